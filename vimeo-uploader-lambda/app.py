@@ -1,25 +1,77 @@
 import json
-import uuid
+import os
 
-from google.protobuf.json_format import MessageToJson
+from google.protobuf.json_format import MessageToJson, ParseDict, ParseError
 
-from core.driver import Driver, get_streaming_platform
-from core.exceptions import VimeoUploaderInternalServerError, VimeoUploaderInvalidVideoIdError
+from core.checkpoints import get_checkpoint_store
+from core.clients import get_lambda_client
+from core.coalescing import RequestCoalescer, get_request_coalescer
+from core.driver import STREAMING_PLATFORMS, Driver, get_download_tuning, get_streaming_platform, get_trim_mode
+from core.exceptions import (
+    VimeoUploaderInternalServerError, VimeoUploaderInvalidRequestError, VimeoUploaderInvalidVideoIdError)
+from core.generated import model_pb2
+from core.jobs import JobProgress, JobStore, create_job, get_job_store, run_job
+from core.metadata_cache import CacheControl, MetadataCache, MetadataStore, get_cache_control, get_metadata_cache
+
+
+def _get_metadata_cache() -> MetadataCache:
+    if os.environ.get('METADATA_CACHE', 'true').lower() == 'true':
+        return get_metadata_cache()
+    return None
+
+
+def _get_checkpoint_store() -> MetadataStore:
+    if os.environ.get('CHECKPOINTS', 'false').lower() == 'true':
+        return get_checkpoint_store()
+    return None
+
+
+def _get_request_coalescer() -> RequestCoalescer:
+    if os.environ.get('COALESCING', 'false').lower() == 'true':
+        return get_request_coalescer()
+    return None
+
+
+def _get_emit_metrics() -> bool:
+    return os.environ.get('METRICS', 'true').lower() == 'true'
+
+
+def _get_extended_result() -> bool:
+    return os.environ.get('EXTENDED_RESULT', 'false').lower() == 'true'
+
+
+def _get_invalid_request_response(error: Exception):
+    return {
+        'statusCode': 400,
+        'headers': {
+            "Content-Type": "application/json"
+        },
+        'body': json.dumps({
+            'error': str(error)
+        })
+    }
 
 
 def handle_get_video_metadata(event, context):
     print(event['queryStringParameters'])
     platform = event['queryStringParameters']['platform']
     video_id = event['queryStringParameters']['video_id']
-    driver = Driver(download_platform=get_streaming_platform(platform))
-    return _handle_get_video_metadata(driver, video_id)
+    try:
+        cache_control = get_cache_control(event['queryStringParameters'].get('cache'))
+    except VimeoUploaderInvalidRequestError as e:
+        return _get_invalid_request_response(e)
+    driver = Driver(
+        download_platform=get_streaming_platform(platform),
+        metadata_cache=_get_metadata_cache())
+    return _handle_get_video_metadata(driver, video_id, cache_control)
 
 
 def _handle_get_video_metadata(
         driver: Driver,
-        video_id: str):
+        video_id: str,
+        cache_control: CacheControl = CacheControl.DEFAULT):
     try:
-        video_metadata = driver.get_video_metadata(video_id)
+        video_metadata = driver.get_video_metadata(video_id, cache_control)
         print(f"Retrieved the video metadata for video id {video_id}")
         return {
             'statusCode': 200,
@@ -50,19 +102,59 @@ def _handle_get_video_metadata(
         }
 
 
+def handle_get_videos_metadata(event, context):
+    print(event['queryStringParameters'])
+    platform = event['queryStringParameters']['platform']
+    video_ids = [video_id for video_id in event['queryStringParameters']['video_ids'].split(',') if video_id]
+    try:
+        cache_control = get_cache_control(event['queryStringParameters'].get('cache'))
+    except VimeoUploaderInvalidRequestError as e:
+        return _get_invalid_request_response(e)
+    driver = Driver(
+        download_platform=get_streaming_platform(platform),
+        metadata_cache=_get_metadata_cache())
+    return _handle_get_videos_metadata(driver, video_ids, cache_control)
+
+
+def _handle_get_videos_metadata(
+        driver: Driver,
+        video_ids: list[str],
+        cache_control: CacheControl = CacheControl.DEFAULT):
+    try:
+        batch_video_metadata_result = driver.get_videos_metadata(video_ids, cache_control)
+        print(f"Retrieved the video metadata for {len(video_ids)} video ids")
+        return {
+            'statusCode': 200,
+            'headers': {
+                "Content-Type": "application/json"
+            },
+            'body': MessageToJson(batch_video_metadata_result)
+        }
+    except VimeoUploaderInternalServerError:
+        return {
+            'statusCode': 500,
+            'headers': {
+                "Content-Type": "application/json"
+            },
+            'body': json.dumps({
+                'error': f"Failed to get metadata with video ids {video_ids} due to some internal server error"
+            })
+        }
+
+
 def handle_process_video_upload(event, context):
     print(event['body'])
-    download_platform = event['body']['download_platform']
-    upload_platform = event['body']['upload_platform']
     video_id = event['body']['video_id']
     start_time_in_sec = event['body']['start_time_in_sec']
     end_time_in_sec = event['body']['end_time_in_sec']
     image_identifier = event['body']['image_identifier']
     title = event['body']['title']
     download = event['body']['download']
-    driver = Driver(
-        get_streaming_platform(download_platform),
-        get_streaming_platform(upload_platform))
+    try:
+        trim_mode = get_trim_mode(event['body'].get('trim_mode'))
+        driver = _create_process_video_driver(event['body'])
+    except VimeoUploaderInvalidRequestError as e:
+        return _get_invalid_request_response(e)
     return _handle_process_video_upload(
         driver,
         video_id,
@@ -70,7 +162,8 @@ def handle_process_video_upload(event, context):
         end_time_in_sec,
         image_identifier,
         title,
-        download)
+        download,
+        trim_mode)
 
 
 def _handle_process_video_upload(
@@ -80,7 +173,8 @@ def _handle_process_video_upload(
         end_time_in_sec: int,
         image_identifier: str,
         title: str,
-        download: bool):
+        download: bool,
+        trim_mode: model_pb2.TrimMode = model_pb2.TRIM_MODE_COPY):
     try:
         video_process_result = driver.process_video(
             video_id,
@@ -88,7 +182,8 @@ def _handle_process_video_upload(
             end_time_in_sec,
             image_identifier,
             title,
-            download)
+            download,
+            trim_mode)
         return {
             'statusCode': 200,
             'headers': {
@@ -108,21 +203,220 @@ def _handle_process_video_upload(
         }
 
 
+def _create_process_video_driver(request: dict) -> Driver:
+    upload_platforms = None
+    if request.get('upload_platforms'):
+        upload_platforms = {platform: get_streaming_platform(platform) for platform in request['upload_platforms']}
+    return Driver(
+        get_streaming_platform(request['download_platform']),
+        get_streaming_platform(request.get('upload_platform')),
+        upload_platforms=upload_platforms,
+        concurrent=os.environ.get('CONCURRENT_PROCESSING', 'false').lower() == 'true',
+        cache_clips=os.environ.get('CLIP_CACHE', 'false').lower() == 'true',
+        stream=os.environ.get('STREAM_PROCESSING', 'false').lower() == 'true',
+        checkpoint_store=_get_checkpoint_store(),
+        coalescer=_get_request_coalescer(),
+        emit_metrics=_get_emit_metrics(),
+        extended_result=_get_extended_result(),
+        download_tuning=get_download_tuning(request.get('download_tuning')))
+
+
+def _validate_process_video_request(request: dict) -> None:
+    missing = [key for key in (
+        'download_platform', 'video_id', 'start_time_in_sec', 'end_time_in_sec', 'image_identifier', 'title', 'download')
+        if key not in request]
+    if missing:
+        raise VimeoUploaderInvalidRequestError(f"Request is missing {', '.join(missing)}")
+    upload_platforms = request.get('upload_platforms') or [request.get('upload_platform')]
+    for platform in [request['download_platform'], *upload_platforms]:
+        if platform not in STREAMING_PLATFORMS:
+            raise VimeoUploaderInvalidRequestError(f"Platform {platform} is not supported")
+    get_trim_mode(request.get('trim_mode'))
+    get_download_tuning(request.get('download_tuning'))
+
+
+def handle_submit_video_job(event, context):
+    print(event['body'])
+    return _handle_submit_video_job(event['body'])
+
+
+def _handle_submit_video_job(request: dict, job_store: JobStore = None):
+    try:
+        _validate_process_video_request(request)
+    except VimeoUploaderInvalidRequestError as e:
+        return _get_invalid_request_response(e)
+    try:
+        job_store = job_store or get_job_store()
+        job_state = create_job(job_store, request)
+        # The worker runs the job in its own invocation, so the caller gets the job id back right away
+        get_lambda_client().invoke(
+            FunctionName=os.environ['JOB_WORKER_FUNCTION_NAME'],
+            InvocationType='Event',
+            Payload=json.dumps({'job_id': job_state.job_id}))
+        print(f"Submitted the job {job_state.job_id}")
+        return {
+            'statusCode': 202,
+            'headers': {
+                "Content-Type": "application/json"
+            },
+            'body': MessageToJson(job_state)
+        }
+    except Exception as e:
+        print(f"Failed to submit the job: {e}")
+        return {
+            'statusCode': 500,
+            'headers': {
+                "Content-Type": "application/json"
+            },
+            'body': json.dumps({
+                'error': "Failed to submit the job due to some internal server error"
+            })
+        }
+
+
+def handle_process_video_job(event, context):
+    print(event)
+    return _handle_process_video_job(event['job_id'])
+
+
+def _handle_process_video_job(job_id: str, job_store: JobStore = None, driver: Driver = None):
+    try:
+        job_store = job_store or get_job_store()
+        job_state = job_store.get(job_id)
+    except Exception as e:
+        # Raised so the asynchronous invocation is retried, and starts the job once the store is reachable
+        print(f"Failed to get the job {job_id}: {e}")
+        raise
+    if job_state is None:
+        print(f"Failed to find the job {job_id}")
+        return None
+    request = json.loads(job_state.request)
+
+    def run(progress: JobProgress) -> model_pb2.VideoProcessResult:
+        # Built within the job, so a request the driver cannot be built for fails the job rather than the invocation
+        job_driver = driver or _create_process_video_driver(request)
+        return job_driver.process_video(
+            request['video_id'],
+            request['start_time_in_sec'],
+            request['end_time_in_sec'],
+            request['image_identifier'],
+            request['title'],
+            request['download'],
+            get_trim_mode(request.get('trim_mode')),
+            progress=progress)
+
+    job_state = run_job(job_store, job_state, run)
+    return MessageToJson(job_state)
+
+
+def handle_get_video_job(event, context):
+    print(event['queryStringParameters'])
+    job_id = event['queryStringParameters']['job_id']
+    return _handle_get_video_job(job_id)
+
+
+def _handle_get_video_job(job_id: str, job_store: JobStore = None):
+    try:
+        job_store = job_store or get_job_store()
+        job_state = job_store.get(job_id)
+    except Exception as e:
+        print(f"Failed to get the job {job_id}: {e}")
+        return {
+            'statusCode': 500,
+            'headers': {
+                "Content-Type": "application/json"
+            },
+            'body': json.dumps({
+                'error': f"Failed to get the job with id {job_id} due to some internal server error"
+            })
+        }
+    if job_state is None:
+        return {
+            'statusCode': 404,
+            'headers': {
+                "Content-Type": "application/json"
+            },
+            'body': json.dumps({
+                'error': f"Failed to get the job with id {job_id} because it does not exist"
+            })
+        }
+    return {
+        'statusCode': 200,
+        'headers': {
+            "Content-Type": "application/json"
+        },
+        'body': MessageToJson(job_state)
+    }
+
+
+def handle_process_video_clips_upload(event, context):
+    print(event['body'])
+    try:
+        download_platform = event['body']['download_platform']
+        upload_platform = event['body']['upload_platform']
+        video_id = event['body']['video_id']
+        clips = [ParseDict(clip, model_pb2.Clip()) for clip in event['body']['clips']]
+        trim_mode = get_trim_mode(event['body'].get('trim_mode'))
+        download_tuning = get_download_tuning(event['body'].get('download_tuning'))
+    except KeyError as e:
+        return _get_invalid_request_response(VimeoUploaderInvalidRequestError(f"Request is missing {e.args[0]}"))
+    except ParseError as e:
+        return _get_invalid_request_response(VimeoUploaderInvalidRequestError(f"Clip is invalid: {e}"))
+    except VimeoUploaderInvalidRequestError as e:
+        return _get_invalid_request_response(e)
+    driver = Driver(
+        get_streaming_platform(download_platform),
+        get_streaming_platform(upload_platform),
+        emit_metrics=_get_emit_metrics(),
+        extended_result=_get_extended_result(),
+        download_tuning=download_tuning)
+    return _handle_process_video_clips_upload(
+        driver,
+        video_id,
+        clips,
+        trim_mode)
+
+
+def _handle_process_video_clips_upload(
+        driver: Driver,
+        video_id: str,
+        clips: list[model_pb2.Clip],
+        trim_mode: model_pb2.TrimMode = model_pb2.TRIM_MODE_COPY):
+    try:
+        batch_video_process_result = driver.process_clips(
+            video_id,
+            clips,
+            trim_mode)
+        return {
+            'statusCode': 200,
+            'headers': {
+                "Content-Type": "application/json"
+            },
+            'body': MessageToJson(batch_video_process_result)
+        }
+    except VimeoUploaderInternalServerError:
+        return {
+            'statusCode': 500,
+            'headers': {
+                "Content-Type": "application/json"
+            },
+            'body': json.dumps({
+                'error': f"Failed to process the clips of video with id {video_id} due to some internal server error"
+            })
+        }
+
+
 def handle_upload_thumbnail_image(event, context):
     data = event['body']
     driver = Driver()
-    return _handle_upload_thumbnail_image(
-        driver, '/tmp', str(uuid.uuid4()), data)
+    return _handle_upload_thumbnail_image(driver, data)
 
 
 def _handle_upload_thumbnail_image(
         driver: Driver,
-        root_path: str,
-        object_key: str,
         object_content: str):
     try:
-        thumbnail_upload_result = driver.upload_thumbnail_image_to_s3(
-            root_path, object_key, object_content)
+        thumbnail_upload_result = driver.upload_thumbnail_image_to_s3(object_content)
         return {
             'statusCode': 200,
             'headers': {
@@ -137,6 +431,6 @@ def _handle_upload_thumbnail_image(
                 "Content-Type": "application/json"
             },
             'body': json.dumps({
-                'error': f"Failed to upload the image with key {object_key} at root path {root_path} due to some internal server error"
+                'error': "Failed to upload the image due to some internal server error"
             })
         }
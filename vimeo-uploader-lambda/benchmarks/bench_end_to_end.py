@@ -0,0 +1,475 @@
+"""
+Benchmark the handlers end to end on synthetic videos: the latency of get_video_metadata, process_video and the
+thumbnail upload, with the peak bytes in the scratch space and the peak RSS of each run.
+
+The videos are generated with ffmpeg at each resolution, as separate video-only and audio-only formats like YouTube
+serves them, and read by yt-dlp from a local HTTP server answering byte ranges. S3 is a local moto server
+(pip install "moto[server]"), and Vimeo a local stand-in of its API and tus upload links. Results are printed as JSON,
+with the commit they were measured at, so runs can be compared across commits.
+
+Run from the lambda directory with ffmpeg on the path:
+    python -m benchmarks.bench_end_to_end --duration 600 --heights 360 720 1080 --output results.json
+"""
+import argparse
+import base64
+import contextlib
+import json
+import logging
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from functools import partial
+from http.server import BaseHTTPRequestHandler, SimpleHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import yt_dlp
+from google.protobuf.json_format import MessageToDict
+from yt_dlp.extractor.common import InfoExtractor
+
+from benchmarks.bench_s3_transfer import start_moto_server
+from core.clients import create_s3_client
+from core.driver import Driver, get_trim_mode
+from core.metrics import get_peak_rss
+from core.scratch import ScratchSpace
+from core.vimeo_platform import VimeoPlatform
+from core.vimeo_session import VimeoSession
+from core.youtube_platform import YouTubePlatform
+
+VIDEO_BUCKET_NAME = "bench-videos"
+THUMBNAIL_BUCKET_NAME = "bench-thumbnails"
+# Interval of sampling the bytes in the scratch space, in seconds
+SCRATCH_SAMPLE_INTERVAL_IN_SEC = 0.05
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """
+    Static file handler answering single byte range requests, which ffmpeg sends to seek into the sources
+    """
+
+    def send_head(self):
+        self.range_length = None
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if not match:
+            return super().send_head()
+        path = self.translate_path(self.path)
+        try:
+            file = open(path, 'rb')
+        except OSError:
+            self.send_error(404)
+            return None
+        size = os.fstat(file.fileno()).st_size
+        start = int(match[1])
+        end = min(int(match[2]) if match[2] else size - 1, size - 1)
+        if start >= size:
+            file.close()
+            self.send_error(416)
+            return None
+        self.send_response(206)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        file.seek(start)
+        self.range_length = end - start + 1
+        return file
+
+    def copyfile(self, source, outputfile):
+        remaining = self.range_length
+        try:
+            if remaining is None:
+                return super().copyfile(source, outputfile)
+            while remaining > 0:
+                chunk = source.read(min(COPY_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                outputfile.write(chunk)
+                remaining -= len(chunk)
+        except ConnectionError:
+            # ffmpeg drops the connection once it has read the section it needs
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeVimeoHandler(BaseHTTPRequestHandler):
+    """
+    Stand-in of the Vimeo API and its tus upload links, which counts the received bytes without keeping them
+    """
+    protocol_version = 'HTTP/1.1'
+    offsets: dict = {}
+    lock = threading.Lock()
+
+    def do_POST(self):
+        self._read_body()
+        path = self.path.split('?')[0]
+        if path == '/me/videos':
+            video_id = uuid.uuid4().hex
+            with self.lock:
+                self.offsets[video_id] = 0
+            self._send_json({
+                'uri': f'/videos/{video_id}',
+                'link': f'https://vimeo.com/{video_id}',
+                'upload': {'upload_link': f'{self._get_root()}/upload/{video_id}'},
+                'metadata': {'connections': {'pictures': {'uri': f'/videos/{video_id}/pictures'}}},
+            })
+        else:
+            self._send_json({'uri': f'{path}/1', 'link': f'{self._get_root()}/picture'})
+
+    def do_PATCH(self):
+        size = self._read_body()
+        if self.path.startswith('/upload/'):
+            video_id = self.path.split('/')[-1]
+            with self.lock:
+                self.offsets[video_id] += size
+                offset = self.offsets[video_id]
+            self._send_empty(204, {'Upload-Offset': str(offset)})
+        else:
+            self._send_json({})
+
+    def do_HEAD(self):
+        with self.lock:
+            offset = self.offsets.get(self.path.split('/')[-1], 0)
+        self._send_empty(200, {'Upload-Offset': str(offset)})
+
+    def do_PUT(self):
+        self._read_body()
+        self._send_json({})
+
+    def log_message(self, format, *args):
+        pass
+
+    def _get_root(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _read_body(self) -> int:
+        remaining = size = int(self.headers.get('Content-Length', 0))
+        while remaining > 0:
+            remaining -= len(self.rfile.read(min(COPY_CHUNK_SIZE, remaining)))
+        return size
+
+    def _send_json(self, body: dict) -> None:
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_empty(self, status: int, headers: dict) -> None:
+        self.send_response(status)
+        for name, value in {**headers, 'Content-Length': '0'}.items():
+            self.send_header(name, value)
+        self.end_headers()
+
+
+class LocalSourceIE(InfoExtractor):
+    """
+    Extractor of the synthetic videos, reading the info of each video from the local source
+    """
+    _VALID_URL = r'(?P<root>http://127\.0\.0\.1:\d+)/watch\?v=(?P<id>[\w-]+)'
+
+    def _real_extract(self, url):
+        root, video_id = self._match_valid_url(url).group('root', 'id')
+        return self._download_json(f"{root}/{video_id}.info.json", video_id)
+
+
+class LocalYoutubeDL(yt_dlp.YoutubeDL):
+    """
+    YoutubeDL trying the local source before the generic extractor, which takes any URL
+    """
+
+    def add_default_info_extractors(self):
+        self.add_info_extractor(LocalSourceIE())
+        super().add_default_info_extractors()
+
+
+class LocalYouTubePlatform(YouTubePlatform):
+    """
+    YouTube platform reading the synthetic videos from the local source
+    """
+
+    def __init__(self, source_root: str) -> None:
+        super().__init__()
+        self.source_root = source_root
+
+    def _get_youtube_url(self, video_id: str) -> str:
+        return f"{self.source_root}/watch?v={video_id}"
+
+
+def start_server(handler) -> tuple[ThreadingHTTPServer, str]:
+    """
+    Start an HTTP server on a free local port
+    :param handler: Request handler of the server
+    :return: Server, and its root URL
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def generate_source(source_path: str, source_root: str, height: int, duration_in_sec: int) -> str:
+    """
+    Generate a synthetic video as separate video-only and audio-only formats, with the info the extractor reads
+    :param source_path: Directory served by the local source
+    :param source_root: Root URL of the local source
+    :param height: Height of the video in pixels
+    :param duration_in_sec: Length of the video in seconds
+    :return: ID of the video
+    """
+    video_id = f"synthetic-{height}p"
+    width = height * 16 // 9 // 2 * 2
+    video_file_name = f"{video_id}.video.mp4"
+    audio_file_name = f"{video_id}.audio.m4a"
+    subprocess.run([
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size={width}x{height}:rate=30:duration={duration_in_sec}',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '60', '-movflags', '+faststart',
+        os.path.join(source_path, video_file_name)], check=True)
+    subprocess.run([
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration_in_sec}',
+        '-c:a', 'aac', '-movflags', '+faststart', os.path.join(source_path, audio_file_name)], check=True)
+    info = {
+        'id': video_id,
+        'title': f"Synthetic {height}p",
+        'uploader': "Benchmark",
+        'duration': duration_in_sec,
+        'upload_date': '20240101',
+        'formats': [{
+            'format_id': f'{height}p',
+            'url': f"{source_root}/{video_file_name}",
+            'ext': 'mp4',
+            'vcodec': 'avc1.64001f',
+            'acodec': 'none',
+            'width': width,
+            'height': height,
+            'filesize': os.path.getsize(os.path.join(source_path, video_file_name)),
+        }, {
+            'format_id': 'audio',
+            'url': f"{source_root}/{audio_file_name}",
+            'ext': 'm4a',
+            'vcodec': 'none',
+            'acodec': 'mp4a.40.2',
+            'filesize': os.path.getsize(os.path.join(source_path, audio_file_name)),
+        }],
+    }
+    with open(os.path.join(source_path, f"{video_id}.info.json"), 'w') as file:
+        json.dump(info, file)
+    return video_id
+
+
+def generate_thumbnail(root_path: str) -> bytes:
+    """
+    Generate a synthetic thumbnail image
+    :param root_path: Directory for the image
+    :return: Content of the image
+    """
+    image_path = os.path.join(root_path, 'thumbnail.jpg')
+    subprocess.run([
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', 'testsrc2=size=1280x720', '-frames:v', '1', image_path], check=True)
+    with open(image_path, 'rb') as file:
+        return file.read()
+
+
+def get_directory_size(path: str) -> int:
+    """
+    :param path: Path of a directory
+    :return: Total size of the files in the directory
+    """
+    size = 0
+    for directory, _, file_names in os.walk(path):
+        for file_name in file_names:
+            try:
+                size += os.path.getsize(os.path.join(directory, file_name))
+            except OSError:
+                # Intermediate files come and go while they are sampled
+                pass
+    return size
+
+
+def measure(run, scratch_path: str = None) -> dict:
+    """
+    Run once, sampling the bytes in the scratch space meanwhile
+    :param run: Function to measure
+    :param scratch_path: Directory of the scratch space, or None to not sample it
+    :return: Latency, peak bytes in the scratch space, peak RSS after the run, and the result of the run
+    """
+    peak_scratch_bytes = 0
+    done = threading.Event()
+
+    def sample():
+        nonlocal peak_scratch_bytes
+        while not done.wait(SCRATCH_SAMPLE_INTERVAL_IN_SEC):
+            peak_scratch_bytes = max(peak_scratch_bytes, get_directory_size(scratch_path))
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    if scratch_path:
+        sampler.start()
+    start = time.perf_counter()
+    try:
+        result = run()
+    finally:
+        latency = time.perf_counter() - start
+        done.set()
+        if scratch_path:
+            sampler.join()
+    return {
+        'latency_in_sec': round(latency, 3),
+        'peak_scratch_bytes': peak_scratch_bytes,
+        'peak_rss_in_bytes': get_peak_rss(),
+        'result': result,
+    }
+
+
+def summarize(runs: list[dict]) -> dict:
+    """
+    :param runs: Measures of the runs of a case
+    :return: Latencies of the runs, and the peaks of the slowest run
+    """
+    latencies = [run['latency_in_sec'] for run in runs]
+    return {
+        'min_in_sec': min(latencies),
+        'median_in_sec': round(statistics.median(latencies), 3),
+        'peak_scratch_bytes': max(run['peak_scratch_bytes'] for run in runs),
+        'peak_rss_in_bytes': max(run['peak_rss_in_bytes'] for run in runs),
+    }
+
+
+def get_commit() -> str:
+    """
+    :return: Commit of the working tree, or None outside of a git repository
+    """
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_cases(args: argparse.Namespace, root_path: str, endpoint_url: str, source_root: str, vimeo_root: str) -> dict:
+    """
+    Measure the thumbnail upload, then the metadata lookup and the processing of a video at each resolution
+    :param args: Arguments of the benchmark
+    :param root_path: Directory of the benchmark, with the served sources and the scratch space
+    :param endpoint_url: Endpoint of the S3 stand-in
+    :param source_root: Root URL of the local source
+    :param vimeo_root: Root URL of the Vimeo stand-in
+    :return: Results of the cases
+    """
+    source_path = os.path.join(root_path, 'source')
+    scratch_path = os.path.join(root_path, 'scratch')
+    s3_client = create_s3_client(endpoint_url=endpoint_url)
+    for bucket_name in (VIDEO_BUCKET_NAME, THUMBNAIL_BUCKET_NAME):
+        s3_client.create_bucket(Bucket=bucket_name)
+    upload_platform = VimeoPlatform(VimeoSession('bench', api_root=vimeo_root))
+    scratch_space = ScratchSpace(scratch_path, reserved_bytes=0)
+    results = {'videos': {}}
+
+    # The same image is uploaded twice, the second upload finds it on S3 by the hash of its content
+    image_content = base64.b64encode(generate_thumbnail(root_path)).decode('utf-8')
+    driver = Driver(s3_client=s3_client)
+    first = measure(lambda: driver.upload_thumbnail_image_to_s3(image_content))
+    repeat = measure(lambda: driver.upload_thumbnail_image_to_s3(image_content))
+    image_identifier = first['result'].object_key
+    results['thumbnail_upload'] = {
+        'bytes': len(base64.b64decode(image_content)),
+        'first_in_sec': first['latency_in_sec'],
+        'repeat_in_sec': repeat['latency_in_sec'],
+    }
+
+    with mock.patch.object(yt_dlp, 'YoutubeDL', LocalYoutubeDL):
+        for height in args.heights:
+            video_id = generate_source(source_path, source_root, height, args.duration)
+            video_results = results['videos'][f'{height}p'] = {
+                'source_bytes': sum(
+                    os.path.getsize(os.path.join(source_path, name))
+                    for name in os.listdir(source_path) if name.startswith(f"{video_id}.")),
+            }
+
+            # The first lookup extracts the video, and the next one reuses the extraction
+            download_platform = LocalYouTubePlatform(source_root)
+            driver = Driver(download_platform=download_platform)
+            cold = measure(lambda: driver.get_video_metadata(video_id))
+            warm = measure(lambda: driver.get_video_metadata(video_id))
+            video_results['get_video_metadata'] = {
+                'cold_in_sec': cold['latency_in_sec'],
+                'warm_in_sec': warm['latency_in_sec'],
+            }
+
+            start_time_in_sec = args.duration // 2
+            end_time_in_sec = start_time_in_sec + args.clip
+            driver = Driver(
+                download_platform, upload_platform, s3_client, concurrent=True, scratch_space=scratch_space,
+                extended_result=True)
+            for trim_mode in args.trim_modes:
+                runs = [measure(lambda: driver.process_video(
+                    video_id, start_time_in_sec, end_time_in_sec, image_identifier, f"{video_id} {trim_mode}",
+                    True, get_trim_mode(trim_mode)), scratch_path) for _ in range(args.runs)]
+                video_results[f'process_video_{trim_mode}'] = {
+                    **summarize(runs),
+                    'download_result': MessageToDict(runs[-1]['result'].download_result),
+                    'stage_metrics': [
+                        MessageToDict(stage_metrics) for stage_metrics in runs[-1]['result'].stage_metrics],
+                }
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=int, default=600, help='Length of the synthetic videos in seconds')
+    parser.add_argument('--heights', type=int, nargs='+', default=[360, 720, 1080], help='Resolutions of the videos')
+    parser.add_argument('--clip', type=int, default=60, help='Length of the processed clip in seconds')
+    parser.add_argument('--trim-modes', nargs='+', default=['copy', 'smart'], help='Trim modes processed')
+    parser.add_argument('--runs', type=int, default=3, help='Number of runs measured per case')
+    parser.add_argument('--output', help='Path of a file the results are also written to')
+    args = parser.parse_args()
+
+    ffmpeg_version = subprocess.run(['ffmpeg', '-version'], check=True, capture_output=True, text=True).stdout
+    results = {
+        'commit': get_commit(),
+        'ffmpeg': ffmpeg_version.splitlines()[0],
+        'cpu_count': os.cpu_count(),
+        'duration_in_sec': args.duration,
+        'clip_in_sec': args.clip,
+    }
+    root_path = tempfile.mkdtemp(prefix='bench-end-to-end-')
+    os.makedirs(os.path.join(root_path, 'source'))
+    os.environ['S3_VIDEO_BUCKET_NAME'] = VIDEO_BUCKET_NAME
+    os.environ['S3_THUMBNAIL_BUCKET_NAME'] = THUMBNAIL_BUCKET_NAME
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    moto_server, endpoint_url = start_moto_server()
+    source_server, source_root = start_server(
+        partial(RangeRequestHandler, directory=os.path.join(root_path, 'source')))
+    vimeo_server, vimeo_root = start_server(FakeVimeoHandler)
+    try:
+        # Only the results are printed to stdout, the output of the handlers goes to stderr
+        with contextlib.redirect_stdout(sys.stderr):
+            results.update(run_cases(args, root_path, endpoint_url, source_root, vimeo_root))
+    finally:
+        source_server.shutdown()
+        vimeo_server.shutdown()
+        moto_server.stop()
+        shutil.rmtree(root_path, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+
+
+if __name__ == '__main__':
+    main()
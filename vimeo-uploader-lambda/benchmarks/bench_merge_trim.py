@@ -0,0 +1,99 @@
+"""
+Benchmark merging and trimming the downloaded video/audio, comparing the merge-then-trim path (two passes over the
+merged file) with the single pass merge+trim post processor.
+
+Run from the lambda directory with ffmpeg on the path:
+    python -m benchmarks.bench_merge_trim --duration 1800 --start 900 --end 960
+"""
+import argparse
+import json
+import os
+import subprocess
+import tempfile
+import time
+
+from yt_dlp.postprocessor.ffmpeg import FFmpegMergerPP
+
+from core.youtube_platform import YouTubePlatform
+
+FORMATS = [
+    {'format_id': 'video', 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'none', 'protocol': 'https'},
+    {'format_id': 'audio', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a', 'protocol': 'https'},
+]
+
+
+def generate_inputs(root_path: str, duration_in_sec: int) -> list[str]:
+    """
+    Generate separate synthetic video-only and audio-only inputs, as yt-dlp downloads them
+    :param root_path: Directory for the inputs
+    :param duration_in_sec: Length of the inputs in seconds
+    :return: Paths of the video and audio inputs
+    """
+    video_path = os.path.join(root_path, 'input.fvideo.mp4')
+    audio_path = os.path.join(root_path, 'input.faudio.m4a')
+    subprocess.run([
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size=1280x720:rate=30:duration={duration_in_sec}',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '60', video_path], check=True)
+    subprocess.run([
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration_in_sec}',
+        '-c:a', 'aac', audio_path], check=True)
+    return [video_path, audio_path]
+
+
+def run_two_pass(files_to_merge: list[str], output_path: str, start_time_in_sec: int, end_time_in_sec: int) -> int:
+    """
+    Merge the inputs into a full-length file and trim it afterwards, as yt-dlp with FFmpegTrimPP does
+    :return: Peak bytes on disk, excluding the inputs
+    """
+    information = {
+        'filepath': output_path,
+        'requested_formats': FORMATS,
+        '__files_to_merge': files_to_merge,
+    }
+    FFmpegMergerPP().run({**information, '__files_to_merge': list(files_to_merge)})
+    merged_size = os.path.getsize(output_path)
+    YouTubePlatform.FFmpegTrimPP(start_time_in_sec, end_time_in_sec).run(information)
+    # The trimmed copy is written next to the merged file before replacing it
+    return merged_size + os.path.getsize(output_path)
+
+
+def run_single_pass(files_to_merge: list[str], output_path: str, start_time_in_sec: int, end_time_in_sec: int) -> int:
+    """
+    Merge and trim the inputs straight into the output file
+    :return: Peak bytes on disk, excluding the inputs
+    """
+    YouTubePlatform.FFmpegMergeTrimPP(start_time_in_sec, end_time_in_sec).run({
+        'filepath': output_path,
+        'requested_formats': FORMATS,
+        '__files_to_merge': files_to_merge,
+    })
+    return os.path.getsize(output_path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--duration', type=int, default=1800, help='Length of the synthetic input in seconds')
+    parser.add_argument('--start', type=int, default=900, help='Start time of trim in seconds')
+    parser.add_argument('--end', type=int, default=960, help='End time of trim in seconds')
+    args = parser.parse_args()
+
+    results = {'duration_in_sec': args.duration, 'start_time_in_sec': args.start, 'end_time_in_sec': args.end}
+    with tempfile.TemporaryDirectory() as root_path:
+        files_to_merge = generate_inputs(root_path, args.duration)
+        results['input_bytes'] = sum(os.path.getsize(path) for path in files_to_merge)
+        for name, run in (('two_pass', run_two_pass), ('single_pass', run_single_pass)):
+            output_path = os.path.join(root_path, f'{name}.mkv')
+            start = time.perf_counter()
+            peak_bytes = run(files_to_merge, output_path, args.start, args.end)
+            results[name] = {
+                'wall_time_in_sec': round(time.perf_counter() - start, 3),
+                'peak_output_bytes': peak_bytes,
+                'output_bytes': os.path.getsize(output_path),
+            }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark uploading and downloading clips to S3, comparing the boto3 defaults (default client and transfer config) with
+the transfer config tuned to the file size and vCPUs, and the pooled client.
+
+By default the transfers go to a local moto server (pip install "moto[server]"). With --endpoint-url, they go to
+another S3 stand-in such as MinIO, which needs the bucket to exist and the credentials in the environment.
+
+Run from the lambda directory:
+    python -m benchmarks.bench_s3_transfer --sizes 16 256 1024
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import boto3
+
+from core.clients import create_s3_client
+from core.s3_transfer import MIB, S3Transfer
+
+BUCKET_NAME = "bench-s3-transfer"
+
+
+def start_moto_server():
+    """
+    Start a moto server standing in for S3 on a free local port
+    :return: Server, and its endpoint URL
+    """
+    from moto.server import ThreadedMotoServer
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    server = ThreadedMotoServer(port=0, verbose=False)
+    server.start()
+    host, port = server.get_host_and_port()
+    return server, f"http://{host}:{port}"
+
+
+def run_default(endpoint_url: str, file_path: str, object_key: str) -> tuple[float, float]:
+    """
+    Upload and download the file with a default client and transfer config, as the driver did
+    :return: Upload and download time in seconds
+    """
+    s3_client = boto3.client('s3', endpoint_url=endpoint_url)
+    start = time.perf_counter()
+    s3_client.upload_file(file_path, BUCKET_NAME, object_key)
+    uploaded = time.perf_counter()
+    s3_client.download_file(BUCKET_NAME, object_key, f"{file_path}.download")
+    return uploaded - start, time.perf_counter() - uploaded
+
+
+def run_tuned(endpoint_url: str, file_path: str, object_key: str) -> tuple[float, float]:
+    """
+    Upload and download the file with the pooled client and the transfer config tuned to its size
+    :return: Upload and download time in seconds
+    """
+    s3_transfer = S3Transfer(create_s3_client(endpoint_url=endpoint_url))
+    upload_metrics = s3_transfer.upload_file(file_path, BUCKET_NAME, object_key)
+    download_metrics = s3_transfer.download_file(
+        BUCKET_NAME, object_key, f"{file_path}.download", os.path.getsize(file_path))
+    return upload_metrics['duration_in_sec'], download_metrics['duration_in_sec']
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[16, 256, 1024], help='Sizes of the files in MiB')
+    parser.add_argument('--runs', type=int, default=3, help='Number of transfers measured per size')
+    parser.add_argument('--endpoint-url', help='Endpoint of the S3 stand-in, or none to start a moto server')
+    args = parser.parse_args()
+
+    server = None
+    endpoint_url = args.endpoint_url
+    if not endpoint_url:
+        server, endpoint_url = start_moto_server()
+        boto3.client('s3', endpoint_url=endpoint_url).create_bucket(Bucket=BUCKET_NAME)
+
+    results = {'cpu_count': os.cpu_count()}
+    try:
+        with tempfile.TemporaryDirectory() as root_path:
+            for size in args.sizes:
+                file_path = os.path.join(root_path, f'{size}.bin')
+                with open(file_path, 'wb') as file:
+                    for _ in range(size):
+                        file.write(os.urandom(MIB))
+                results[f'{size}_mib'] = {}
+                for name, run in (('default', run_default), ('tuned', run_tuned)):
+                    timings = [run(endpoint_url, file_path, f'{name}/{size}') for _ in range(args.runs)]
+                    upload_time = min(timing[0] for timing in timings)
+                    download_time = min(timing[1] for timing in timings)
+                    results[f'{size}_mib'][name] = {
+                        'upload_in_sec': round(upload_time, 3),
+                        'upload_in_mib_per_sec': round(size / upload_time, 1),
+                        'download_in_sec': round(download_time, 3),
+                        'download_in_mib_per_sec': round(size / download_time, 1),
+                    }
+                os.remove(file_path)
+                os.remove(f"{file_path}.download")
+    finally:
+        if server:
+            server.stop()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
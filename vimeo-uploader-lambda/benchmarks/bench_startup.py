@@ -0,0 +1,104 @@
+"""
+Benchmark the cold start of each lambda handler: the time to import app.py, and the latency of the first call, each
+measured in a fresh interpreter as a new container would.
+
+By default the first call only covers the setup each handler does before its first network request (creating the
+platforms and clients it uses), so it runs anywhere. With --live, the handlers are invoked with the events of
+benchmarks/events, which requires network access and the ENV variables of the lambda functions.
+
+Run from the lambda directory:
+    python -m benchmarks.bench_startup --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Modules which are expensive to import, and should only be loaded by the handlers which need them
+HEAVY_MODULES = ['boto3', 'botocore.client', 'yt_dlp', 'requests']
+
+# Setup done by each handler before its first network request
+HANDLER_SETUP = {
+    'get-video-metadata': (
+        "driver = app.Driver(download_platform=app.get_streaming_platform('youtube'), "
+        "metadata_cache=app._get_metadata_cache())"),
+    'get-videos-metadata': (
+        "driver = app.Driver(download_platform=app.get_streaming_platform('youtube'), "
+        "metadata_cache=app._get_metadata_cache())"),
+    'process-video': (
+        "driver = app.Driver(app.get_streaming_platform('youtube'), app.get_streaming_platform('vimeo')); "
+        "driver.s3_client"),
+    'process-video-clips': (
+        "driver = app.Driver(app.get_streaming_platform('youtube'), app.get_streaming_platform('vimeo')); "
+        "driver.s3_client"),
+    'upload-thumbnail-image': "driver = app.Driver(); driver.s3_client",
+    'get-video-job': "app.get_job_store()",
+}
+
+HANDLER_FUNCTIONS = {
+    'get-video-metadata': 'handle_get_video_metadata',
+    'get-videos-metadata': 'handle_get_videos_metadata',
+    'process-video': 'handle_process_video_upload',
+    'process-video-clips': 'handle_process_video_clips_upload',
+    'upload-thumbnail-image': 'handle_upload_thumbnail_image',
+    'get-video-job': 'handle_get_video_job',
+}
+
+MEASURE = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+loaded_after_import = [m for m in {heavy_modules!r} if m in sys.modules]
+{first_call}
+called = time.perf_counter()
+print(json.dumps({{
+    'import_in_ms': (imported - start) * 1000,
+    'first_call_in_ms': (called - imported) * 1000,
+    'loaded_after_import': loaded_after_import,
+    'loaded_after_first_call': [m for m in {heavy_modules!r} if m in sys.modules],
+}}))
+"""
+
+
+def measure(handler: str, live: bool) -> dict:
+    """
+    Measure the cold start of the handler in a fresh interpreter
+    :param handler: Name of the lambda function
+    :param live: True if the handler should be invoked, false to only run its setup
+    :return: Timings in milliseconds, and the heavy modules loaded
+    """
+    if live:
+        with open(os.path.join(os.path.dirname(__file__), 'events', f'{handler}.json')) as file:
+            event = json.load(file)
+        first_call = f"app.{HANDLER_FUNCTIONS[handler]}({event!r}, None)"
+    else:
+        first_call = HANDLER_SETUP[handler]
+    output = subprocess.run(
+        [sys.executable, '-c', MEASURE.format(heavy_modules=HEAVY_MODULES, first_call=first_call)],
+        check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5, help='Number of cold starts measured per handler')
+    parser.add_argument('--live', action='store_true', help='Invoke the handlers with the events of benchmarks/events')
+    args = parser.parse_args()
+
+    results = {}
+    for handler in HANDLER_SETUP:
+        runs = [measure(handler, args.live) for _ in range(args.runs)]
+        results[handler] = {
+            'import_in_ms': round(statistics.median(run['import_in_ms'] for run in runs), 1),
+            'first_call_in_ms': round(statistics.median(run['first_call_in_ms'] for run in runs), 1),
+            'loaded_after_import': runs[0]['loaded_after_import'],
+            'loaded_after_first_call': runs[0]['loaded_after_first_call'],
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
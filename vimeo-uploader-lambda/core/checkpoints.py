@@ -0,0 +1,172 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+from core.clients import get_s3_client
+from core.generated import model_pb2
+from core.metadata_cache import LocalMetadataStore, MetadataStore, S3MetadataStore
+from core.scratch import get_scratch_space
+
+# Name of the local store of the checkpoints in the scratch space
+CHECKPOINT_STORE_NAME: str = "checkpoints"
+# Checkpoints older than this are ignored, as the tus upload links of Vimeo expire after a day
+CHECKPOINT_TTL_IN_SEC: int = 24 * 3600
+# Size of each read when hashing an artifact
+HASH_CHUNK_SIZE: int = 1024 * 1024
+
+
+def get_checkpoint_key(video_id: str, start_time_in_sec: int, end_time_in_sec: int, options: dict) -> str:
+    """
+    Get the key of the checkpoint of a request, the same for every retry of the request.
+
+    :param video_id: ID of the video
+    :param start_time_in_sec: Start time of trim in seconds
+    :param end_time_in_sec: End time of trim in seconds
+    :param options: Options the clip is processed with, such as the trim mode
+    :return: Key of the checkpoint
+    """
+    request = json.dumps([video_id, start_time_in_sec, end_time_in_sec, options], sort_keys=True)
+    return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+
+def get_file_sha256(file_path: str) -> str:
+    """
+    :param file_path: Path of the file
+    :return: SHA-256 hash of the content of the file
+    """
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class StageCheckpointer:
+    """
+    Checkpoint of a single stage, saved with the checkpoint of the request whenever the stage updates it.
+    """
+
+    def __init__(self, checkpointer: 'Checkpointer', stage: str) -> None:
+        self.checkpointer = checkpointer
+        self.stage = stage
+
+    def get(self) -> model_pb2.StageCheckpoint:
+        """
+        :return: Copy of the checkpoint of the stage
+        """
+        return self.checkpointer.get(self.stage)
+
+    def update(self, **fields) -> None:
+        """
+        Set the fields of the checkpoint of the stage, and save it.
+
+        :param fields: Fields of the checkpoint, with attributes merged into the existing ones
+        """
+        with self.checkpointer.lock:
+            state = self.checkpointer.checkpoint.stages[self.stage]
+            for name, value in fields.items():
+                if name == 'attributes':
+                    state.attributes.update(value)
+                else:
+                    setattr(state, name, value)
+            self.checkpointer.save()
+
+    def reset(self) -> None:
+        """
+        Forget the progress of the stage, keeping the inputs it is for.
+        """
+        with self.checkpointer.lock:
+            state = self.checkpointer.checkpoint.stages[self.stage]
+            state.CopyFrom(model_pb2.StageCheckpoint(inputs_sha256=state.inputs_sha256))
+            self.checkpointer.save()
+
+
+class Checkpointer:
+    """
+    Durable checkpoint of the stages of a request, so a retry of the request resumes from the first incomplete stage
+    rather than starting over. Checkpoints are an optimization, a failure to save one does not fail the request.
+    """
+
+    def __init__(self, store: MetadataStore, key: str, ttl_in_sec: int = CHECKPOINT_TTL_IN_SEC) -> None:
+        """
+        :param store: Store of the checkpoints
+        :param key: Key of the checkpoint of the request
+        :param ttl_in_sec: Time to live of the checkpoint in seconds
+        """
+        self.store = store
+        self.key = key
+        self.lock = threading.Lock()
+        self.checkpoint = model_pb2.Checkpoint(key=key)
+        try:
+            value = store.get(key)
+        except Exception as e:
+            logging.warning("Failed to load the checkpoint %s: %s", key, e)
+            value = None
+        if value:
+            checkpoint = model_pb2.Checkpoint.FromString(value)
+            if time.time() - checkpoint.updated_at < ttl_in_sec:
+                self.checkpoint = checkpoint
+                logging.info("Resuming from checkpoint %s with stages %s", key, [
+                    stage for stage, state in checkpoint.stages.items() if state.completed])
+
+    def get(self, stage: str) -> model_pb2.StageCheckpoint:
+        """
+        :param stage: Name of the stage
+        :return: Copy of the checkpoint of the stage, empty if the stage has none
+        """
+        with self.lock:
+            state = model_pb2.StageCheckpoint()
+            if stage in self.checkpoint.stages:
+                state.CopyFrom(self.checkpoint.stages[stage])
+            return state
+
+    def stage(self, stage: str, inputs: dict = None) -> StageCheckpointer:
+        """
+        Get the checkpoint of the stage, discarding it if it was made with other inputs.
+
+        :param stage: Name of the stage
+        :param inputs: Inputs of the stage beyond the request, such as the title of the uploaded video
+        :return: Checkpoint of the stage
+        """
+        inputs_sha256 = hashlib.sha256(json.dumps(inputs or {}, sort_keys=True).encode('utf-8')).hexdigest()
+        with self.lock:
+            state = self.checkpoint.stages[stage]
+            if state.inputs_sha256 != inputs_sha256:
+                state.CopyFrom(model_pb2.StageCheckpoint(inputs_sha256=inputs_sha256))
+        return StageCheckpointer(self, stage)
+
+    def save(self) -> None:
+        """
+        Save the checkpoint, with the lock held.
+        """
+        self.checkpoint.updated_at = int(time.time())
+        try:
+            self.store.put(self.key, self.checkpoint.SerializeToString())
+        except Exception as e:
+            logging.warning("Failed to save the checkpoint %s: %s", self.key, e)
+
+
+_checkpoint_store: Optional[MetadataStore] = None
+_checkpoint_store_lock = threading.Lock()
+
+
+def get_checkpoint_store() -> MetadataStore:
+    """
+    Get the checkpoint store of the process, local to the container without a bucket.
+
+    :return: Checkpoint store
+    """
+    global _checkpoint_store
+    with _checkpoint_store_lock:
+        if _checkpoint_store is None:
+            if os.environ.get('CHECKPOINT_BUCKET_NAME'):
+                _checkpoint_store = S3MetadataStore(
+                    get_s3_client(), os.environ['CHECKPOINT_BUCKET_NAME'], prefix="checkpoints/")
+            else:
+                _checkpoint_store = LocalMetadataStore(
+                    os.environ.get('CHECKPOINT_STORE_PATH') or get_scratch_space().get_store_path(CHECKPOINT_STORE_NAME))
+        return _checkpoint_store
@@ -0,0 +1,82 @@
+"""
+Clients of the process. Like the other get_* singletons of the core modules, such as the stores and caches, each client
+is created on first use, so handlers which never touch it do not pay for importing and building it, and is reused by
+the later invocations of the warm container.
+"""
+import os
+import threading
+
+# Connections kept open to S3, enough for the threads of concurrent transfers
+S3_MAX_POOL_CONNECTIONS: int = 64
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def create_s3_client(**kwargs):
+    """
+    Create an S3 client keeping enough connections open for the threads of concurrent transfers.
+
+    :param kwargs: Extra arguments of the client, such as the endpoint URL
+    :return: S3 client
+    """
+    import boto3
+    from botocore.config import Config
+    return boto3.client('s3', config=Config(
+        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+        tcp_keepalive=True,
+        retries={'mode': 'adaptive'}), **kwargs)
+
+
+def get_s3_client():
+    """
+    Get the S3 client of the process.
+
+    :return: S3 client
+    """
+    with _clients_lock:
+        if 's3' not in _clients:
+            _clients['s3'] = create_s3_client()
+        return _clients['s3']
+
+
+def get_lambda_client():
+    """
+    Get the Lambda client of the process.
+
+    :return: Lambda client
+    """
+    with _clients_lock:
+        if 'lambda' not in _clients:
+            import boto3
+            _clients['lambda'] = boto3.client('lambda')
+        return _clients['lambda']
+
+
+def get_dynamodb_client():
+    """
+    Get the DynamoDB client of the process.
+
+    :return: DynamoDB client
+    """
+    with _clients_lock:
+        if 'dynamodb' not in _clients:
+            import boto3
+            _clients['dynamodb'] = boto3.client('dynamodb')
+        return _clients['dynamodb']
+
+
+def get_vimeo_session():
+    """
+    Get the Vimeo session of the process, keeping the connections to Vimeo open.
+
+    :return: Vimeo session
+    """
+    with _clients_lock:
+        if 'vimeo' not in _clients:
+            from core.vimeo_session import UPLOAD_CHUNK_SIZE, VIMEO_API_ROOT, VimeoSession
+            _clients['vimeo'] = VimeoSession(
+                os.environ['VIMEO_CLIENT_TOKEN'],
+                api_root=os.environ.get('VIMEO_API_ROOT', VIMEO_API_ROOT),
+                chunk_size=int(os.environ.get('VIMEO_UPLOAD_CHUNK_SIZE', UPLOAD_CHUNK_SIZE)))
+        return _clients['vimeo']
@@ -0,0 +1,88 @@
+import hashlib
+import json
+import logging
+import os
+from typing import TYPE_CHECKING, Optional
+
+from botocore.exceptions import ClientError
+
+from core.s3_transfer import S3Transfer
+
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
+
+MISSING_OBJECT_ERROR_CODES: tuple = ('404', 'NoSuchKey', 'NotFound')
+
+
+class ClipCache:
+    """
+    Cache of processed clips on S3, addressed by the clip and the options which change its content.
+    """
+
+    def __init__(self, s3_client: 'BaseClient', bucket_name: str) -> None:
+        """
+        :param s3_client: Client used to access the bucket
+        :param bucket_name: Name of the bucket storing the clips
+        """
+        self.s3_client = s3_client
+        self.s3_transfer = S3Transfer(s3_client)
+        self.bucket_name = bucket_name
+
+    @staticmethod
+    def get_object_key(
+            video_id: str,
+            start_time_in_sec: int,
+            end_time_in_sec: int,
+            options: dict) -> str:
+        """
+        Get the key of the clip, so clips processed with different options are stored under different keys.
+
+        :param video_id: ID of the video
+        :param start_time_in_sec: Start time of trim in seconds
+        :param end_time_in_sec: End time of trim in seconds
+        :param options: Options which change the content of the clip
+        :return: Key of the clip object
+        """
+        digest = hashlib.sha256(json.dumps(options, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+        return f"{video_id}_{start_time_in_sec}_{end_time_in_sec}_{digest}"
+
+    @staticmethod
+    def get_metadata(options: dict) -> dict:
+        """
+        Get the S3 object metadata recording the options of the clip.
+
+        :param options: Options which change the content of the clip
+        :return: Object metadata, with lowercase keys and string values as S3 returns them
+        """
+        return {str(key).lower(): str(value) for key, value in options.items()}
+
+    def lookup(self, object_key: str, options: dict) -> Optional[int]:
+        """
+        Look up the clip on S3.
+
+        :param object_key: Key of the clip object
+        :param options: Options which change the content of the clip
+        :return: Size of the cached clip in bytes, or None if the clip is not cached
+        """
+        try:
+            response = self.s3_client.head_object(Bucket=self.bucket_name, Key=object_key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in MISSING_OBJECT_ERROR_CODES:
+                # Without list permission S3 answers 403 for missing keys, the clip is processed again either way
+                logging.warning("Failed to look up cached clip %s: %s", object_key, e)
+            return None
+        if response.get('Metadata', {}) != self.get_metadata(options):
+            logging.warning("Cached clip %s was processed with other options %s", object_key, response.get('Metadata'))
+            return None
+        return response['ContentLength']
+
+    def fetch(self, object_key: str, output_path: str, size: int = 0) -> None:
+        """
+        Copy the cached clip from S3 to disk.
+
+        :param object_key: Key of the clip object
+        :param output_path: Path of the output video file
+        :param size: Size of the cached clip in bytes, as found by the lookup
+        """
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        self.s3_transfer.download_file(self.bucket_name, object_key, output_path, size)
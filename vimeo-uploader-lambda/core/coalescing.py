@@ -0,0 +1,414 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Callable, Optional
+
+from botocore.exceptions import ClientError
+
+from core.clients import get_dynamodb_client
+from core.exceptions import VimeoUploaderInternalServerError
+from core.generated import model_pb2
+
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
+
+# Time a leader holds the lease without renewing it, after which a follower takes over from a crashed leader
+LEASE_TTL_IN_SEC: float = 60
+# Time between two checks of a follower on a leader in another container
+POLL_INTERVAL_IN_SEC: float = 1
+# Number of poll intervals the result of a request is kept by default, just long enough for the followers polling for it
+RESULT_TTL_IN_POLL_INTERVALS: int = 2
+# Longest time a follower waits on leaders, the maximum timeout of a lambda function
+WAIT_TIMEOUT_IN_SEC: float = 15 * 60
+
+
+def get_request_key(**spec) -> str:
+    """
+    Get the key of a request from its normalized spec, the same for every identical request.
+
+    :param spec: Spec of the request, such as the video, its trim range and where it is uploaded
+    :return: Key of the request
+    """
+    normalized = {name: value.strip() if isinstance(value, str) else value for name, value in spec.items()}
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class Lease:
+    """
+    Lease of a request, held by the leader processing it, and then the result of the request.
+    """
+
+    def __init__(self, owner: str, expires_at: float, result: Optional[bytes] = None) -> None:
+        """
+        :param owner: Leader holding the lease
+        :param expires_at: Time the lease expires at, in seconds since the epoch
+        :param result: Result of the request once it completed, kept until the lease expires
+        """
+        self.owner = owner
+        self.expires_at = expires_at
+        self.result = result
+
+
+class LeaseStore(ABC):
+    """
+    Store of the leases of the requests in flight, shared by the containers of the function.
+    """
+
+    @abstractmethod
+    def acquire(self, key: str, owner: str, ttl_in_sec: float) -> bool:
+        """
+        Acquire the lease of the request, if no one holds it or it expired.
+
+        :param key: Key of the request
+        :param owner: Leader acquiring the lease
+        :param ttl_in_sec: Time to live of the lease in seconds
+        :return: True if the lease was acquired
+        """
+        pass
+
+    @abstractmethod
+    def renew(self, key: str, owner: str, ttl_in_sec: float) -> bool:
+        """
+        Extend the lease held by the leader.
+
+        :param key: Key of the request
+        :param owner: Leader holding the lease
+        :param ttl_in_sec: Time to live of the lease from now in seconds
+        :return: True if the leader still held the lease
+        """
+        pass
+
+    @abstractmethod
+    def complete(self, key: str, owner: str, result: bytes, ttl_in_sec: float) -> None:
+        """
+        Store the result of the request with the lease, so followers get it instead of processing the request again.
+
+        :param key: Key of the request
+        :param owner: Leader holding the lease
+        :param result: Result of the request
+        :param ttl_in_sec: Time to keep the result in seconds
+        """
+        pass
+
+    @abstractmethod
+    def release(self, key: str, owner: str) -> None:
+        """
+        Release the lease without a result, so a follower takes over the request.
+
+        :param key: Key of the request
+        :param owner: Leader holding the lease
+        """
+        pass
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Lease]:
+        """
+        :param key: Key of the request
+        :return: Lease of the request, or None if missing
+        """
+        pass
+
+
+class DynamoDBLeaseStore(LeaseStore):
+    """
+    Lease store keeping each lease as an item of a DynamoDB table, with partition key `lease_key`. Conditional writes
+    make sure a single leader holds each lease.
+    """
+
+    def __init__(self, dynamodb_client: 'BaseClient', table_name: str) -> None:
+        self.dynamodb_client = dynamodb_client
+        self.table_name = table_name
+
+    def acquire(self, key: str, owner: str, ttl_in_sec: float) -> bool:
+        now = time.time()
+        return self._write(
+            'put_item',
+            Item=self._get_item(key, owner, now + ttl_in_sec),
+            ConditionExpression='attribute_not_exists(lease_key) OR expires_at < :now',
+            ExpressionAttributeValues={':now': {'N': str(now)}})
+
+    def renew(self, key: str, owner: str, ttl_in_sec: float) -> bool:
+        return self._write(
+            'update_item',
+            Key={'lease_key': {'S': key}},
+            UpdateExpression='SET expires_at = :expires_at',
+            ConditionExpression='lease_owner = :owner',
+            ExpressionAttributeValues={
+                ':expires_at': {'N': str(time.time() + ttl_in_sec)},
+                ':owner': {'S': owner},
+            })
+
+    def complete(self, key: str, owner: str, result: bytes, ttl_in_sec: float) -> None:
+        item = self._get_item(key, owner, time.time() + ttl_in_sec)
+        item['result'] = {'B': result}
+        self._write(
+            'put_item',
+            Item=item,
+            ConditionExpression='lease_owner = :owner',
+            ExpressionAttributeValues={':owner': {'S': owner}})
+
+    def release(self, key: str, owner: str) -> None:
+        self._write(
+            'delete_item',
+            Key={'lease_key': {'S': key}},
+            ConditionExpression='lease_owner = :owner',
+            ExpressionAttributeValues={':owner': {'S': owner}})
+
+    def get(self, key: str) -> Optional[Lease]:
+        item = self.dynamodb_client.get_item(
+            TableName=self.table_name, Key={'lease_key': {'S': key}}, ConsistentRead=True).get('Item')
+        if not item:
+            return None
+        return Lease(item['lease_owner']['S'], float(item['expires_at']['N']), item.get('result', {}).get('B'))
+
+    @staticmethod
+    def _get_item(key: str, owner: str, expires_at: float) -> dict:
+        return {
+            'lease_key': {'S': key},
+            'lease_owner': {'S': owner},
+            'expires_at': {'N': str(expires_at)},
+        }
+
+    def _write(self, operation: str, **kwargs) -> bool:
+        """
+        Write the item if its condition holds.
+
+        :param operation: Name of the write operation of the client
+        :return: True if the condition held
+        """
+        try:
+            getattr(self.dynamodb_client, operation)(TableName=self.table_name, **kwargs)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                return False
+            raise
+        return True
+
+
+class SQLiteLeaseStore(LeaseStore):
+    """
+    Lease store keeping the leases in a local SQLite database, standing in for a shared store. The database is shared
+    by the processes of the host.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS leases (lease_key TEXT PRIMARY KEY, owner TEXT, expires_at REAL, result BLOB)")
+
+    def acquire(self, key: str, owner: str, ttl_in_sec: float) -> bool:
+        now = time.time()
+        with self.lock:
+            # The write lock is taken before reading, so two processes cannot both find the lease free
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute(
+                    "SELECT expires_at FROM leases WHERE lease_key = ?", (key,)).fetchone()
+                acquired = row is None or row[0] < now
+                if acquired:
+                    self.connection.execute(
+                        "INSERT OR REPLACE INTO leases (lease_key, owner, expires_at, result) VALUES (?, ?, ?, NULL)",
+                        (key, owner, now + ttl_in_sec))
+            finally:
+                self.connection.execute("COMMIT")
+        return acquired
+
+    def renew(self, key: str, owner: str, ttl_in_sec: float) -> bool:
+        with self.lock:
+            cursor = self.connection.execute(
+                "UPDATE leases SET expires_at = ? WHERE lease_key = ? AND owner = ?",
+                (time.time() + ttl_in_sec, key, owner))
+        return cursor.rowcount == 1
+
+    def complete(self, key: str, owner: str, result: bytes, ttl_in_sec: float) -> None:
+        with self.lock:
+            self.connection.execute(
+                "UPDATE leases SET expires_at = ?, result = ? WHERE lease_key = ? AND owner = ?",
+                (time.time() + ttl_in_sec, result, key, owner))
+
+    def release(self, key: str, owner: str) -> None:
+        with self.lock:
+            self.connection.execute("DELETE FROM leases WHERE lease_key = ? AND owner = ?", (key, owner))
+
+    def get(self, key: str) -> Optional[Lease]:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT owner, expires_at, result FROM leases WHERE lease_key = ?", (key,)).fetchone()
+        return Lease(*row) if row else None
+
+
+class RequestCoalescer:
+    """
+    Single flight of identical requests. The first request for a key leads and processes it, while the identical
+    requests arriving meanwhile follow and get the result of the leader. Within the process the followers wait on the
+    leader directly. Across containers the leader holds a lease in the shared store, renewed while it processes the
+    request, and followers poll the store for the result. A follower takes over once the lease expires, after the
+    leader crashed, or is released, after the leader failed.
+    """
+
+    def __init__(
+            self,
+            lease_store: LeaseStore = None,
+            lease_ttl_in_sec: float = LEASE_TTL_IN_SEC,
+            result_ttl_in_sec: Optional[float] = None,
+            poll_interval_in_sec: float = POLL_INTERVAL_IN_SEC,
+            wait_timeout_in_sec: float = WAIT_TIMEOUT_IN_SEC) -> None:
+        """
+        :param lease_store: Store of the leases shared by the containers, or None to only coalesce within the process
+        :param lease_ttl_in_sec: Time to live of a lease in seconds, renewed by the leader a few times within it
+        :param result_ttl_in_sec: Time the result of a request is kept in seconds, serving the identical requests
+        arriving meanwhile, or None to only keep it for the followers polling for it
+        :param poll_interval_in_sec: Time between two checks of a follower on the store in seconds
+        :param wait_timeout_in_sec: Longest time a follower waits for a result in seconds
+        """
+        self.lease_store = lease_store
+        self.lease_ttl_in_sec = lease_ttl_in_sec
+        self.result_ttl_in_sec = result_ttl_in_sec or RESULT_TTL_IN_POLL_INTERVALS * poll_interval_in_sec
+        self.poll_interval_in_sec = poll_interval_in_sec
+        self.wait_timeout_in_sec = wait_timeout_in_sec
+        self.flights: dict[str, Future] = {}
+        self.lock = threading.Lock()
+
+    def run(
+            self,
+            key: str,
+            process: Callable[[], model_pb2.VideoProcessResult]) -> model_pb2.VideoProcessResult:
+        """
+        Process the request, unless an identical request is in flight, in which case wait for its result.
+
+        :param key: Key of the request
+        :param process: Function processing the request
+        :return: Result of the request
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = Future()
+                self.flights[key] = flight
+        if not leader:
+            logging.info("Waiting for the request %s in flight", key)
+            result = model_pb2.VideoProcessResult()
+            result.CopyFrom(flight.result())
+            return result
+        try:
+            result = self._run_across_instances(key, process)
+            flight.set_result(result)
+            return result
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+
+    def _run_across_instances(
+            self,
+            key: str,
+            process: Callable[[], model_pb2.VideoProcessResult]) -> model_pb2.VideoProcessResult:
+        """
+        Process the request once it holds the lease, or get the result of the leader in another container.
+
+        :param key: Key of the request
+        :param process: Function processing the request
+        :return: Result of the request
+        """
+        if not self.lease_store:
+            return process()
+        owner = str(uuid.uuid4())
+        deadline = time.monotonic() + self.wait_timeout_in_sec
+        while True:
+            if self.lease_store.acquire(key, owner, self.lease_ttl_in_sec):
+                return self._lead(key, owner, process)
+            lease = self.lease_store.get(key)
+            if lease and lease.result is not None:
+                logging.info("Got the result of the request %s from leader %s", key, lease.owner)
+                return model_pb2.VideoProcessResult.FromString(lease.result)
+            if time.monotonic() > deadline:
+                raise VimeoUploaderInternalServerError(f"Timed out waiting for the request {key} in flight")
+            time.sleep(self.poll_interval_in_sec)
+
+    def _lead(
+            self,
+            key: str,
+            owner: str,
+            process: Callable[[], model_pb2.VideoProcessResult]) -> model_pb2.VideoProcessResult:
+        """
+        Process the request while renewing its lease, then store the result for the followers.
+
+        :param key: Key of the request
+        :param owner: Leader holding the lease
+        :param process: Function processing the request
+        :return: Result of the request
+        """
+        done = threading.Event()
+        renewer = threading.Thread(
+            target=self._renew, args=(key, owner, done), name='lease-renewer', daemon=True)
+        renewer.start()
+        try:
+            result = process()
+        except BaseException:
+            done.set()
+            # Followers take over, rather than all failing with the leader
+            try:
+                self.lease_store.release(key, owner)
+            except Exception as e:
+                # The followers take over once the lease expires, and the error of the request is raised
+                logging.warning("Failed to release the lease of the request %s: %s", key, e)
+            raise
+        done.set()
+        try:
+            self.lease_store.complete(key, owner, result.SerializeToString(), self.result_ttl_in_sec)
+        except Exception as e:
+            # The followers take over once the lease expires
+            logging.warning("Failed to store the result of the request %s: %s", key, e)
+        return result
+
+    def _renew(self, key: str, owner: str, done: threading.Event) -> None:
+        """
+        Renew the lease a few times within its time to live, until the leader is done.
+
+        :param key: Key of the request
+        :param owner: Leader holding the lease
+        :param done: Event set once the leader is done
+        """
+        while not done.wait(self.lease_ttl_in_sec / 3):
+            try:
+                if not self.lease_store.renew(key, owner, self.lease_ttl_in_sec):
+                    logging.warning("Lost the lease of the request %s", key)
+                    return
+            except Exception as e:
+                logging.warning("Failed to renew the lease of the request %s: %s", key, e)
+
+
+_request_coalescer: Optional[RequestCoalescer] = None
+_request_coalescer_lock = threading.Lock()
+
+
+def get_request_coalescer() -> RequestCoalescer:
+    """
+    Get the request coalescer of the process, only coalescing within it without a table or database.
+
+    :return: Request coalescer
+    """
+    global _request_coalescer
+    with _request_coalescer_lock:
+        if _request_coalescer is None:
+            lease_store = None
+            if os.environ.get('COALESCING_TABLE_NAME'):
+                lease_store = DynamoDBLeaseStore(get_dynamodb_client(), os.environ['COALESCING_TABLE_NAME'])
+            elif os.environ.get('COALESCING_STORE_PATH'):
+                lease_store = SQLiteLeaseStore(os.environ['COALESCING_STORE_PATH'])
+            result_ttl_in_sec = os.environ.get('COALESCING_RESULT_TTL_IN_SEC')
+            _request_coalescer = RequestCoalescer(
+                lease_store, result_ttl_in_sec=float(result_ttl_in_sec) if result_ttl_in_sec else None)
+        return _request_coalescer
@@ -1,21 +1,60 @@
 import base64
+import hashlib
+import importlib
 import logging
 import os
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import date
+from typing import TYPE_CHECKING, Callable, Optional
 
-import boto3
-from botocore.client import BaseClient
-from botocore.exceptions import NoCredentialsError
+from botocore.exceptions import ClientError, NoCredentialsError
+from google.protobuf.json_format import ParseDict, ParseError
 
-from core.exceptions import VimeoUploaderInternalServerError
+from core.checkpoints import Checkpointer, StageCheckpointer, get_checkpoint_key, get_file_sha256
+from core.clients import get_s3_client
+from core.coalescing import RequestCoalescer, get_request_key
+from core.clip_cache import MISSING_OBJECT_ERROR_CODES, ClipCache
+from core.exceptions import VimeoUploaderInternalServerError, VimeoUploaderInvalidRequestError
 from core.generated import model_pb2
-from core.streaming_platform import YouTubePlatform, VimeoPlatform, StreamingPlatform, SupportedPlatform
+from core.metadata_cache import CacheControl, MetadataCache, MetadataStore
+from core.metrics import Metrics
+from core.pipeline import Stage, run_stages
+from core.s3_transfer import S3Transfer
+from core.scratch import ScratchSpace, get_scratch_space
+from core.streaming_platform import StreamingPlatform, SupportedPlatform
 
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
+
+    from core.jobs import JobProgress
+
+# Maximum number of clips of a batch uploaded at the same time
+BATCH_UPLOAD_CONCURRENCY: int = 4
+# Maximum number of uploads to the same platform at the same time, across the requests of the container
+UPLOAD_CONCURRENCY_PER_PLATFORM: int = 2
+# Downloaders of yt-dlp a request may pick, any other downloader is an executable only the deployment may set
+REQUEST_EXTERNAL_DOWNLOADERS: tuple = ('native', 'ffmpeg', 'aria2c')
+# Maximum of each option of the download tuning of a request, higher values are lowered to it
+REQUEST_DOWNLOAD_TUNING_LIMITS: dict = {
+    'concurrent_fragment_downloads': 16,
+    'http_chunk_size': 64 * 1024 * 1024,
+    'buffer_size': 16 * 1024 * 1024,
+    'retries': 10,
+    'fragment_retries': 10,
+}
+
+# Module and class of each platform, imported on first use so each handler only loads the SDKs it needs
 STREAMING_PLATFORMS = {
-    SupportedPlatform.YOUTUBE.name.lower(): YouTubePlatform(),
-    SupportedPlatform.VIMEO.name.lower(): VimeoPlatform()
+    SupportedPlatform.YOUTUBE.name.lower(): ('core.youtube_platform', 'YouTubePlatform'),
+    SupportedPlatform.VIMEO.name.lower(): ('core.vimeo_platform', 'VimeoPlatform')
 }
 
+_streaming_platforms = {}
+_streaming_platforms_lock = threading.Lock()
+_upload_semaphores = {}
+
 
 def get_streaming_platform(platform: str) -> StreamingPlatform:
     """
@@ -24,7 +63,158 @@ def get_streaming_platform(platform: str) -> StreamingPlatform:
     :param platform: Platform string
     :return:
     """
-    return STREAMING_PLATFORMS.get(platform)
+    if platform not in STREAMING_PLATFORMS:
+        return None
+    with _streaming_platforms_lock:
+        if platform not in _streaming_platforms:
+            module_name, class_name = STREAMING_PLATFORMS[platform]
+            _streaming_platforms[platform] = getattr(importlib.import_module(module_name), class_name)()
+        return _streaming_platforms[platform]
+
+
+def get_upload_semaphore(platform: str) -> threading.BoundedSemaphore:
+    """
+    Fetch the semaphore limiting the uploads to the platform at the same time.
+
+    :param platform: Platform string
+    :return: Semaphore of the platform
+    """
+    with _streaming_platforms_lock:
+        if platform not in _upload_semaphores:
+            _upload_semaphores[platform] = threading.BoundedSemaphore(UPLOAD_CONCURRENCY_PER_PLATFORM)
+        return _upload_semaphores[platform]
+
+
+def get_trim_mode(trim_mode: str) -> model_pb2.TrimMode:
+    """
+    Fetch trim mode from trim mode string, defaulting to stream copy.
+
+    :param trim_mode: Trim mode string, either copy or smart
+    :return:
+    """
+    if not trim_mode:
+        return model_pb2.TRIM_MODE_COPY
+    name = f"TRIM_MODE_{str(trim_mode).upper()}"
+    if name not in model_pb2.TrimMode.keys():
+        raise VimeoUploaderInvalidRequestError(f"Trim mode {trim_mode} is not supported")
+    return model_pb2.TrimMode.Value(name)
+
+
+def get_download_tuning(download_tuning: dict) -> Optional[model_pb2.DownloadTuning]:
+    """
+    Fetch the download tuning of a request, with its options kept within the limits a request may set.
+
+    :param download_tuning: Download tuning of the request, such as {"concurrent_fragment_downloads": 8}
+    :return: Download tuning, or None to use the tuning of the deployment
+    """
+    if not download_tuning:
+        return None
+    try:
+        tuning = ParseDict(download_tuning, model_pb2.DownloadTuning())
+    except ParseError as e:
+        raise VimeoUploaderInvalidRequestError(f"Download tuning is invalid: {e}")
+    if tuning.external_downloader and tuning.external_downloader not in REQUEST_EXTERNAL_DOWNLOADERS:
+        raise VimeoUploaderInvalidRequestError(f"External downloader {tuning.external_downloader} is not supported")
+    for option, limit in REQUEST_DOWNLOAD_TUNING_LIMITS.items():
+        setattr(tuning, option, max(0, min(getattr(tuning, option), limit)))
+    return tuning
+
+
+class VideoRequest:
+    """
+    State of a request processing a video, shared by its stages: the clip, its copies in the clip cache and on disk,
+    its checkpoint, and the metrics and progress of the request.
+    """
+
+    def __init__(
+            self,
+            video_id: str,
+            start_time_in_sec: int,
+            end_time_in_sec: int,
+            image_identifier: str,
+            title: str,
+            download: bool,
+            trim_mode: model_pb2.TrimMode,
+            progress: 'JobProgress' = None) -> None:
+        """
+        :param video_id: ID of the video
+        :param start_time_in_sec: Start time of trim in seconds
+        :param end_time_in_sec: End time of trim in seconds
+        :param image_identifier: Unique identifier on S3, for image
+        :param title: Title of the video
+        :param download: True if download the video, false otherwise
+        :param trim_mode: Mode of trimming
+        :param progress: Progress of the job processing the video, updated as the stages advance
+        """
+        self.video_id = video_id
+        self.start_time_in_sec = start_time_in_sec
+        self.end_time_in_sec = end_time_in_sec
+        self.image_identifier = image_identifier
+        self.title = title
+        self.download = download
+        self.trim_mode = trim_mode
+        self.progress = progress
+        self.video_name = f"{video_id}_{start_time_in_sec}_{end_time_in_sec}.mkv"
+        self.s3_object_key = f"{video_id}_{start_time_in_sec}_{end_time_in_sec}"
+        self.s3_bucket_name = os.environ.get('S3_VIDEO_BUCKET_NAME')
+        self.target_profile: Optional[model_pb2.TargetProfile] = None
+        self.clip_options: Optional[dict] = None
+        self.clip_key: Optional[str] = None
+        self.clip_cache: Optional[ClipCache] = None
+        self.cached_size: Optional[int] = None
+        self.streaming = False
+        self.checkpointer: Optional[Checkpointer] = None
+        self.download_path: Optional[str] = None
+        self.video_path: Optional[str] = None
+        self.metrics = Metrics()
+
+    def get_checkpoint(self, stage: str, inputs: dict) -> Optional[StageCheckpointer]:
+        """
+        :param stage: Name of the stage after the download
+        :param inputs: Inputs of the stage beyond the request
+        :return: Checkpoint of the stage, or None without checkpoints
+        """
+        if not self.checkpointer:
+            return None
+        # Stages after the download are only resumed for the same downloaded video
+        return self.checkpointer.stage(stage, {**inputs, 'video_sha256': self.get_video_sha256()})
+
+    def get_video_sha256(self) -> Optional[str]:
+        """
+        :return: SHA-256 hash of the downloaded video, recorded by its checkpoint, or None without checkpoints
+        """
+        if not self.checkpointer:
+            return None
+        return self.checkpointer.get('download').sha256 or None
+
+    def get_progress_callback(self, stage: str) -> Optional[Callable[[float], None]]:
+        """
+        :param stage: Name of the stage
+        :return: Callback taking the fraction of the stage done, or None if the request is not a job
+        """
+        return self.progress.get_callback(stage) if self.progress else None
+
+    def get_clip_metadata(self) -> Optional[dict]:
+        """
+        :return: Metadata of the clip in the clip cache, or None without the clip cache
+        """
+        return ClipCache.get_metadata(self.clip_options) if self.clip_cache else None
+
+    def complete(self, stage: str, run: Callable[[dict], object]) -> Callable[[dict], object]:
+        """
+        Time the stage, and mark it complete once it returns, as it only reports its progress when the platform does.
+
+        :param stage: Name of the stage
+        :param run: Function running the stage
+        :return: Function running the stage and completing it
+        """
+        def run_and_complete(results: dict):
+            with self.metrics.stage(stage):
+                result = run(results)
+            if self.progress:
+                self.progress.update(stage, 1.0)
+            return result
+        return run_and_complete
 
 
 class Driver:
@@ -36,28 +226,130 @@ class Driver:
             self,
             download_platform: StreamingPlatform = None,
             upload_platform: StreamingPlatform = None,
-            s3_client: BaseClient = boto3.client('s3'),
+            s3_client: 'BaseClient' = None,
             allow_download=True,
-            allow_upload=True) -> None:
+            allow_upload=True,
+            concurrent=False,
+            cache_clips=False,
+            metadata_cache: MetadataCache = None,
+            stream=False,
+            checkpoint_store: MetadataStore = None,
+            coalescer: RequestCoalescer = None,
+            scratch_space: ScratchSpace = None,
+            emit_metrics=False,
+            extended_result=False,
+            download_tuning: model_pb2.DownloadTuning = None,
+            upload_platforms: dict[str, StreamingPlatform] = None) -> None:
         """
         Initialize the driver used to interact with video/audio resources.
+
+        :param s3_client: Client used to access S3, or None to use the client of the process once S3 is accessed
+        :param concurrent: True if the independent stages of processing the video should run in parallel
+        :param cache_clips: True if processed clips should be stored on S3 and reused instead of downloading again
+        :param metadata_cache: Cache of video metadata in front of the download platform, or None to disable it
+        :param stream: True if stream copied clips should be streamed into S3 as they are trimmed, without a copy on
+        disk, and uploaded to the target platform from S3
+        :param checkpoint_store: Store of the checkpoints of processed videos, so a retried request resumes from the
+        first incomplete stage, or None to disable checkpoints
+        :param coalescer: Single flight of identical requests, so only one of them is processed while the others wait
+        for its result, or None to process every request
+        :param scratch_space: Allocator of the directories the videos are downloaded to, or None to use the scratch
+        space of the process
+        :param emit_metrics: True if the wall time and bytes moved of each stage should be written to stdout
+        in the CloudWatch Embedded Metric Format
+        :param extended_result: True if the metrics of each stage should be returned in the result, for debugging
+        :param download_tuning: Tuning of the downloads of the request, such as concurrent fragments, over the tuning
+        of the deployment
+        :param upload_platforms: Platforms by platform string the video is uploaded to at the same time, instead of the
+        upload platform, with the result of each one returned. A platform which is not supported is None
         """
         self.download_platform = download_platform
         self.upload_platform = upload_platform
-        self.s3_client = s3_client
+        self._s3_client = s3_client
+        self._s3_transfer = None
         self.allow_download = allow_download
         self.allow_upload = allow_upload
+        self.concurrent = concurrent
+        self.cache_clips = cache_clips
+        self.metadata_cache = metadata_cache
+        self.stream = stream
+        self.checkpoint_store = checkpoint_store
+        self.coalescer = coalescer
+        self._scratch_space = scratch_space
+        self.emit_metrics = emit_metrics
+        self.extended_result = extended_result
+        self.download_tuning = download_tuning
+        self.upload_platforms = upload_platforms
         print("Driver initialization successful")
 
+    @property
+    def s3_client(self) -> 'BaseClient':
+        if self._s3_client is None:
+            self._s3_client = get_s3_client()
+        return self._s3_client
+
+    @property
+    def scratch_space(self) -> ScratchSpace:
+        if self._scratch_space is None:
+            self._scratch_space = get_scratch_space()
+        return self._scratch_space
+
+    @property
+    def s3_transfer(self) -> S3Transfer:
+        if self._s3_transfer is None:
+            self._s3_transfer = S3Transfer(self.s3_client)
+        return self._s3_transfer
+
     def get_video_metadata(
             self,
-            video_id: str) -> model_pb2.VideoMetadata:
+            video_id: str,
+            cache_control: CacheControl = CacheControl.DEFAULT) -> model_pb2.VideoMetadata:
         """
         Get video metadata from download platform.
         :param video_id: ID of the video
+        :param cache_control: How the lookup uses the metadata cache
         :return: Video metadata from video service for video ID
         """
-        return self.download_platform.get_video_metadata(video_id)
+        return self.get_videos_metadata([video_id], cache_control, raise_error=True).video_metadata[0]
+
+    def get_videos_metadata(
+            self,
+            video_ids: list[str],
+            cache_control: CacheControl = CacheControl.DEFAULT,
+            raise_error: bool = False) -> model_pb2.BatchVideoMetadataResult:
+        """
+        Get metadata about many videos from download platform, looking up only the videos missing from the cache.
+        :param video_ids: IDs of the videos
+        :param cache_control: How the lookup uses the metadata cache
+        :param raise_error: True if a failed lookup should raise, false to report it in the result
+        :return: Video metadata for each video ID, with the error for videos which failed
+        """
+        use_cache = self.metadata_cache is not None and cache_control != CacheControl.BYPASS
+        videos_metadata = {}
+        if use_cache:
+            for video_id in video_ids:
+                cache_key = self._get_metadata_cache_key(video_id)
+                if cache_control == CacheControl.INVALIDATE:
+                    self.metadata_cache.invalidate(cache_key)
+                else:
+                    video_metadata = self.metadata_cache.get(cache_key)
+                    if video_metadata:
+                        videos_metadata[video_id] = video_metadata
+
+        missing_video_ids = [video_id for video_id in dict.fromkeys(video_ids) if video_id not in videos_metadata]
+        if len(missing_video_ids) == 1 and raise_error:
+            videos_metadata[missing_video_ids[0]] = self.download_platform.get_video_metadata(missing_video_ids[0])
+        elif missing_video_ids:
+            videos_metadata.update(zip(
+                missing_video_ids, self.download_platform.get_videos_metadata(missing_video_ids)))
+        if use_cache:
+            for video_id in missing_video_ids:
+                if not videos_metadata[video_id].error:
+                    self.metadata_cache.put(self._get_metadata_cache_key(video_id), videos_metadata[video_id])
+            logging.info("Metadata cache stats %s", self.metadata_cache.stats)
+
+        return model_pb2.BatchVideoMetadataResult(
+            video_metadata=[videos_metadata[video_id] for video_id in video_ids])
 
     def process_video(
             self,
@@ -66,7 +358,51 @@ class Driver:
             end_time_in_sec: int,
             image_identifier: str,
             title: str,
-            download: bool) -> model_pb2.VideoProcessResult:
+            download: bool,
+            trim_mode: model_pb2.TrimMode = model_pb2.TRIM_MODE_COPY,
+            progress: 'JobProgress' = None) -> model_pb2.VideoProcessResult:
+        """
+        Process the video with input video configuration. Identical requests in flight at the same time are processed
+        once, when the driver has a coalescer.
+
+        :param video_id: ID of the video
+        :param start_time_in_sec: Start time of trim in seconds
+        :param end_time_in_sec: End time of trim in seconds
+        :param image_identifier: Unique identifier on S3, for image
+        :param title: Title of the video
+        :param download: True if download the video, false otherwise
+        :param trim_mode: Mode of trimming, stream copy by default or frame accurate smart cut
+        :param progress: Progress of the job processing the video, updated as the stages advance
+        :return:
+        """
+        def process() -> model_pb2.VideoProcessResult:
+            return self._process_video(
+                video_id, start_time_in_sec, end_time_in_sec, image_identifier, title, download, trim_mode, progress)
+
+        if not self.coalescer:
+            return process()
+        key = get_request_key(
+            download_platform=type(self.download_platform).__name__,
+            upload_platform=self._get_upload_platform_names() if self.allow_upload else None,
+            video_id=video_id,
+            start_time_in_sec=int(start_time_in_sec),
+            end_time_in_sec=int(end_time_in_sec),
+            trim_mode=model_pb2.TrimMode.Name(trim_mode),
+            image_identifier=image_identifier or None,
+            title=title or None,
+            download=bool(download and self.allow_download))
+        return self.coalescer.run(key, process)
+
+    def _process_video(
+            self,
+            video_id: str,
+            start_time_in_sec: int,
+            end_time_in_sec: int,
+            image_identifier: str,
+            title: str,
+            download: bool,
+            trim_mode: model_pb2.TrimMode = model_pb2.TRIM_MODE_COPY,
+            progress: 'JobProgress' = None) -> model_pb2.VideoProcessResult:
         """
         Process the video with input video configuration.
 
@@ -76,66 +412,465 @@ class Driver:
         :param image_identifier: Unique identifier on S3, for image
         :param title: Title of the video
         :param download: True if download the video, false otherwise
+        :param trim_mode: Mode of trimming, stream copy by default or frame accurate smart cut
+        :param progress: Progress of the job processing the video, updated as the stages advance
         :return:
         """
-        if not title:
-            today = date.today()
-            current_date = today.strftime("%m/%d/%y")
-            title = f"(CW) {current_date}"
+        request = self._create_video_request(
+            video_id, start_time_in_sec, end_time_in_sec, image_identifier, title or self._get_default_title(),
+            download, trim_mode, progress)
+        metrics = request.metrics
+        # With checkpoints, the downloaded video is kept under the clip key for a retry on the same container to reuse
+        # it. Otherwise each request has a directory of its own, so concurrent requests never write the same file
+        reusable = request.checkpointer is not None
+        with self.scratch_space.allocate(
+                f"{video_id}_{request.clip_key[:16] if reusable else uuid.uuid4().hex}",
+                self._estimate_clip_size(request),
+                reusable=reusable) as download_path:
+            request.download_path = download_path
+            request.video_path = os.path.join(download_path, request.video_name)
+
+            # The thumbnail is fetched while the video downloads, and both uploads read the same local file. A streamed
+            # video is already on S3 once downloaded, and the target platform fetches it from there
+            try:
+                with metrics.stage('total'):
+                    results = run_stages([
+                        Stage('download_result', request.complete('download', lambda _: self._download_clip(request))),
+                        Stage('image_data', lambda _: self._download_image(
+                            image_identifier, metrics) if image_identifier else None),
+                        Stage('upload_url', request.complete(
+                            'upload', lambda stage_results: self._upload_clip(request, stage_results)),
+                            ['download_result', 'image_data']),
+                        Stage('download_url', request.complete(
+                            'upload_to_s3', lambda _: self._upload_clip_to_s3(request)), ['download_result']),
+                    ], concurrent=self.concurrent)
+            finally:
+                if self.emit_metrics:
+                    metrics.emit('process_video')
+        return self._get_video_process_result(request, results)
+
+    def _create_video_request(
+            self,
+            video_id: str,
+            start_time_in_sec: int,
+            end_time_in_sec: int,
+            image_identifier: str,
+            title: str,
+            download: bool,
+            trim_mode: model_pb2.TrimMode,
+            progress: 'JobProgress' = None) -> 'VideoRequest':
+        """
+        Create the state of the request, looking up the clip in the clip cache and its checkpoint.
+
+        :param video_id: ID of the video
+        :param start_time_in_sec: Start time of trim in seconds
+        :param end_time_in_sec: End time of trim in seconds
+        :param image_identifier: Unique identifier on S3, for image
+        :param title: Title of the video
+        :param download: True if download the video, false otherwise
+        :param trim_mode: Mode of trimming
+        :param progress: Progress of the job processing the video
+        :return: State of the request
+        """
+        request = VideoRequest(
+            video_id, start_time_in_sec, end_time_in_sec, image_identifier, title, download, trim_mode, progress)
+        request.target_profile = self._get_target_profile()
+        request.clip_options = self.download_platform.get_clip_options(trim_mode, request.target_profile)
+        if self.cache_clips:
+            request.clip_cache = ClipCache(self.s3_client, os.environ['S3_VIDEO_BUCKET_NAME'])
+            request.s3_object_key = request.clip_cache.get_object_key(
+                video_id, start_time_in_sec, end_time_in_sec, request.clip_options)
+            request.cached_size = request.clip_cache.lookup(request.s3_object_key, request.clip_options)
+            logging.info(
+                "Clip cache %s for %s", "hit" if request.cached_size is not None else "miss", request.s3_object_key)
+        # The formats are checked before choosing to stream, so a video ffmpeg cannot read is downloaded to disk instead
+        request.streaming = self.stream and request.cached_size is None and self.download_platform.can_stream_video(
+            video_id, trim_mode, request.target_profile)
+        # Identifies the clip across requests, for resuming its stages and for the upload platform to recognize it
+        request.clip_key = get_checkpoint_key(video_id, start_time_in_sec, end_time_in_sec, request.clip_options)
+        if self.checkpoint_store:
+            request.checkpointer = Checkpointer(self.checkpoint_store, request.clip_key)
+        return request
+
+    def _estimate_clip_size(self, request: 'VideoRequest') -> int:
+        """
+        Estimate the space taken by the clip on disk, checked before downloading it rather than running out of it
+        midway.
+
+        :param request: State of the request
+        :return: Estimated size in bytes
+        """
+        if request.streaming or request.checkpointer and request.checkpointer.get('download').completed:
+            return 0
+        if request.cached_size is not None:
+            return request.cached_size
+        return self.download_platform.estimate_download_size(
+            request.video_id, request.start_time_in_sec, request.end_time_in_sec, request.target_profile)
 
-        suffix = f"{str(start_time_in_sec)}_{str(end_time_in_sec)}"
-        video_name = f"{video_id}_{suffix}.mkv"
-        s3_object_key = f"{video_id}_{suffix}"
-        download_path = os.path.join("/tmp", video_id)
+    def _download_clip(self, request: 'VideoRequest') -> model_pb2.DownloadResult:
+        """
+        Download the clip, restoring it from the checkpoint of an earlier attempt when possible.
 
-        downloaded = self.download_platform.download_video(
-            video_id, start_time_in_sec, end_time_in_sec, download_path, video_name)
+        :param request: State of the request
+        :return: Result of the download
+        """
+        checkpointer = request.checkpointer
+        checkpoint = checkpointer.stage('download', {'stream': request.streaming}) if checkpointer else None
+        if checkpoint and checkpoint.get().completed:
+            download_result = self._restore_download(checkpointer, request.video_path, request.metrics)
+            if download_result:
+                return download_result
+            checkpoint.reset()
+        if request.streaming:
+            download_result = self._stream_video_to_s3(
+                request.video_id, request.start_time_in_sec, request.end_time_in_sec, request.trim_mode,
+                request.s3_object_key, request.s3_bucket_name, request.get_clip_metadata(), request.target_profile)
+            if checkpoint:
+                checkpoint.update(
+                    completed=True, artifact=request.s3_object_key, size=download_result.bytes_downloaded,
+                    result=download_result.SerializeToString(), attributes={'bucket_name': request.s3_bucket_name})
+        elif request.cached_size is not None and not self.allow_upload:
+            # The local copy of the cached clip is only needed by the upload
+            return model_pb2.DownloadResult(downloaded=True, mode=model_pb2.DOWNLOAD_MODE_CACHE)
+        else:
+            download_result = self._download_clip_to_disk(request)
+            if checkpoint:
+                checkpoint.update(
+                    completed=True, artifact=request.video_path, sha256=get_file_sha256(request.video_path),
+                    size=os.path.getsize(request.video_path), result=download_result.SerializeToString())
+        request.metrics.add_bytes('download', download_result.bytes_downloaded)
+        return download_result
 
-        if not downloaded:
+    def _download_clip_to_disk(self, request: 'VideoRequest') -> model_pb2.DownloadResult:
+        """
+        Copy the clip from the clip cache, or download it from the download platform.
+
+        :param request: State of the request
+        :return: Result of the download
+        """
+        if request.cached_size is not None:
+            request.clip_cache.fetch(request.s3_object_key, request.video_path, request.cached_size)
+            return model_pb2.DownloadResult(
+                downloaded=True, mode=model_pb2.DOWNLOAD_MODE_CACHE, bytes_downloaded=request.cached_size)
+        download_result = self.download_platform.download_video(
+            request.video_id, request.start_time_in_sec, request.end_time_in_sec, request.download_path,
+            request.video_name, request.trim_mode,
+            progress_callback=request.get_progress_callback('download'),
+            metrics=request.metrics,
+            target_profile=request.target_profile,
+            download_tuning=self.download_tuning)
+        if not download_result.downloaded:
             raise VimeoUploaderInternalServerError(
                 "Failed to download the video")
+        return download_result
 
-        video_path = os.path.join(download_path, video_name)
+    def _upload_clip(self, request: 'VideoRequest', results: dict):
+        """
+        Upload the clip to the upload platform, or to every upload platform at the same time.
 
-        if image_identifier:
-            image_path = self._download_image_to_file(image_identifier, '/tmp')
-        else:
-            image_path = None
+        :param request: State of the request
+        :param results: Results of the download and thumbnail stages
+        :return: URL of the uploaded video, or the result of the upload by platform string, or None if not uploaded
+        """
+        if not self.allow_upload:
+            return None
+        if self.upload_platforms is None:
+            return self._upload_clip_to_platform(
+                request, self.upload_platform, 'upload', results, request.get_progress_callback('upload'))
+        return self._fan_out_upload(
+            lambda upload_platform, name, progress_callback: self._upload_clip_to_platform(
+                request, upload_platform, f"upload_{name}", results, progress_callback),
+            request.get_progress_callback('upload'))
 
-        if self.allow_upload:
-            upload_url = self.upload_platform.upload_video(
-                video_path, title, image_path)
+    def _upload_clip_to_platform(
+            self,
+            request: 'VideoRequest',
+            upload_platform: StreamingPlatform,
+            stage: str,
+            results: dict,
+            progress_callback: Callable[[float], None] = None) -> str:
+        """
+        Upload the clip to the platform, from S3 when it was streamed there, or from the local file otherwise.
+
+        :param request: State of the request
+        :param upload_platform: Platform the clip is uploaded to
+        :param stage: Name of the stage checkpointing the upload
+        :param results: Results of the download and thumbnail stages
+        :param progress_callback: Callback taking the uploaded fraction of the clip
+        :return: URL of the uploaded video
+        """
+        checkpoint = request.get_checkpoint(stage, {
+            'platform': type(upload_platform).__name__,
+            'title': request.title,
+            'image_identifier': request.image_identifier,
+        })
+        if checkpoint and checkpoint.get().completed:
+            return checkpoint.get().artifact
+        if request.streaming:
+            upload_url = upload_platform.upload_video_from_url(
+                self._generate_presigned_url(request.s3_object_key, request.s3_bucket_name),
+                results['download_result'].bytes_downloaded,
+                request.title,
+                results['image_data'])
         else:
-            upload_url = None
+            upload_url = upload_platform.upload_video(
+                request.video_path, request.title, results['image_data'],
+                progress_callback=progress_callback,
+                checkpoint=checkpoint,
+                clip_key=request.clip_key,
+                video_sha256=request.get_video_sha256())
+            request.metrics.add_bytes('upload', os.path.getsize(request.video_path))
+        if checkpoint:
+            checkpoint.update(completed=True, artifact=upload_url)
+        return upload_url
 
-        if self.allow_download and download:
-            download_url = self._upload_file_to_s3(
-                s3_object_key, video_path, os.environ['S3_VIDEO_BUCKET_NAME'])
+    def _upload_clip_to_s3(self, request: 'VideoRequest') -> Optional[str]:
+        """
+        Upload the clip to the video S3 Bucket, for the requested download and for the clip cache.
+
+        :param request: State of the request
+        :return: URL to download the clip, or None if no download was requested
+        """
+        return_url = self.allow_download and request.download
+        if request.cached_size is not None or request.streaming:
+            return self._generate_presigned_url(request.s3_object_key, request.s3_bucket_name) if return_url else None
+        # With the clip cache, the clip is stored even if no download was requested, so the next request for it is
+        # served from S3
+        if not request.clip_cache and not return_url:
+            return None
+        bucket_name = request.clip_cache.bucket_name if request.clip_cache else os.environ['S3_VIDEO_BUCKET_NAME']
+        checkpoint = request.get_checkpoint('upload_to_s3', {'bucket_name': bucket_name})
+        if checkpoint and checkpoint.get().completed:
+            url = self._generate_presigned_url(request.s3_object_key, bucket_name)
         else:
-            download_url = None
+            try:
+                url = self._upload_file_to_s3(
+                    request.s3_object_key, request.video_path, bucket_name,
+                    metadata=request.get_clip_metadata(),
+                    progress_callback=request.get_progress_callback('upload_to_s3'),
+                    checkpoint=checkpoint,
+                    metrics=request.metrics)
+            except Exception as e:
+                if return_url:
+                    raise
+                # Storing the clip in the clip cache is an optimization, which does not fail the request
+                logging.warning("Failed to store the clip %s in the clip cache: %s", request.s3_object_key, e)
+                return None
+            if checkpoint:
+                checkpoint.update(
+                    completed=True, artifact=request.s3_object_key,
+                    sha256=request.checkpointer.get('download').sha256, attributes={'bucket_name': bucket_name})
+        return url if return_url else None
+
+    def _get_video_process_result(self, request: 'VideoRequest', results: dict) -> model_pb2.VideoProcessResult:
+        """
+        :param request: State of the request
+        :param results: Results of the stages
+        :return: Result of processing the video
+        """
+        download_url = results['download_url']
+        upload_url = results['upload_url']
+        upload_results = {}
+        if isinstance(upload_url, dict):
+            # The upload link of the first platform uploaded to stays in the result, for clients of a single platform
+            upload_results = upload_url
+            upload_url = next(
+                (upload_result.upload_url for upload_result in upload_results.values() if upload_result.uploaded), None)
 
         logging.info("Download link is %s", download_url)
         logging.info("Upload link is %s", upload_url)
 
-        return model_pb2.VideoProcessResult(
+        video_process_result = model_pb2.VideoProcessResult(
             download_url=download_url,
-            upload_url=upload_url)
+            upload_url=upload_url,
+            download_result=results['download_result'],
+            upload_results=upload_results)
+        if self.extended_result:
+            video_process_result.stage_metrics.extend(request.metrics.get_stage_metrics())
+        return video_process_result
 
-    def upload_thumbnail_image_to_s3(
+    def process_clips(
             self,
-            root_path: str,
-            object_key: str,
-            object_content: str) -> model_pb2.ThumbnailUploadResult:
+            video_id: str,
+            clips: list[model_pb2.Clip],
+            trim_mode: model_pb2.TrimMode = model_pb2.TRIM_MODE_COPY,
+            max_workers: int = BATCH_UPLOAD_CONCURRENCY) -> model_pb2.BatchVideoProcessResult:
+        """
+        Process many clips of the same video, downloading the video once and cutting all the clips out of it.
+
+        :param video_id: ID of the video
+        :param clips: Clips of the video, with their trim, title, thumbnail and whether to download them
+        :param trim_mode: Mode of trimming, stream copy by default or frame accurate smart cut
+        :param max_workers: Maximum number of clips uploaded at the same time
+        :return: Result of the download, and of processing each clip
+        """
+        video_names = [f"{video_id}_{clip.start_time_in_sec}_{clip.end_time_in_sec}.mkv" for clip in clips]
+        # Clips with the same trim share the same file, which is cut once
+        ranges = {
+            video_name: (clip.start_time_in_sec, clip.end_time_in_sec) for clip, video_name in zip(clips, video_names)}
+        target_profile = self._get_target_profile()
+        estimated_size = self.download_platform.estimate_download_size(
+            video_id,
+            min((start for start, _ in ranges.values()), default=0),
+            max((end for _, end in ranges.values()), default=0),
+            target_profile)
+
+        batch_result = model_pb2.BatchVideoProcessResult(video_id=video_id)
+        metrics = Metrics()
+        with self.scratch_space.allocate(
+                f"{video_id}_clips_{uuid.uuid4().hex}", estimated_size) as download_path, ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix='clip') as executor, metrics.stage('total'):
+            # The thumbnails are fetched while the video downloads
+            image_futures = {
+                clip.image_identifier: executor.submit(self._download_image, clip.image_identifier, metrics)
+                for clip in clips if clip.image_identifier}
+
+            download_error = None
+            try:
+                with metrics.stage('download'):
+                    batch_result.download_result.CopyFrom(self.download_platform.download_clips(
+                        video_id,
+                        list(ranges.values()),
+                        download_path,
+                        list(ranges),
+                        trim_mode,
+                        metrics=metrics,
+                        target_profile=target_profile,
+                        download_tuning=self.download_tuning))
+                metrics.add_bytes('download', batch_result.download_result.bytes_downloaded)
+            except VimeoUploaderInternalServerError as e:
+                logging.error("Failed to download the clips of video id %s", video_id)
+                download_error = f"Failed to download the video: {e}"
+
+            clip_futures = [
+                executor.submit(
+                    self._process_clip,
+                    clip,
+                    os.path.join(download_path, video_name),
+                    image_futures.get(clip.image_identifier),
+                    download_error,
+                    metrics)
+                for clip, video_name in zip(clips, video_names)]
+            batch_result.clip_results.extend(future.result() for future in clip_futures)
+        if self.emit_metrics:
+            metrics.emit('process_clips')
+        if self.extended_result:
+            batch_result.stage_metrics.extend(metrics.get_stage_metrics())
+        return batch_result
+
+    def _fan_out_upload(
+            self,
+            upload: Callable[[StreamingPlatform, str, Optional[Callable[[float], None]]], str],
+            progress_callback: Callable[[float], None] = None) -> dict[str, model_pb2.UploadResult]:
+        """
+        Upload the video to every upload platform at the same time, each platform limited to a few uploads at the same
+        time across the requests of the container. A platform failing is recorded in its result, without failing the
+        uploads to the others.
+
+        :param upload: Function uploading the video to a platform, taking the platform, its platform string and the
+        callback of its progress, and returning the URL of the uploaded video
+        :param progress_callback: Callback taking the uploaded fraction of the video across the platforms
+        :return: Result of the upload by platform string
+        """
+        names = list(self.upload_platforms)
+        fractions = dict.fromkeys(names, 0.0)
+        fractions_lock = threading.Lock()
+
+        def get_platform_progress_callback(name: str) -> Optional[Callable[[float], None]]:
+            if not progress_callback:
+                return None
+
+            def platform_progress_callback(fraction: float) -> None:
+                with fractions_lock:
+                    fractions[name] = fraction
+                    overall = sum(fractions.values()) / len(fractions)
+                progress_callback(overall)
+            return platform_progress_callback
+
+        def upload_to_platform(name: str) -> model_pb2.UploadResult:
+            upload_platform = self.upload_platforms[name]
+            if upload_platform is None:
+                return model_pb2.UploadResult(error=f"Platform {name} is not supported")
+            try:
+                with get_upload_semaphore(name):
+                    upload_url = upload(upload_platform, name, get_platform_progress_callback(name))
+            except Exception as e:
+                logging.error("Failed to upload the video to %s: %s", name, e)
+                return model_pb2.UploadResult(error=f"Failed to upload the video: {e}")
+            return model_pb2.UploadResult(uploaded=True, upload_url=upload_url)
+
+        with ThreadPoolExecutor(max_workers=max(len(names), 1), thread_name_prefix='upload') as executor:
+            upload_results = dict(zip(names, executor.map(upload_to_platform, names)))
+        if names and not any(upload_result.uploaded for upload_result in upload_results.values()):
+            raise VimeoUploaderInternalServerError(f"Failed to upload the video to any of {names}")
+        return upload_results
+
+    def _process_clip(
+            self,
+            clip: model_pb2.Clip,
+            video_path: str,
+            image_future: Future,
+            download_error: str = None,
+            metrics: Metrics = None) -> model_pb2.ClipProcessResult:
         """
-        Upload thumbnail image to s3
+        Upload a downloaded clip, recording the failure in the result rather than raising it.
+
+        :param clip: Clip of the video
+        :param video_path: Path of the downloaded clip
+        :param image_future: Future of the content of the downloaded thumbnail image, if any
+        :param download_error: Error of downloading the video, if it failed
+        :param metrics: Metrics of the batch, which the upload stages of each clip add up into
+        :return: Result of processing the clip
         """
-        image_path = os.path.join(root_path, object_key)
-        with open(image_path, 'wb') as file:
-            file.write(base64.b64decode(object_content.encode('utf-8')))
-        s3_url = self._upload_file_to_s3(
-            object_key,
-            image_path,
-            os.environ['S3_THUMBNAIL_BUCKET_NAME'])
+        metrics = metrics or Metrics()
+        clip_result = model_pb2.ClipProcessResult(clip=clip)
+        try:
+            if download_error:
+                raise VimeoUploaderInternalServerError(download_error)
+            if not os.path.exists(video_path):
+                raise VimeoUploaderInternalServerError("Failed to download the clip")
+            image_data = image_future.result() if image_future else None
+            if self.allow_upload:
+                with metrics.stage('upload'):
+                    clip_result.upload_url = self.upload_platform.upload_video(
+                        video_path, clip.title or self._get_default_title(), image_data)
+                metrics.add_bytes('upload', os.path.getsize(video_path))
+            if self.allow_download and clip.download:
+                with metrics.stage('upload_to_s3'):
+                    clip_result.download_url = self._upload_file_to_s3(
+                        os.path.basename(os.path.splitext(video_path)[0]),
+                        video_path,
+                        os.environ['S3_VIDEO_BUCKET_NAME'],
+                        metrics=metrics)
+        except Exception as e:
+            logging.error(
+                "Failed to process clip %d-%d: %s", clip.start_time_in_sec, clip.end_time_in_sec, e)
+            clip_result.error = str(e)
+            return clip_result
+        clip_result.processed = True
+        return clip_result
+
+    def upload_thumbnail_image_to_s3(self, object_content: str) -> model_pb2.ThumbnailUploadResult:
+        """
+        Upload thumbnail image to s3 from memory. Images are stored under the hash of their content, so an image which
+        is already on s3 is not uploaded again.
+
+        :param object_content: Content of the image, base64 encoded
+        :return:
+        """
+        image_data = base64.b64decode(object_content)
+        object_key = hashlib.sha256(image_data).hexdigest()
+        bucket_name = os.environ['S3_THUMBNAIL_BUCKET_NAME']
+        try:
+            if self._exists_on_s3(object_key, bucket_name):
+                logging.info("Thumbnail image %s is already on s3", object_key)
+            else:
+                self.s3_client.put_object(Bucket=bucket_name, Key=object_key, Body=image_data)
+            s3_url = self._generate_presigned_url(object_key, bucket_name)
+        except (ClientError, NoCredentialsError) as e:
+            logging.error("Failed to upload thumbnail image %s to s3: %s", object_key, e)
+            raise VimeoUploaderInternalServerError(
+                "Failed to upload the image to s3")
         return model_pb2.ThumbnailUploadResult(
             object_key=object_key,
             s3_url=s3_url
@@ -146,49 +881,218 @@ class Driver:
             object_key: str,
             object_path: str,
             bucket_name: str,
-            expires_in: int = 1 * 3600) -> str:
+            expires_in: int = 1 * 3600,
+            metadata: dict = None,
+            progress_callback: Callable[[float], None] = None,
+            checkpoint: StageCheckpointer = None,
+            metrics: Metrics = None) -> str:
         """
         Upload file to S3 (with image identifier).
 
         :param object_key: Key of the object
         :param object_path: Path to the object
         :expires_in: Expiry time of object on S3 (in seconds)
+        :param metadata: Metadata stored with the object
+        :param progress_callback: Callback taking the uploaded fraction of the file
+        :param checkpoint: Checkpoint of the upload, so a failed upload is resumed by the next attempt
+        :param metrics: Metrics of the request, which the transfer is added to in the upload_to_s3 stage
         :return:
         """
         try:
-            self.s3_client.upload_file(object_path,
-                                       bucket_name,
-                                       object_key)
-            url = self.s3_client.generate_presigned_url(
-                ClientMethod='get_object', Params={
-                    'Bucket': bucket_name,
-                    'Key': object_key,
-                },
-                ExpiresIn=expires_in
-            )
-        except (FileNotFoundError, NoCredentialsError):
+            transfer_metrics = self.s3_transfer.upload_file(object_path,
+                                                            bucket_name,
+                                                            object_key,
+                                                            {'Metadata': metadata} if metadata else None,
+                                                            progress_callback,
+                                                            checkpoint)
+            url = self._generate_presigned_url(object_key, bucket_name, expires_in)
+        except (FileNotFoundError, ClientError, NoCredentialsError) as e:
             logging.error(
-                "Failed to upload object with key % and file %s to s3",
+                "Failed to upload object with key %s and file %s to s3: %s",
                 object_key,
-                object_path)
+                object_path,
+                e)
             raise VimeoUploaderInternalServerError(
                 "Failed to upload the file to s3")
+        if metrics:
+            metrics.record_transfer('upload_to_s3', transfer_metrics)
         return url
 
-    def _download_image_to_file(
+    def _stream_video_to_s3(
             self,
-            image_identifier: str,
-            root_path: str) -> str:
+            video_id: str,
+            start_time_in_sec: int,
+            end_time_in_sec: int,
+            trim_mode: model_pb2.TrimMode,
+            object_key: str,
+            bucket_name: str,
+            metadata: dict = None,
+            target_profile: model_pb2.TargetProfile = None) -> model_pb2.DownloadResult:
         """
-        Download image from S3 (with image identifier) to disk.
+        Stream the trimmed video into S3 while the download platform produces it.
 
-        :param image_identifier: Image identifier on S3.
-        :param root_path: Root path of file
+        :param video_id: ID of the video
+        :param start_time_in_sec: Start time of trim in seconds
+        :param end_time_in_sec: End time of trim in seconds
+        :param trim_mode: Mode of trimming
+        :param object_key: Key of the object
+        :param bucket_name: Name of the bucket
+        :param metadata: Metadata stored with the object
+        :param target_profile: Profile of the target platform the formats of the video are selected for
+        :return: Result of the download, with the size of the streamed video
+        """
+        try:
+            with self.download_platform.stream_video(
+                    video_id, start_time_in_sec, end_time_in_sec, trim_mode, target_profile) as stream:
+                metrics = self.s3_transfer.upload_stream(
+                    stream, bucket_name, object_key, {'Metadata': metadata} if metadata else None)
+        except Exception as e:
+            logging.error("Failed to stream video id %s to s3: %s", video_id, e)
+            raise VimeoUploaderInternalServerError("Failed to stream the video to s3")
+        return model_pb2.DownloadResult(
+            downloaded=True, mode=model_pb2.DOWNLOAD_MODE_STREAM, bytes_downloaded=metrics['size_in_bytes'])
+
+    def _restore_download(
+            self,
+            checkpointer: Checkpointer,
+            video_path: str,
+            metrics: Metrics = None) -> Optional[model_pb2.DownloadResult]:
+        """
+        Restore the video downloaded by an earlier attempt at the request, if its copy is intact. The local copy only
+        survives on the same container, so the copy uploaded to S3 by the earlier attempt is fetched otherwise.
+
+        :param checkpointer: Checkpoint of the request
+        :param video_path: Path of the downloaded video
+        :param metrics: Metrics of the request, which the copy fetched from S3 is recorded in as the restore stage
+        :return: Result of the earlier download, or None if the video has to be downloaded again
+        """
+        metrics = metrics or Metrics()
+        state = checkpointer.get('download')
+        if state.attributes.get('bucket_name'):
+            # A streamed video is on S3 as long as the object has its full size
+            try:
+                response = self.s3_client.head_object(Bucket=state.attributes['bucket_name'], Key=state.artifact)
+            except ClientError:
+                return None
+            return model_pb2.DownloadResult.FromString(state.result) if response['ContentLength'] == state.size else None
+        reused = os.path.exists(video_path) and os.path.getsize(video_path) == state.size
+        if not reused:
+            s3_state = checkpointer.get('upload_to_s3')
+            if not (s3_state.completed and s3_state.sha256 == state.sha256):
+                return None
+            os.makedirs(os.path.dirname(video_path), exist_ok=True)
+            try:
+                with metrics.stage('restore'):
+                    transfer_metrics = self.s3_transfer.download_file(
+                        s3_state.attributes['bucket_name'], s3_state.artifact, video_path, state.size)
+                metrics.record_transfer('restore', transfer_metrics)
+            except ClientError as e:
+                logging.warning("Failed to restore the video %s from s3: %s", video_path, e)
+                return None
+        if get_file_sha256(video_path) != state.sha256:
+            logging.warning("Video %s does not match its checkpoint", video_path)
+            return None
+        if reused:
+            self.scratch_space.record_reuse(video_path)
+        logging.info("Restored the video %s from its checkpoint", video_path)
+        return model_pb2.DownloadResult.FromString(state.result)
+
+    def _get_target_profile(self) -> Optional[model_pb2.TargetProfile]:
+        """
+        Get the profile of the target platform, which the formats of the video are selected for.
+
+        :return: Profile of the upload platform, or None to download the best formats if nothing is uploaded
+        """
+        if not self.allow_upload:
+            return None
+        if self.upload_platforms is None:
+            return self.upload_platform.get_target_profile() if self.upload_platform else None
+        # The formats are selected for all the platforms at once, only if they share the same profile
+        target_profiles = [
+            upload_platform.get_target_profile() if upload_platform else None
+            for upload_platform in self.upload_platforms.values()]
+        if not target_profiles or any(target_profile != target_profiles[0] for target_profile in target_profiles):
+            return None
+        return target_profiles[0]
+
+    def _get_upload_platform_names(self) -> str:
+        """
+        :return: Names of the platforms the video is uploaded to, telling apart requests to different platforms
+        """
+        if self.upload_platforms is None:
+            return type(self.upload_platform).__name__
+        return ','.join(self.upload_platforms)
+
+    def _get_metadata_cache_key(self, video_id: str) -> str:
+        """
+        Get the key of the video in the metadata cache, as the same video ID may exist on different platforms.
+
+        :param video_id: ID of the video
         :return:
         """
-        image_path = os.path.join(root_path, image_identifier)
-        self.s3_client.download_file(
-            os.environ['S3_THUMBNAIL_BUCKET_NAME'],
-            image_identifier,
-            image_path)
-        return image_path
+        return f"{type(self.download_platform).__name__.lower()}_{video_id}"
+
+    @staticmethod
+    def _get_default_title() -> str:
+        """
+        Get the title of videos uploaded without one, from the current date.
+
+        :return:
+        """
+        today = date.today()
+        current_date = today.strftime("%m/%d/%y")
+        return f"(CW) {current_date}"
+
+    def _generate_presigned_url(
+            self,
+            object_key: str,
+            bucket_name: str,
+            expires_in: int = 1 * 3600) -> str:
+        """
+        Generate presigned URL to download the object from S3.
+
+        :param object_key: Key of the object
+        :param bucket_name: Name of the bucket
+        :expires_in: Expiry time of the URL (in seconds)
+        :return:
+        """
+        return self.s3_client.generate_presigned_url(
+            ClientMethod='get_object', Params={
+                'Bucket': bucket_name,
+                'Key': object_key,
+            },
+            ExpiresIn=expires_in
+        )
+
+    def _download_image(self, image_identifier: str, metrics: Metrics = None) -> bytes:
+        """
+        Download image from S3 (with image identifier) to memory.
+
+        :param image_identifier: Image identifier on S3.
+        :param metrics: Metrics of the request, which the download is recorded in as the thumbnail stage
+        :return: Content of the image
+        """
+        metrics = metrics or Metrics()
+        with metrics.stage('thumbnail'):
+            image_data = self.s3_client.get_object(
+                Bucket=os.environ['S3_THUMBNAIL_BUCKET_NAME'],
+                Key=image_identifier)['Body'].read()
+        metrics.add_bytes('thumbnail', len(image_data))
+        return image_data
+
+    def _exists_on_s3(self, object_key: str, bucket_name: str) -> bool:
+        """
+        Check whether the object is on S3.
+
+        :param object_key: Key of the object
+        :param bucket_name: Name of the bucket
+        :return: True if the object exists
+        """
+        try:
+            self.s3_client.head_object(Bucket=bucket_name, Key=object_key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in MISSING_OBJECT_ERROR_CODES:
+                # Without list permission S3 answers 403 for missing keys, the object is uploaded either way
+                logging.warning("Failed to look up object %s: %s", object_key, e)
+            return False
+        return True
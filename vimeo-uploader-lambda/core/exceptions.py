@@ -8,3 +8,9 @@ class VimeoUploaderInvalidVideoIdError(Exception):
     """
     Error thrown for video id not found
     """
+
+
+class VimeoUploaderInvalidRequestError(Exception):
+    """
+    Error thrown for a request with invalid input, such as an unknown option
+    """
@@ -0,0 +1,188 @@
+import logging
+from typing import Optional
+
+from core.generated import model_pb2
+
+# Prefixes of the codec strings reported by yt-dlp (such as avc1.640028 or mp4a.40.2), by codec name
+CODEC_PREFIXES: dict = {
+    'h264': ('avc1', 'avc3', 'h264'),
+    'hevc': ('hvc1', 'hev1', 'hevc', 'h265'),
+    'vp9': ('vp09', 'vp9'),
+    'av1': ('av01', 'av1'),
+    'aac': ('mp4a', 'aac'),
+    'opus': ('opus',),
+    'vorbis': ('vorbis',),
+    'mp3': ('mp3',),
+}
+# Codecs which can be stream copied into each container, without re-encoding
+CONTAINER_CODECS: dict = {
+    'mp4': {'h264', 'hevc', 'av1', 'aac', 'mp3'},
+    'webm': {'vp9', 'av1', 'opus', 'vorbis'},
+}
+
+
+def get_codec_name(codec: Optional[str]) -> Optional[str]:
+    """
+    Get the name of the codec of a format.
+
+    :param codec: Codec string reported by yt-dlp
+    :return: Name of the codec, or None if the format has no such stream
+    """
+    if not codec or codec == 'none':
+        return None
+    codec = codec.lower()
+    return next(
+        (name for name, prefixes in CODEC_PREFIXES.items() if codec.startswith(prefixes)), codec.split('.')[0])
+
+
+def get_target_profile_key(target_profile: Optional[model_pb2.TargetProfile]) -> str:
+    """
+    Get a stable description of the target profile, telling apart clips downloaded for different targets.
+
+    :param target_profile: Target profile, or None for no target
+    :return: Description of the target profile, empty for no target
+    """
+    if not target_profile:
+        return ''
+    return ';'.join([
+        f"max_height={target_profile.max_height}",
+        f"video_codecs={','.join(target_profile.video_codecs)}",
+        f"audio_codecs={','.join(target_profile.audio_codecs)}",
+        f"container={target_profile.container}",
+        f"max_bytes={target_profile.max_bytes}",
+    ])
+
+
+class FormatCandidate:
+    """
+    Formats downloaded together for a video, either a single format with video and audio, or a video only format with
+    an audio only format to merge.
+    """
+
+    def __init__(self, formats: list[dict], duration: Optional[float]) -> None:
+        """
+        :param formats: Formats of the candidate, with the video first
+        :param duration: Duration of the video in seconds, used for estimating sizes from bitrates
+        """
+        self.formats = formats
+        self.height = max((f.get('height') or 0 for f in formats if f.get('vcodec') != 'none'), default=0)
+        self.video_codec = get_codec_name(next((f.get('vcodec') for f in formats if f.get('vcodec') != 'none'), None))
+        self.audio_codec = get_codec_name(next((f.get('acodec') for f in formats if f.get('acodec') != 'none'), None))
+        self.size = sum(self._estimate_size(f, duration) for f in formats)
+
+    @property
+    def format_id(self) -> str:
+        return '+'.join(f['format_id'] for f in self.formats)
+
+    @property
+    def muxed(self) -> bool:
+        """
+        :return: True if the video and audio come in a single format, so nothing is merged
+        """
+        return len(self.formats) == 1
+
+    @staticmethod
+    def _estimate_size(fmt: dict, duration: Optional[float]) -> float:
+        """
+        Estimate the size of a format, from its bitrate when the size is not reported.
+
+        :param fmt: Format of the video
+        :param duration: Duration of the video in seconds
+        :return: Estimated size in bytes, or infinity if unknown, so unknown sizes are never the cheapest
+        """
+        size = fmt.get('filesize') or fmt.get('filesize_approx')
+        if not size and fmt.get('tbr') and duration:
+            # The bitrate is in kbit/s
+            size = fmt['tbr'] * duration * 125
+        return size or float('inf')
+
+
+class FormatSelector:
+    """
+    Selector of the formats of a video for a target profile, such as the upload platform. The best resolution within
+    the target is kept, and the cheapest formats of that resolution are downloaded, preferring formats which can be
+    stream copied into the target container, then a single format with both video and audio over two formats to merge.
+    Each constraint of the target is relaxed when no format meets it, so a video is always downloaded.
+    """
+
+    def __init__(self, target_profile: model_pb2.TargetProfile) -> None:
+        """
+        :param target_profile: Target profile of the video
+        """
+        self.target_profile = target_profile
+
+    def select(self, formats: list[dict], duration: float = None) -> Optional[FormatCandidate]:
+        """
+        Select the formats to download.
+
+        :param formats: Formats of the video extracted by yt-dlp
+        :param duration: Duration of the video in seconds
+        :return: Selected formats, or None if none has video and audio
+        """
+        candidates = self._get_candidates(formats, duration)
+        if not candidates:
+            return None
+        target_profile = self.target_profile
+        if target_profile.max_height:
+            # Above the target, the lowest resolution comes closest to it
+            lowest_height = min(c.height for c in candidates)
+            candidates = self._prefer(
+                candidates, lambda c: c.height <= max(target_profile.max_height, lowest_height))
+        if target_profile.video_codecs:
+            candidates = self._prefer(candidates, lambda c: c.video_codec in target_profile.video_codecs)
+        if target_profile.audio_codecs:
+            candidates = self._prefer(candidates, lambda c: c.audio_codec in target_profile.audio_codecs)
+        if target_profile.max_bytes:
+            within_budget = [c for c in candidates if c.size <= target_profile.max_bytes]
+            # Over budget, the cheapest formats come closest to it
+            candidates = within_budget or [min(candidates, key=lambda c: c.size)]
+
+        height = max(c.height for c in candidates)
+        selected = min(
+            (c for c in candidates if c.height == height),
+            key=lambda c: (not self._is_stream_copy_compatible(c), c.size, not c.muxed))
+        logging.info(
+            "Selected format %s of %dp and estimated size %s for the target profile",
+            selected.format_id, selected.height, selected.size)
+        return selected
+
+    def _is_stream_copy_compatible(self, candidate: FormatCandidate) -> bool:
+        """
+        :param candidate: Formats of the video
+        :return: True if the codecs can be stream copied into the target container, or there is no target container
+        """
+        codecs = CONTAINER_CODECS.get(self.target_profile.container)
+        return codecs is None or {candidate.video_codec, candidate.audio_codec} <= codecs
+
+    @staticmethod
+    def _prefer(candidates: list[FormatCandidate], predicate) -> list[FormatCandidate]:
+        """
+        :param candidates: Formats of the video
+        :param predicate: Constraint of the target
+        :return: Candidates meeting the constraint, or all of them if none does
+        """
+        return [c for c in candidates if predicate(c)] or candidates
+
+    @staticmethod
+    def _get_candidates(formats: list[dict], duration: Optional[float]) -> list[FormatCandidate]:
+        """
+        Get the formats which can be downloaded together for a video with audio.
+
+        :param formats: Formats of the video extracted by yt-dlp
+        :param duration: Duration of the video in seconds
+        :return: Single formats with video and audio, and pairs of video only and audio only formats
+        """
+        # Storyboards and other image formats have neither codec
+        formats = [f for f in formats if f.get('format_id') and (f.get('vcodec'), f.get('acodec')) != ('none', 'none')]
+        muxed = [f for f in formats if f.get('vcodec') != 'none' and f.get('acodec') != 'none']
+        video_only = [f for f in formats if f.get('vcodec') != 'none' and f.get('acodec') == 'none']
+        # Audio is small next to the video, so only the best audio of each codec is paired with the video
+        best_audio = {}
+        for f in formats:
+            if f.get('vcodec') == 'none' and f.get('acodec') != 'none':
+                codec = get_codec_name(f.get('acodec'))
+                if codec not in best_audio or (f.get('abr') or f.get('tbr') or 0) > \
+                        (best_audio[codec].get('abr') or best_audio[codec].get('tbr') or 0):
+                    best_audio[codec] = f
+        return [FormatCandidate([f], duration) for f in muxed] + [
+            FormatCandidate([video, audio], duration) for video in video_only for audio in best_audio.values()]
@@ -0,0 +1,301 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Callable, Optional
+
+from botocore.exceptions import ClientError
+
+from core.clients import get_s3_client
+from core.exceptions import VimeoUploaderInternalServerError
+from core.generated import model_pb2
+from core.scratch import get_scratch_space
+
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
+
+# Name of the local store of the jobs in the scratch space
+JOB_STORE_NAME: str = "jobs.sqlite"
+# Minimum time between two saves of the progress of a running job, as each save is a write to the store
+JOB_PROGRESS_INTERVAL_IN_SEC: float = 2
+# Maximum duration of a Lambda invocation, after which a job still running is known to have been killed
+JOB_TIMEOUT_IN_SEC: int = 15 * 60
+# Share of the job each stage accounts for, in percent
+JOB_STAGE_WEIGHTS: dict = {
+    'download': 50,
+    'upload': 40,
+    'upload_to_s3': 10,
+}
+
+
+class JobStore(ABC):
+    """
+    Store of the state of the jobs, shared by the handlers submitting, running and reporting them.
+    """
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[model_pb2.JobState]:
+        """
+        :param job_id: ID of the job
+        :return: State of the job, or None if missing
+        """
+        pass
+
+    @abstractmethod
+    def put(self, job_state: model_pb2.JobState) -> None:
+        """
+        :param job_state: State of the job
+        """
+        pass
+
+    @abstractmethod
+    def put_if_unchanged(self, job_state: model_pb2.JobState, previous: model_pb2.JobState) -> bool:
+        """
+        :param job_state: State of the job
+        :param previous: State the job is expected to be stored with
+        :return: True if the state was saved, false if the stored state is no longer the previous state
+        """
+        pass
+
+
+class S3JobStore(JobStore):
+    """
+    Job store keeping the state of each job as an object on S3.
+    """
+
+    def __init__(self, s3_client: 'BaseClient', bucket_name: str, prefix: str = "jobs/") -> None:
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+
+    def get(self, job_id: str) -> Optional[model_pb2.JobState]:
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=self.prefix + job_id)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        return model_pb2.JobState.FromString(response['Body'].read())
+
+    def put(self, job_state: model_pb2.JobState) -> None:
+        self.s3_client.put_object(
+            Bucket=self.bucket_name, Key=self.prefix + job_state.job_id, Body=job_state.SerializeToString())
+
+    def put_if_unchanged(self, job_state: model_pb2.JobState, previous: model_pb2.JobState) -> bool:
+        key = self.prefix + job_state.job_id
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        if model_pb2.JobState.FromString(response['Body'].read()) != previous:
+            return False
+        try:
+            # The write only succeeds if nobody wrote the object since it was read
+            self.s3_client.put_object(
+                Bucket=self.bucket_name, Key=key, Body=job_state.SerializeToString(), IfMatch=response['ETag'])
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                return False
+            raise
+        return True
+
+
+class SQLiteJobStore(JobStore):
+    """
+    Job store keeping the state of the jobs in a local SQLite database, standing in for a shared store.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, state BLOB)")
+
+    def get(self, job_id: str) -> Optional[model_pb2.JobState]:
+        with self.lock:
+            row = self.connection.execute("SELECT state FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return model_pb2.JobState.FromString(row[0]) if row else None
+
+    def put(self, job_state: model_pb2.JobState) -> None:
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, state) VALUES (?, ?)",
+                (job_state.job_id, job_state.SerializeToString(deterministic=True)))
+
+    def put_if_unchanged(self, job_state: model_pb2.JobState, previous: model_pb2.JobState) -> bool:
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "UPDATE jobs SET state = ? WHERE job_id = ? AND state = ?",
+                (job_state.SerializeToString(deterministic=True), job_state.job_id,
+                 previous.SerializeToString(deterministic=True)))
+        return cursor.rowcount == 1
+
+
+class JobProgress:
+    """
+    Progress of a running job, saved to the job store as its stages advance. Saves are spaced out, except when a
+    stage completes.
+    """
+
+    def __init__(
+            self,
+            job_store: JobStore,
+            job_state: model_pb2.JobState,
+            interval_in_sec: float = JOB_PROGRESS_INTERVAL_IN_SEC) -> None:
+        """
+        :param job_store: Store of the state of the job
+        :param job_state: State of the job
+        :param interval_in_sec: Minimum time between two saves in seconds
+        """
+        self.job_store = job_store
+        self.job_state = job_state
+        self.interval_in_sec = interval_in_sec
+        self.fractions = {}
+        self.saved_at = float("-inf")
+        self.lock = threading.Lock()
+
+    def get_callback(self, stage: str) -> Callable[[float], None]:
+        """
+        Get the callback reporting the progress of the stage.
+
+        :param stage: Name of the stage
+        :return: Callback taking the completed fraction of the stage
+        """
+        return lambda fraction: self.update(stage, fraction)
+
+    def update(self, stage: str, fraction: float) -> None:
+        """
+        Record the progress of the stage, and save it if it is due.
+
+        :param stage: Name of the stage
+        :param fraction: Completed fraction of the stage, between 0 and 1
+        """
+        with self.lock:
+            self.fractions[stage] = min(1.0, max(self.fractions.get(stage, 0.0), fraction))
+            self.job_state.stage = stage
+            self.job_state.percent_complete = round(sum(
+                weight * self.fractions.get(name, 0.0) for name, weight in JOB_STAGE_WEIGHTS.items()), 1)
+            now = time.monotonic()
+            if fraction >= 1 or now - self.saved_at >= self.interval_in_sec:
+                self.saved_at = now
+                self._save()
+
+    def _save(self) -> None:
+        self.job_state.updated_at = int(time.time())
+        try:
+            self.job_store.put(self.job_state)
+        except Exception as e:
+            # The progress is only informative, the job goes on
+            logging.warning("Failed to save the progress of job %s: %s", self.job_state.job_id, e)
+
+
+def create_job(job_store: JobStore, request: dict) -> model_pb2.JobState:
+    """
+    Create a pending job for the request.
+
+    :param job_store: Store of the state of the jobs
+    :param request: Request run by the job
+    :return: State of the created job
+    """
+    now = int(time.time())
+    job_state = model_pb2.JobState(
+        job_id=str(uuid.uuid4()),
+        status=model_pb2.JOB_STATUS_PENDING,
+        request=json.dumps(request),
+        created_at=now,
+        updated_at=now)
+    job_store.put(job_state)
+    return job_state
+
+
+def start_job(job_store: JobStore, job_state: model_pb2.JobState) -> bool:
+    """
+    Start the job if it is pending, so a job delivered again to the worker is not run twice. A job left running by an
+    invocation which was killed is failed instead.
+
+    :param job_store: Store of the state of the jobs
+    :param job_state: State of the job, updated if the job is started or failed
+    :return: True if the job was started by this call
+    """
+    updated = model_pb2.JobState()
+    updated.CopyFrom(job_state)
+    updated.updated_at = int(time.time())
+    if job_state.status == model_pb2.JOB_STATUS_RUNNING and \
+            updated.updated_at - job_state.updated_at >= JOB_TIMEOUT_IN_SEC:
+        updated.status = model_pb2.JOB_STATUS_FAILED
+        updated.error = "Job timed out"
+        if job_store.put_if_unchanged(updated, job_state):
+            job_state.CopyFrom(updated)
+        return False
+    if job_state.status != model_pb2.JOB_STATUS_PENDING:
+        return False
+    updated.status = model_pb2.JOB_STATUS_RUNNING
+    if not job_store.put_if_unchanged(updated, job_state):
+        return False
+    job_state.CopyFrom(updated)
+    return True
+
+
+def run_job(
+        job_store: JobStore,
+        job_state: model_pb2.JobState,
+        run: Callable[[JobProgress], model_pb2.VideoProcessResult]) -> model_pb2.JobState:
+    """
+    Run the job if it is pending, saving its progress and then its result or error.
+
+    :param job_store: Store of the state of the jobs
+    :param job_state: State of the job
+    :param run: Function processing the request of the job, reporting its progress
+    :return: State of the finished job, or its stored state if it was not pending
+    """
+    if not start_job(job_store, job_state):
+        logging.info("Job %s is %s, not running it", job_state.job_id, model_pb2.JobStatus.Name(job_state.status))
+        return job_state
+    progress = JobProgress(job_store, job_state)
+    try:
+        result = run(progress)
+    except Exception as e:
+        logging.error("Job %s failed: %s", job_state.job_id, e)
+        with progress.lock:
+            job_state.status = model_pb2.JOB_STATUS_FAILED
+            job_state.error = str(e)
+            job_state.updated_at = int(time.time())
+            job_store.put(job_state)
+        return job_state
+    with progress.lock:
+        job_state.status = model_pb2.JOB_STATUS_SUCCEEDED
+        job_state.percent_complete = 100
+        job_state.result.CopyFrom(result)
+        job_state.updated_at = int(time.time())
+        job_store.put(job_state)
+    return job_state
+
+
+_job_store: Optional[JobStore] = None
+_job_store_lock = threading.Lock()
+
+
+def get_job_store() -> JobStore:
+    """
+    Get the job store of the process, which requires a bucket on Lambda, as the job functions run in separate containers.
+
+    :return: Job store
+    """
+    global _job_store
+    with _job_store_lock:
+        if _job_store is None:
+            if os.environ.get('JOB_STORE_BUCKET_NAME'):
+                _job_store = S3JobStore(get_s3_client(), os.environ['JOB_STORE_BUCKET_NAME'])
+            elif os.environ.get('AWS_LAMBDA_FUNCTION_NAME'):
+                raise VimeoUploaderInternalServerError(
+                    "JOB_STORE_BUCKET_NAME is required on Lambda, as a local job store is not seen by the other functions")
+            else:
+                _job_store = SQLiteJobStore(
+                    os.environ.get('JOB_STORE_PATH') or get_scratch_space().get_store_path(JOB_STORE_NAME))
+        return _job_store
@@ -0,0 +1,328 @@
+import dbm
+import json
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from enum import Enum
+from typing import TYPE_CHECKING, Optional
+from urllib.parse import quote
+
+from botocore.exceptions import ClientError
+from google.protobuf.json_format import MessageToDict, ParseDict
+
+from core.clients import get_s3_client
+from core.exceptions import VimeoUploaderInvalidRequestError
+from core.generated import model_pb2
+from core.scratch import get_scratch_space
+
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
+
+METADATA_CACHE_TTL_IN_SEC: int = 6 * 3600
+METADATA_CACHE_MAX_ENTRIES: int = 1024
+METADATA_CACHE_DISK_NAME: str = "metadata-cache"
+
+
+class CacheControl(Enum):
+    """
+    How a request uses the metadata cache
+    """
+    DEFAULT = 1
+    # Neither read nor write the cache
+    BYPASS = 2
+    # Drop the cached entry, then look up and cache the metadata again
+    INVALIDATE = 3
+
+
+def get_cache_control(cache_control: str) -> CacheControl:
+    """
+    Fetch cache control from cache control string, defaulting to using the cache.
+
+    :param cache_control: Cache control string, either bypass or invalidate
+    :return:
+    """
+    if not cache_control:
+        return CacheControl.DEFAULT
+    if cache_control.upper() not in CacheControl.__members__:
+        raise VimeoUploaderInvalidRequestError(f"Cache control {cache_control} is not supported")
+    return CacheControl[cache_control.upper()]
+
+
+class MetadataStore(ABC):
+    """
+    Shared key-value store backing the metadata cache, outliving the container.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        :param key: Key of the entry
+        :return: Value of the entry, or None if missing
+        """
+        pass
+
+    @abstractmethod
+    def put(self, key: str, value: bytes) -> None:
+        """
+        :param key: Key of the entry
+        :param value: Value of the entry
+        """
+        pass
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """
+        :param key: Key of the entry
+        """
+        pass
+
+
+class S3MetadataStore(MetadataStore):
+    """
+    Metadata store keeping each entry as an object on S3.
+    """
+
+    def __init__(self, s3_client: 'BaseClient', bucket_name: str, prefix: str = "metadata/") -> None:
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=self.prefix + key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        return response['Body'].read()
+
+    def put(self, key: str, value: bytes) -> None:
+        self.s3_client.put_object(Bucket=self.bucket_name, Key=self.prefix + key, Body=value)
+
+    def delete(self, key: str) -> None:
+        self.s3_client.delete_object(Bucket=self.bucket_name, Key=self.prefix + key)
+
+
+class LocalMetadataStore(MetadataStore):
+    """
+    Metadata store keeping the entries in a local dbm database, standing in for a shared store.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self.lock, dbm.open(self.path, 'c') as db:
+            return db.get(key)
+
+    def put(self, key: str, value: bytes) -> None:
+        with self.lock, dbm.open(self.path, 'c') as db:
+            db[key] = value
+
+    def delete(self, key: str) -> None:
+        with self.lock, dbm.open(self.path, 'c') as db:
+            if key in db:
+                del db[key]
+
+
+class MetadataCache:
+    """
+    Cache of video metadata with three tiers, each entry expiring after the same time to live:
+    - in-process LRU, for repeated lookups within the container
+    - files in a local store of the scratch space, surviving as long as the warm container
+    - optional shared store, surviving across containers
+    Entries found in a lower tier are copied into the tiers above.
+    """
+
+    def __init__(
+            self,
+            ttl_in_sec: int = METADATA_CACHE_TTL_IN_SEC,
+            max_entries: int = METADATA_CACHE_MAX_ENTRIES,
+            disk_path: Optional[str] = None,
+            shared_store: MetadataStore = None) -> None:
+        """
+        :param ttl_in_sec: Time to live of the entries in seconds
+        :param max_entries: Maximum number of entries kept in memory
+        :param disk_path: Directory of the on-disk tier, or None to disable it
+        :param shared_store: Store of the shared tier, or None to disable it
+        """
+        self.ttl_in_sec = ttl_in_sec
+        self.max_entries = max_entries
+        self.disk_path = disk_path
+        self.shared_store = shared_store
+        self.entries: OrderedDict[str, tuple[float, model_pb2.VideoMetadata]] = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'shared_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0,
+        }
+
+    def get(self, key: str) -> Optional[model_pb2.VideoMetadata]:
+        """
+        Get the cached metadata, from the first tier which has it.
+
+        :param key: Key of the video
+        :return: Metadata for the video, or None if not cached
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] + self.ttl_in_sec > now:
+                self.entries.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return entry[1]
+            if entry:
+                del self.entries[key]
+                self.stats['expirations'] += 1
+
+        cached_at, video_metadata = self._get_from_disk(key, now)
+        if video_metadata:
+            self._put_in_memory(key, video_metadata, cached_at)
+            self._count('disk_hits')
+            return video_metadata
+
+        cached_at, video_metadata = self._get_from_shared_store(key, now)
+        if video_metadata:
+            self._put_in_memory(key, video_metadata, cached_at)
+            self._put_on_disk(key, video_metadata, cached_at)
+            self._count('shared_hits')
+            return video_metadata
+
+        self._count('misses')
+        return None
+
+    def put(self, key: str, video_metadata: model_pb2.VideoMetadata) -> None:
+        """
+        Cache the metadata in every tier.
+
+        :param key: Key of the video
+        :param video_metadata: Metadata for the video
+        """
+        cached_at = time.time()
+        self._put_in_memory(key, video_metadata, cached_at)
+        self._put_on_disk(key, video_metadata, cached_at)
+        if self.shared_store:
+            try:
+                self.shared_store.put(key, json.dumps({
+                    'cached_at': cached_at,
+                    'video_metadata': MessageToDict(video_metadata),
+                }).encode('utf-8'))
+            except Exception as e:
+                logging.warning("Failed to write metadata %s to the shared store: %s", key, e)
+
+    def invalidate(self, key: str) -> None:
+        """
+        Drop the cached metadata from every tier.
+
+        :param key: Key of the video
+        """
+        with self.lock:
+            self.entries.pop(key, None)
+        if self.disk_path:
+            try:
+                os.remove(self._get_disk_path(key))
+            except FileNotFoundError:
+                pass
+        if self.shared_store:
+            try:
+                self.shared_store.delete(key)
+            except Exception as e:
+                logging.warning("Failed to delete metadata %s from the shared store: %s", key, e)
+
+    def _count(self, stat: str) -> None:
+        with self.lock:
+            self.stats[stat] += 1
+
+    def _put_in_memory(self, key: str, video_metadata: model_pb2.VideoMetadata, cached_at: float) -> None:
+        with self.lock:
+            self.entries[key] = (cached_at, video_metadata)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def _get_disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_path, f"{quote(key, safe='')}.pb")
+
+    def _get_from_disk(self, key: str, now: float) -> tuple[float, Optional[model_pb2.VideoMetadata]]:
+        if not self.disk_path:
+            return 0, None
+        path = self._get_disk_path(key)
+        try:
+            cached_at = os.path.getmtime(path)
+            if cached_at + self.ttl_in_sec <= now:
+                os.remove(path)
+                self._count('expirations')
+                return 0, None
+            with open(path, 'rb') as file:
+                return cached_at, model_pb2.VideoMetadata.FromString(file.read())
+        except FileNotFoundError:
+            return 0, None
+        except Exception as e:
+            logging.warning("Failed to read metadata %s from disk: %s", key, e)
+            return 0, None
+
+    def _put_on_disk(self, key: str, video_metadata: model_pb2.VideoMetadata, cached_at: float) -> None:
+        if not self.disk_path:
+            return
+        path = self._get_disk_path(key)
+        try:
+            os.makedirs(self.disk_path, exist_ok=True)
+            # Written aside and renamed, so concurrent readers never see a partial file
+            temp_path = f"{path}.{threading.get_ident()}.temp"
+            with open(temp_path, 'wb') as file:
+                file.write(video_metadata.SerializeToString())
+            os.utime(temp_path, (cached_at, cached_at))
+            os.replace(temp_path, path)
+        except Exception as e:
+            logging.warning("Failed to write metadata %s to disk: %s", key, e)
+
+    def _get_from_shared_store(self, key: str, now: float) -> tuple[float, Optional[model_pb2.VideoMetadata]]:
+        if not self.shared_store:
+            return 0, None
+        try:
+            value = self.shared_store.get(key)
+            if value is None:
+                return 0, None
+            entry = json.loads(value)
+            if entry['cached_at'] + self.ttl_in_sec <= now:
+                self._count('expirations')
+                return 0, None
+            return entry['cached_at'], ParseDict(entry['video_metadata'], model_pb2.VideoMetadata())
+        except Exception as e:
+            logging.warning("Failed to read metadata %s from the shared store: %s", key, e)
+            return 0, None
+
+
+_metadata_cache: Optional[MetadataCache] = None
+_metadata_cache_lock = threading.Lock()
+
+
+def get_metadata_cache() -> MetadataCache:
+    """
+    Get the metadata cache of the process.
+
+    :return: Metadata cache
+    """
+    global _metadata_cache
+    with _metadata_cache_lock:
+        if _metadata_cache is None:
+            shared_store = None
+            if os.environ.get('METADATA_CACHE_BUCKET_NAME'):
+                shared_store = S3MetadataStore(get_s3_client(), os.environ['METADATA_CACHE_BUCKET_NAME'])
+            elif os.environ.get('METADATA_CACHE_STORE_PATH'):
+                shared_store = LocalMetadataStore(os.environ['METADATA_CACHE_STORE_PATH'])
+            _metadata_cache = MetadataCache(
+                ttl_in_sec=int(os.environ.get('METADATA_CACHE_TTL_IN_SEC', METADATA_CACHE_TTL_IN_SEC)),
+                max_entries=int(os.environ.get('METADATA_CACHE_MAX_ENTRIES', METADATA_CACHE_MAX_ENTRIES)),
+                disk_path=get_scratch_space().get_store_path(METADATA_CACHE_DISK_NAME),
+                shared_store=shared_store)
+        return _metadata_cache
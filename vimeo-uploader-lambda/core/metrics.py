@@ -0,0 +1,168 @@
+import contextlib
+import json
+import resource
+import sys
+import threading
+import time
+from typing import Iterator
+
+from core.generated import model_pb2
+
+METRICS_NAMESPACE: str = "VimeoUploader"
+# Metrics of each stage, with their CloudWatch unit
+STAGE_METRIC_UNITS: dict = {
+    'Duration': 'Seconds',
+    'Bytes': 'Bytes',
+    'Throughput': 'Bytes/Second',
+}
+
+
+def get_peak_rss() -> int:
+    """
+    Get the peak resident set size of the process and of its finished child processes, such as ffmpeg. It is the high
+    water mark since the process started, so in a warm container it covers the earlier invocations too.
+
+    :return: Peak resident set size in bytes
+    """
+    # Linux reports the sizes in KiB
+    return 1024 * max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+class Metrics:
+    """
+    Wall time and bytes moved of the stages of a request. Recording a stage only reads the clock, so the metrics are
+    cheap enough to record for every request. A stage recorded several times, such as the upload of each clip of a
+    batch, adds up.
+    """
+
+    def __init__(self) -> None:
+        self.stages: dict[str, model_pb2.StageMetrics] = {}
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Time the stage, recording it even if it fails.
+
+        :param name: Name of the stage
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, duration_in_sec: float, bytes_moved: int = 0) -> None:
+        """
+        Record the run of a stage.
+
+        :param name: Name of the stage
+        :param duration_in_sec: Wall time of the stage in seconds
+        :param bytes_moved: Bytes downloaded or uploaded by the stage
+        """
+        with self.lock:
+            stage_metrics = self._get_stage(name)
+            stage_metrics.duration_in_sec += duration_in_sec
+            stage_metrics.bytes += bytes_moved
+
+    def add_bytes(self, name: str, bytes_moved: int) -> None:
+        """
+        Add the bytes moved by a stage, known apart from its timing.
+
+        :param name: Name of the stage
+        :param bytes_moved: Bytes downloaded or uploaded by the stage
+        """
+        with self.lock:
+            self._get_stage(name).bytes += bytes_moved
+
+    def record_transfer(self, name: str, transfer_metrics: dict) -> None:
+        """
+        Add an S3 transfer to a stage, timed around it, with its bytes and part size.
+
+        :param name: Name of the stage
+        :param transfer_metrics: Metrics of the transfer, returned by S3Transfer
+        """
+        with self.lock:
+            stage_metrics = self._get_stage(name)
+            stage_metrics.bytes += transfer_metrics['size_in_bytes']
+            stage_metrics.part_size_in_bytes = max(
+                stage_metrics.part_size_in_bytes, transfer_metrics['part_size_in_bytes'])
+
+    def get_stage_metrics(self) -> list[model_pb2.StageMetrics]:
+        """
+        :return: Metrics of the recorded stages, in the order they were first recorded
+        """
+        with self.lock:
+            stages_metrics = []
+            for stage_metrics in self.stages.values():
+                stage_metrics = model_pb2.StageMetrics(
+                    stage=stage_metrics.stage,
+                    duration_in_sec=round(stage_metrics.duration_in_sec, 3),
+                    bytes=stage_metrics.bytes,
+                    part_size_in_bytes=stage_metrics.part_size_in_bytes)
+                if stage_metrics.bytes and stage_metrics.duration_in_sec:
+                    stage_metrics.throughput_in_bytes_per_sec = round(
+                        stage_metrics.bytes / stage_metrics.duration_in_sec, 1)
+                stages_metrics.append(stage_metrics)
+            return stages_metrics
+
+    def emit(self, operation: str, namespace: str = METRICS_NAMESPACE) -> None:
+        """
+        Write the metrics of each stage to stdout in the CloudWatch Embedded Metric Format, which CloudWatch Logs turns
+        into metrics by operation and stage without any API call. The peak memory of the process is written once for
+        the invocation, by operation only, as it is not measured per stage.
+
+        :param operation: Operation the stages belong to, such as process_video
+        :param namespace: CloudWatch namespace of the metrics
+        """
+        timestamp = int(time.time() * 1000)
+        lines = []
+        for stage_metrics in self.get_stage_metrics():
+            line = {
+                '_aws': {
+                    'Timestamp': timestamp,
+                    'CloudWatchMetrics': [{
+                        'Namespace': namespace,
+                        'Dimensions': [['Operation', 'Stage']],
+                        'Metrics': [{'Name': name, 'Unit': unit} for name, unit in STAGE_METRIC_UNITS.items()],
+                    }],
+                },
+                'Operation': operation,
+                'Stage': stage_metrics.stage,
+                'Duration': stage_metrics.duration_in_sec,
+                'Bytes': stage_metrics.bytes,
+                'Throughput': stage_metrics.throughput_in_bytes_per_sec,
+            }
+            # Only the S3 transfers have a part size
+            if stage_metrics.part_size_in_bytes:
+                line['_aws']['CloudWatchMetrics'][0]['Metrics'].append({'Name': 'PartSize', 'Unit': 'Bytes'})
+                line['PartSize'] = stage_metrics.part_size_in_bytes
+            lines.append(json.dumps(line))
+        if lines:
+            lines.append(json.dumps({
+                '_aws': {
+                    'Timestamp': timestamp,
+                    'CloudWatchMetrics': [{
+                        'Namespace': namespace,
+                        'Dimensions': [['Operation']],
+                        'Metrics': [{'Name': 'ProcessPeakRSS', 'Unit': 'Bytes'}],
+                    }],
+                },
+                'Operation': operation,
+                'ProcessPeakRSS': get_peak_rss(),
+            }))
+            sys.stdout.write('\n'.join(lines) + '\n')
+            sys.stdout.flush()
+
+    def _get_stage(self, name: str) -> model_pb2.StageMetrics:
+        """
+        Get the metrics of the stage, with the lock held.
+
+        :param name: Name of the stage
+        :return: Metrics of the stage, created on first use
+        """
+        if name not in self.stages:
+            self.stages[name] = model_pb2.StageMetrics(stage=name)
+        return self.stages[name]
@@ -0,0 +1,110 @@
+import logging
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Iterable
+
+from core.exceptions import VimeoUploaderInternalServerError
+
+
+class Stage:
+    """
+    Stage of the processing pipeline, which runs once all the stages it depends on have completed.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            func: Callable[[dict], Any],
+            dependencies: Iterable[str] = ()) -> None:
+        """
+        :param name: Unique name of the stage, which its result is stored under
+        :param func: Function running the stage, called with the results of the completed stages
+        :param dependencies: Names of the stages which must complete before this stage
+        """
+        self.name = name
+        self.func = func
+        self.dependencies = tuple(dependencies)
+
+
+def run_stages(
+        stages: list[Stage],
+        concurrent: bool = False,
+        max_workers: int = 4) -> dict:
+    """
+    Run the stages of the pipeline in dependency order.
+
+    :param stages: Stages of the pipeline, listed in an order which satisfies the dependencies
+    :param concurrent: True if independent stages should run in parallel, false to run them one after another
+    :param max_workers: Maximum number of stages running at the same time, when concurrent
+    :return: Results of the stages by stage name
+    """
+    if not concurrent:
+        results = {}
+        for stage in stages:
+            _check_dependencies(stage, results)
+            results[stage.name] = stage.func(dict(results))
+        return results
+    return _run_stages_concurrently(stages, max_workers)
+
+
+def _run_stages_concurrently(
+        stages: list[Stage],
+        max_workers: int) -> dict:
+    """
+    Run each stage as soon as its dependencies have completed. The first failure skips the stages which have not
+    started yet. Stages already running cannot be interrupted, so the failure is raised once they return, and no stage
+    outlives the call, such as one still reading a file the caller deletes on failure.
+
+    :param stages: Stages of the pipeline
+    :param max_workers: Maximum number of stages running at the same time
+    :return: Results of the stages by stage name
+    """
+    results = {}
+    pending = {stage.name: stage for stage in stages}
+    running: dict[Future, str] = {}
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='stage')
+    try:
+        while pending or running:
+            for name, stage in list(pending.items()):
+                if all(dependency in results for dependency in stage.dependencies):
+                    running[executor.submit(stage.func, dict(results))] = name
+                    del pending[name]
+            if not running:
+                _check_dependencies(next(iter(pending.values())), results)
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    _raise_stage_failure(name, e, list(pending) + list(running.values()))
+    finally:
+        # Only the stages which have not started are cancelled, the running ones are waited for
+        executor.shutdown(wait=True, cancel_futures=True)
+    return results
+
+
+def _raise_stage_failure(name: str, error: Exception, skipped: list[str]) -> None:
+    """
+    Raise the failure of the stage as an internal server error.
+
+    :param name: Name of the failed stage
+    :param error: Error of the stage
+    :param skipped: Names of the stages which have not completed
+    """
+    logging.error("Stage %s failed, skipping %s", name, skipped)
+    if isinstance(error, VimeoUploaderInternalServerError):
+        raise error
+    raise VimeoUploaderInternalServerError(f"Failed to run stage {name}") from error
+
+
+def _check_dependencies(stage: Stage, results: dict) -> None:
+    """
+    Check that the stages the stage depends on have completed.
+
+    :param stage: Stage about to run
+    :param results: Results of the completed stages
+    """
+    missing = [dependency for dependency in stage.dependencies if dependency not in results]
+    if missing:
+        raise ValueError(f"Stage {stage.name} depends on stages {missing} which have not run")
@@ -0,0 +1,377 @@
+import logging
+import math
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, BinaryIO, Callable, Optional
+
+if TYPE_CHECKING:
+    from boto3.s3.transfer import TransferConfig
+    from botocore.client import BaseClient
+
+    from core.checkpoints import StageCheckpointer
+
+MIB: int = 1024 * 1024
+# S3 rejects parts under 5 MiB, and allows at most 10000 parts per upload
+MIN_PART_SIZE: int = 8 * MIB
+MAX_PART_SIZE: int = 128 * MIB
+MAX_PARTS: int = 10000
+# Transfers wait on the network rather than the CPU, so each vCPU drives many parts at once
+THREADS_PER_CPU: int = 8
+MAX_CONCURRENCY: int = 32
+# Share of the function memory the parts in flight may take
+TRANSFER_MEMORY_FRACTION: float = 0.25
+# Size of each read from the network or disk, larger than the default 256 KiB to cut per-read overhead
+IO_CHUNK_SIZE: int = 1 * MIB
+# Parts of a streamed upload, of unknown size, held in a fixed ring of buffers bounding its memory
+STREAM_PART_SIZE: int = 16 * MIB
+STREAM_BUFFER_COUNT: int = 4
+
+
+def get_transfer_config(size: int, cpu_count: int = None, memory_in_mb: int = None) -> 'TransferConfig':
+    """
+    Get the transfer config for an object of the size, so large objects are split into enough parts to keep every
+    thread busy, and small objects are sent in a single request.
+
+    :param size: Size of the object in bytes, or 0 if unknown
+    :param cpu_count: Number of vCPUs, or None to read it from the host
+    :param memory_in_mb: Memory of the function in MB, or None to read it from the lambda environment
+    :return: Transfer config
+    """
+    from boto3.s3.transfer import TransferConfig
+
+    cpu_count = cpu_count or os.cpu_count() or 1
+    if memory_in_mb is None:
+        memory_in_mb = int(os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', 0))
+    concurrency = min(MAX_CONCURRENCY, THREADS_PER_CPU * cpu_count)
+    part_size = min(MAX_PART_SIZE, max(MIN_PART_SIZE, size // concurrency))
+    part_size = max(part_size, math.ceil(size / MAX_PARTS))
+    if memory_in_mb:
+        concurrency = min(concurrency, int(memory_in_mb * MIB * TRANSFER_MEMORY_FRACTION) // part_size)
+    if size:
+        # No more threads than parts
+        concurrency = min(concurrency, math.ceil(size / part_size))
+    concurrency = max(1, concurrency)
+    return TransferConfig(
+        multipart_threshold=part_size,
+        multipart_chunksize=part_size,
+        max_concurrency=concurrency,
+        io_chunksize=IO_CHUNK_SIZE)
+
+
+class TransferProgress:
+    """
+    Bytes transferred so far, counted from the callbacks of the transfer threads.
+    """
+
+    def __init__(self, size: int = 0, progress_callback: Callable[[float], None] = None) -> None:
+        """
+        :param size: Size of the transfer in bytes, if known
+        :param progress_callback: Callback taking the transferred fraction, called when the size is known
+        """
+        self.bytes_transferred = 0
+        self.size = size
+        self.progress_callback = progress_callback
+        self.lock = threading.Lock()
+
+    def __call__(self, bytes_amount: int) -> None:
+        with self.lock:
+            self.bytes_transferred += bytes_amount
+            fraction = self.bytes_transferred / self.size if self.size else None
+        if self.progress_callback and fraction is not None:
+            self.progress_callback(fraction)
+
+
+class S3Transfer:
+    """
+    Transfers of files to and from S3, tuned to the size of each file and recording the throughput of each transfer.
+    """
+
+    def __init__(self, s3_client: 'BaseClient', cpu_count: int = None, memory_in_mb: int = None) -> None:
+        """
+        :param s3_client: Client used to access S3
+        :param cpu_count: Number of vCPUs, or None to read it from the host
+        :param memory_in_mb: Memory of the function in MB, or None to read it from the lambda environment
+        """
+        self.s3_client = s3_client
+        self.cpu_count = cpu_count
+        self.memory_in_mb = memory_in_mb
+
+    def upload_file(
+            self,
+            file_path: str,
+            bucket_name: str,
+            object_key: str,
+            extra_args: dict = None,
+            progress_callback: Callable[[float], None] = None,
+            checkpoint: 'StageCheckpointer' = None) -> dict:
+        """
+        Upload the file to S3.
+
+        :param file_path: Path of the file
+        :param bucket_name: Name of the bucket
+        :param object_key: Key of the object
+        :param extra_args: Extra arguments of the put request, such as the metadata
+        :param progress_callback: Callback taking the uploaded fraction of the file
+        :param checkpoint: Checkpoint of the upload, so a multipart upload which failed is resumed by the next attempt
+        :return: Metrics of the transfer
+        """
+        size = os.path.getsize(file_path)
+        config = get_transfer_config(size, self.cpu_count, self.memory_in_mb)
+        progress = TransferProgress(size, progress_callback)
+        start = time.perf_counter()
+        if checkpoint and size > config.multipart_chunksize:
+            self._upload_file_in_parts(
+                file_path, bucket_name, object_key, extra_args, size, config, progress, checkpoint)
+        else:
+            self.s3_client.upload_file(
+                file_path, bucket_name, object_key, ExtraArgs=extra_args, Callback=progress, Config=config)
+        return self._get_metrics(
+            'upload', object_key, progress, config.multipart_chunksize, config.max_concurrency,
+            time.perf_counter() - start)
+
+    def download_file(self, bucket_name: str, object_key: str, file_path: str, size: int = 0) -> dict:
+        """
+        Download the object from S3 to the file.
+
+        :param bucket_name: Name of the bucket
+        :param object_key: Key of the object
+        :param file_path: Path of the file
+        :param size: Size of the object in bytes if known, to split large objects into parts
+        :return: Metrics of the transfer
+        """
+        config = get_transfer_config(size, self.cpu_count, self.memory_in_mb)
+        progress = TransferProgress()
+        start = time.perf_counter()
+        self.s3_client.download_file(bucket_name, object_key, file_path, Callback=progress, Config=config)
+        return self._get_metrics(
+            'download', object_key, progress, config.multipart_chunksize, config.max_concurrency,
+            time.perf_counter() - start)
+
+    def upload_stream(
+            self,
+            stream: BinaryIO,
+            bucket_name: str,
+            object_key: str,
+            extra_args: dict = None,
+            part_size: int = STREAM_PART_SIZE,
+            buffer_count: int = STREAM_BUFFER_COUNT) -> dict:
+        """
+        Upload the stream to S3 with a multipart upload while it is being produced, without knowing its size. Each part
+        is read into a free buffer of the ring and uploaded from there, so when every buffer waits on S3 the reading
+        stops until a part completes. The multipart upload is aborted if the stream or any part fails.
+
+        :param stream: Stream to upload, read until its end
+        :param bucket_name: Name of the bucket
+        :param object_key: Key of the object
+        :param extra_args: Extra arguments of the create request, such as the metadata
+        :param part_size: Size of each part in bytes, at least 5 MiB
+        :param buffer_count: Number of buffers in the ring, which is also the number of parts uploaded at once
+        :return: Metrics of the transfer
+        """
+        progress = TransferProgress()
+        free_buffers = queue.Queue()
+        for _ in range(buffer_count):
+            free_buffers.put(bytearray(part_size))
+        start = time.perf_counter()
+        upload_id = self.s3_client.create_multipart_upload(
+            Bucket=bucket_name, Key=object_key, **(extra_args or {}))['UploadId']
+
+        def upload_part(part_number: int, buffer: bytearray, size: int) -> dict:
+            try:
+                response = self.s3_client.upload_part(
+                    Bucket=bucket_name,
+                    Key=object_key,
+                    UploadId=upload_id,
+                    PartNumber=part_number,
+                    Body=buffer if size == part_size else buffer[:size])
+                progress(size)
+                return {'PartNumber': part_number, 'ETag': response['ETag']}
+            finally:
+                free_buffers.put(buffer)
+
+        try:
+            with ThreadPoolExecutor(max_workers=buffer_count, thread_name_prefix='s3-stream') as executor:
+                futures = self._submit_stream_parts(
+                    stream, object_key, part_size, free_buffers,
+                    lambda part_number, buffer, size: executor.submit(upload_part, part_number, buffer, size))
+                parts = [future.result() for future in futures]
+            self.s3_client.complete_multipart_upload(
+                Bucket=bucket_name, Key=object_key, UploadId=upload_id, MultipartUpload={'Parts': parts})
+        except BaseException:
+            logging.error("Aborting the upload of stream %s", object_key)
+            self.s3_client.abort_multipart_upload(Bucket=bucket_name, Key=object_key, UploadId=upload_id)
+            raise
+        return self._get_metrics(
+            'stream_upload', object_key, progress, part_size, buffer_count, time.perf_counter() - start)
+
+    def _submit_stream_parts(
+            self,
+            stream: BinaryIO,
+            object_key: str,
+            part_size: int,
+            free_buffers: queue.Queue,
+            submit: Callable[[int, bytearray, int], Future]) -> list[Future]:
+        """
+        Read the stream into the free buffers of the ring one part at a time, submitting the upload of each part.
+
+        :param stream: Stream to upload, read until its end
+        :param object_key: Key of the object
+        :param part_size: Size of each part in bytes
+        :param free_buffers: Buffers of the ring not holding a part being uploaded
+        :param submit: Function submitting the upload of a part, taking its number, buffer and size
+        :return: Future of the upload of each part, in order
+        """
+        futures = []
+        size = part_size
+        while size == part_size:
+            buffer = free_buffers.get()
+            # Fail fast rather than reading the rest of the stream after a part failed
+            for future in futures:
+                if future.done() and future.exception():
+                    raise future.exception()
+            size = self._read_part(stream, buffer)
+            if size == 0 and futures:
+                break
+            if size == 0:
+                raise ValueError(f"Stream of {object_key} is empty")
+            futures.append(submit(len(futures) + 1, buffer, size))
+        return futures
+
+    def _upload_file_in_parts(
+            self,
+            file_path: str,
+            bucket_name: str,
+            object_key: str,
+            extra_args: dict,
+            size: int,
+            config: 'TransferConfig',
+            progress: TransferProgress,
+            checkpoint: 'StageCheckpointer') -> None:
+        """
+        Upload the file with a multipart upload recorded in the checkpoint. The parts S3 already has from an earlier
+        attempt with the same part size are skipped. A failed upload is left for the next attempt to resume, and
+        expires with the lifecycle rules of the bucket.
+
+        :param file_path: Path of the file
+        :param bucket_name: Name of the bucket
+        :param object_key: Key of the object
+        :param extra_args: Extra arguments of the create request, such as the metadata
+        :param size: Size of the file in bytes
+        :param config: Transfer config, with the part size and concurrency
+        :param progress: Progress of the transfer
+        :param checkpoint: Checkpoint of the upload
+        """
+        part_size = config.multipart_chunksize
+        state = checkpoint.get()
+        upload_id = None
+        parts = {}
+        if state.upload_id and state.part_size == part_size:
+            parts = self._list_parts(bucket_name, object_key, state.upload_id, size, part_size)
+            if parts is not None:
+                upload_id = state.upload_id
+                logging.info("Resuming the upload of %s with %d parts uploaded", object_key, len(parts))
+                progress(sum(min(part_size, size - (part_number - 1) * part_size) for part_number in parts))
+        if upload_id is None:
+            parts = {}
+            upload_id = self.s3_client.create_multipart_upload(
+                Bucket=bucket_name, Key=object_key, **(extra_args or {}))['UploadId']
+            checkpoint.update(upload_id=upload_id, part_size=part_size)
+
+        def upload_part(part_number: int) -> None:
+            with open(file_path, 'rb') as file:
+                file.seek((part_number - 1) * part_size)
+                body = file.read(part_size)
+            response = self.s3_client.upload_part(
+                Bucket=bucket_name, Key=object_key, UploadId=upload_id, PartNumber=part_number, Body=body)
+            parts[part_number] = response['ETag']
+            progress(len(body))
+
+        part_count = math.ceil(size / part_size)
+        with ThreadPoolExecutor(max_workers=config.max_concurrency, thread_name_prefix='s3-parts') as executor:
+            futures = [
+                executor.submit(upload_part, part_number)
+                for part_number in range(1, part_count + 1) if part_number not in parts]
+            for future in futures:
+                future.result()
+        self.s3_client.complete_multipart_upload(
+            Bucket=bucket_name, Key=object_key, UploadId=upload_id, MultipartUpload={'Parts': [
+                {'PartNumber': part_number, 'ETag': parts[part_number]} for part_number in sorted(parts)]})
+        checkpoint.update(upload_id='', part_size=0)
+
+    def _list_parts(
+            self,
+            bucket_name: str,
+            object_key: str,
+            upload_id: str,
+            size: int,
+            part_size: int) -> Optional[dict[int, str]]:
+        """
+        List the complete parts of the multipart upload.
+
+        :param bucket_name: Name of the bucket
+        :param object_key: Key of the object
+        :param upload_id: ID of the multipart upload
+        :param size: Size of the file in bytes
+        :param part_size: Size of each part in bytes
+        :return: ETag of each complete part by part number, or None if the upload no longer exists
+        """
+        from botocore.exceptions import ClientError
+
+        parts = {}
+        kwargs = {}
+        while True:
+            try:
+                response = self.s3_client.list_parts(
+                    Bucket=bucket_name, Key=object_key, UploadId=upload_id, **kwargs)
+            except ClientError as e:
+                logging.warning("Failed to resume the upload of %s: %s", object_key, e)
+                return None
+            for part in response.get('Parts', []):
+                # A part cut short by the failure is uploaded again
+                if part['Size'] == min(part_size, size - (part['PartNumber'] - 1) * part_size):
+                    parts[part['PartNumber']] = part['ETag']
+            if not response.get('IsTruncated'):
+                return parts
+            kwargs = {'PartNumberMarker': response['NextPartNumberMarker']}
+
+    @staticmethod
+    def _read_part(stream: BinaryIO, buffer: bytearray) -> int:
+        """
+        Fill the buffer from the stream, as a pipe may return less than asked for.
+
+        :param stream: Stream to read
+        :param buffer: Buffer to fill
+        :return: Number of bytes read, less than the size of the buffer only at the end of the stream
+        """
+        view = memoryview(buffer)
+        size = 0
+        while size < len(buffer):
+            read = stream.readinto(view[size:])
+            if not read:
+                break
+            size += read
+        return size
+
+    @staticmethod
+    def _get_metrics(
+            operation: str,
+            object_key: str,
+            progress: TransferProgress,
+            part_size: int,
+            concurrency: int,
+            duration: float) -> dict:
+        size = progress.bytes_transferred
+        metrics = {
+            'operation': operation,
+            'object_key': object_key,
+            'size_in_bytes': size,
+            'duration_in_sec': round(duration, 3),
+            'throughput_in_mib_per_sec': round(size / MIB / duration, 2) if duration else 0,
+            'part_size_in_bytes': part_size,
+            'concurrency': concurrency,
+        }
+        logging.info("S3 transfer: %s", metrics)
+        return metrics
@@ -0,0 +1,205 @@
+import contextlib
+import logging
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Iterator, Optional
+
+from core.exceptions import VimeoUploaderInternalServerError
+
+SCRATCH_ROOT: str = "/tmp/scratch"
+# Directory of the local stores kept for the life of the container, such as the checkpoints, counted in the quota
+SCRATCH_STORES_ROOT: str = "/tmp/stores"
+# Ephemeral storage left free for the files kept elsewhere under /tmp, such as the cache of yt-dlp
+SCRATCH_RESERVED_BYTES: int = 64 * 1024 * 1024
+
+
+class ScratchArtifact:
+    """
+    Directory of the scratch space holding the files of an artifact, such as a downloaded clip.
+    """
+
+    def __init__(self, path: str, reusable: bool) -> None:
+        """
+        :param path: Path of the directory
+        :param reusable: True if the artifact is kept after use, for a later request to reuse it
+        """
+        self.path = path
+        self.reusable = reusable
+        self.size = 0
+        self.users = 0
+
+
+class ScratchSpace:
+    """
+    Allocator of the ephemeral storage of the function, which outlives the requests of a warm container. Each request
+    works in its own directory, which is deleted when the request ends, unless it holds a reusable artifact. Reusable
+    artifacts are kept until the space is needed by a new allocation, and evicted least recently used first. The local
+    stores of the process are kept apart and never evicted, but their size counts against the quota.
+    """
+
+    def __init__(
+            self,
+            root: str = SCRATCH_ROOT,
+            reserved_bytes: int = SCRATCH_RESERVED_BYTES,
+            quota_bytes: int = None,
+            stores_root: str = SCRATCH_STORES_ROOT) -> None:
+        """
+        :param root: Directory of the scratch space
+        :param reserved_bytes: Free bytes left on the file system for everything else
+        :param quota_bytes: Maximum bytes taken by the scratch space and the stores, or None to only be bound by the
+        file system
+        :param stores_root: Directory of the local stores
+        """
+        self.root = root
+        self.stores_root = stores_root
+        self.reserved_bytes = reserved_bytes
+        self.quota_bytes = quota_bytes
+        self.artifacts: OrderedDict[str, ScratchArtifact] = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {
+            'allocations': 0,
+            'reuses': 0,
+            'evictions': 0,
+            'evicted_bytes': 0,
+        }
+        os.makedirs(root, exist_ok=True)
+        # Artifacts left by an earlier process of the container, such as one which timed out, can be reused or evicted
+        for entry in sorted(os.scandir(root), key=lambda entry: entry.stat().st_mtime):
+            if entry.is_dir():
+                artifact = ScratchArtifact(entry.path, reusable=True)
+                artifact.size = self._get_size(entry.path)
+                self.artifacts[entry.path] = artifact
+
+    @contextlib.contextmanager
+    def allocate(self, name: str, estimated_size: int = 0, reusable: bool = False) -> Iterator[str]:
+        """
+        Allocate the directory of an artifact for the duration of the request, evicting reusable artifacts until the
+        estimated size fits.
+
+        :param name: Name of the artifact, the same for every request which may reuse it
+        :param estimated_size: Estimated bytes the request writes into the directory, or 0 if unknown
+        :param reusable: True if the artifact is kept after the request, false to delete it when the request ends
+        :return: Path of the directory
+        """
+        path = os.path.join(self.root, name)
+        with self.lock:
+            artifact = self.artifacts.pop(path, None) or ScratchArtifact(path, reusable)
+            artifact.reusable = reusable
+            artifact.users += 1
+            self.artifacts[path] = artifact
+            self.stats['allocations'] += 1
+            try:
+                self._make_room(estimated_size - artifact.size)
+            except VimeoUploaderInternalServerError:
+                self._release(artifact)
+                raise
+            # The estimate counts against the quota until the request ends, and the actual size is known
+            artifact.size = max(artifact.size, estimated_size)
+            os.makedirs(path, exist_ok=True)
+        try:
+            yield path
+        finally:
+            with self.lock:
+                self._release(artifact)
+                logging.info("Scratch space stats %s", self.stats)
+
+    def record_reuse(self, path: str) -> None:
+        """
+        Count the reuse of an artifact left by an earlier request, instead of fetching it again.
+
+        :param path: Path of the reused file
+        """
+        with self.lock:
+            self.stats['reuses'] += 1
+        logging.info("Reusing %s from the scratch space", path)
+
+    def get_store_path(self, name: str) -> str:
+        """
+        :param name: Name of a local store, such as a database
+        :return: Path of the store
+        """
+        os.makedirs(self.stores_root, exist_ok=True)
+        return os.path.join(self.stores_root, name)
+
+    def get_free_bytes(self) -> int:
+        """
+        :return: Bytes which can be allocated without evicting any artifact
+        """
+        free_bytes = shutil.disk_usage(self.root).free - self.reserved_bytes
+        if self.quota_bytes is not None:
+            used_bytes = self._get_size(self.stores_root) + sum(artifact.size for artifact in self.artifacts.values())
+            free_bytes = min(free_bytes, self.quota_bytes - used_bytes)
+        return free_bytes
+
+    def _make_room(self, needed_bytes: int) -> None:
+        """
+        Evict the least recently used artifacts which are reusable and not in use, until the bytes are free.
+
+        :param needed_bytes: Bytes to make room for
+        """
+        free_bytes = self.get_free_bytes()
+        for path, artifact in list(self.artifacts.items()):
+            if free_bytes >= needed_bytes:
+                break
+            if artifact.users or not artifact.reusable:
+                continue
+            logging.info("Evicting %s of %d bytes from the scratch space", path, artifact.size)
+            shutil.rmtree(path, ignore_errors=True)
+            del self.artifacts[path]
+            free_bytes += artifact.size
+            self.stats['evictions'] += 1
+            self.stats['evicted_bytes'] += artifact.size
+        if free_bytes < needed_bytes:
+            raise VimeoUploaderInternalServerError(
+                f"Not enough ephemeral storage, {needed_bytes} bytes needed and {free_bytes} bytes free")
+
+    def _release(self, artifact: ScratchArtifact) -> None:
+        """
+        Release the artifact by a request, deleting it once no request uses it, unless it is reusable.
+
+        :param artifact: Artifact used by the request
+        """
+        artifact.users -= 1
+        if artifact.users:
+            return
+        if artifact.reusable:
+            artifact.size = self._get_size(artifact.path)
+        else:
+            shutil.rmtree(artifact.path, ignore_errors=True)
+            del self.artifacts[artifact.path]
+
+    @staticmethod
+    def _get_size(path: str) -> int:
+        """
+        :param path: Path of a directory
+        :return: Total size of the files in the directory
+        """
+        size = 0
+        for directory, _, file_names in os.walk(path):
+            for file_name in file_names:
+                with contextlib.suppress(OSError):
+                    size += os.path.getsize(os.path.join(directory, file_name))
+        return size
+
+
+_scratch_space: Optional[ScratchSpace] = None
+_scratch_space_lock = threading.Lock()
+
+
+def get_scratch_space() -> ScratchSpace:
+    """
+    Get the scratch space of the process.
+
+    :return: Scratch space
+    """
+    global _scratch_space
+    with _scratch_space_lock:
+        if _scratch_space is None:
+            quota_in_mb = os.environ.get('SCRATCH_QUOTA_IN_MB')
+            _scratch_space = ScratchSpace(
+                root=os.environ.get('SCRATCH_ROOT', SCRATCH_ROOT),
+                quota_bytes=int(quota_in_mb) * 1024 * 1024 if quota_in_mb else None,
+                stores_root=os.environ.get('SCRATCH_STORES_ROOT', SCRATCH_STORES_ROOT))
+        return _scratch_space
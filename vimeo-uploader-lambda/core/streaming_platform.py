@@ -1,16 +1,15 @@
 import logging
-import os
 from abc import abstractmethod, ABC
-from datetime import datetime
 from enum import Enum
-
-import vimeo
-import yt_dlp
-from yt_dlp.utils import prepend_extension
+from typing import TYPE_CHECKING, BinaryIO, Callable, ContextManager, Optional
 
 from core.exceptions import VimeoUploaderInternalServerError
 from core.generated import model_pb2
 
+if TYPE_CHECKING:
+    from core.checkpoints import StageCheckpointer
+    from core.metrics import Metrics
+
 
 class SupportedPlatform(Enum):
     YOUTUBE = 1
@@ -28,6 +27,20 @@ class StreamingPlatform(ABC):
         """
         pass
 
+    def get_videos_metadata(self, video_ids: list[str]) -> list[model_pb2.VideoMetadata]:
+        """
+        Get the metadata about many videos, by default one after another
+        :param video_ids: IDs of the videos
+        :return: Metadata for each video, in the same order, with the error for videos which failed
+        """
+        videos_metadata = []
+        for video_id in video_ids:
+            try:
+                videos_metadata.append(self.get_video_metadata(video_id))
+            except Exception as e:
+                videos_metadata.append(model_pb2.VideoMetadata(video_id=video_id, error=str(e)))
+        return videos_metadata
+
     @abstractmethod
     def download_video(
             self,
@@ -35,7 +48,12 @@ class StreamingPlatform(ABC):
             start_time_in_sec: int,
             end_time_in_sec: int,
             download_path: str,
-            output_file_name: str) -> bool:
+            output_file_name: str,
+            trim_mode: model_pb2.TrimMode = model_pb2.TRIM_MODE_COPY,
+            progress_callback: Callable[[float], None] = None,
+            metrics: 'Metrics' = None,
+            target_profile: model_pb2.TargetProfile = None,
+            download_tuning: model_pb2.DownloadTuning = None) -> model_pb2.DownloadResult:
         """
         Download the video from streaming service with input parameters to the output path. Output video must contain
         both video and audio channels
@@ -44,166 +62,156 @@ class StreamingPlatform(ABC):
         :param end_time_in_sec: End time of trim in seconds
         :param download_path: Absolute path to the output destination folder
         :param output_file_name: Name of the output video file
-        :return: Boolean flag representing whether the video completed downloading
+        :param trim_mode: Mode of trimming, either stream copy (snapped to keyframes) or frame accurate smart cut
+        :param progress_callback: Callback taking the downloaded fraction of the video, if the service reports it
+        :param metrics: Metrics of the request, which the steps of the download such as the trim are recorded in
+        :param target_profile: Profile of the target platform the formats of the video are selected for, or None for
+        the best formats
+        :param download_tuning: Tuning of the download for the request, over the tuning of the deployment
+        :return: Result of the download, with flag representing whether the video completed downloading
         """
         pass
 
-    @abstractmethod
-    def upload_video(self, video_path: str, title: str,
-                     image_path: str = None) -> str:
+    def estimate_download_size(
+            self,
+            video_id: str,
+            start_time_in_sec: int,
+            end_time_in_sec: int,
+            target_profile: model_pb2.TargetProfile = None) -> int:
         """
-        Upload the video to streaming service
-        :param video_path: Absolute path to the video
-        :param title: Title of the uploaded video
-        :param image_path: Path of the thumbnail image
-        :return: URL of the uploaded video
+        Estimate the disk space taken while downloading the trimmed video, with the intermediate files of the trim
+        :param video_id: ID of the video
+        :param start_time_in_sec: Start time of trim in seconds
+        :param end_time_in_sec: End time of trim in seconds
+        :param target_profile: Profile of the target platform the formats of the video are selected for
+        :return: Estimated size in bytes, or 0 if unknown
         """
-        pass
-
+        return 0
 
-YOUTUBE_URL_PREFIX: str = "https://www.youtube.com/watch?v="
-DATE_FORMAT: str = "%Y-%m-%d"
-
-
-class YouTubePlatform(StreamingPlatform):
-
-    def get_video_metadata(self, video_id) -> model_pb2.VideoMetadata:
-        url = self._get_youtube_url(video_id)
-        ydl_opts = {
-            'cachedir': '/tmp/yt-dlp'
-        }
-        try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.sanitize_info(ydl.extract_info(url, download=False))
-                return model_pb2.VideoMetadata(
-                    video_id=info["id"],
-                    title=info["title"],
-                    author=info["uploader"],
-                    length_in_sec=info["duration"],
-                    publish_date=datetime.strptime(
-                        info["upload_date"],
-                        '%Y%m%d').strftime(DATE_FORMAT))
-        except Exception as e:
-            raise VimeoUploaderInternalServerError(e)
-
-    def download_video(
+    def download_clips(
             self,
             video_id: str,
-            start_time_in_sec: int,
-            end_time_in_sec: int,
+            clips: list[tuple[int, int]],
             download_path: str,
-            output_file_name: str) -> bool:
-        url = self._get_youtube_url(video_id)
-
-        # Download the video, and trim it using ffmpeg
-        # Fetch the best video / audio
-        ydl_opts = {
-            'format': "bv*+ba/b",
-            'outtmpl': os.path.join(download_path, output_file_name),
-            'cachedir': '/tmp/yt-dlp',
-            'merge_output_format': 'mkv'
-        }
-        try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.add_post_processor(
-                    self.FFmpegTrimPP(
-                        start_time_in_sec,
-                        end_time_in_sec))
-                error_code = ydl.download(url)
-                logging.info("Error code is %d", error_code)
-        except Exception as e:
-            raise VimeoUploaderInternalServerError(e)
-        return True
-
-    def upload_video(self, video_path: str, title: str,
-                     image_path: str = None) -> str:
-        raise NotImplementedError("This operation is not yet implemented")
-
-    @staticmethod
-    def _get_youtube_url(video_id: str) -> str:
-        return YOUTUBE_URL_PREFIX + video_id
-
-    class FFmpegTrimPP(yt_dlp.postprocessor.ffmpeg.FFmpegFixupPostProcessor):
+            output_file_names: list[str],
+            trim_mode: model_pb2.TrimMode = model_pb2.TRIM_MODE_COPY,
+            metrics: 'Metrics' = None,
+            target_profile: model_pb2.TargetProfile = None,
+            download_tuning: model_pb2.DownloadTuning = None) -> model_pb2.DownloadResult:
         """
-        Custom post processor used for trimming video
+        Download many clips of the same video from streaming service to the output path, by default one after another.
+        Clips which fail to download have no output file
+        :param video_id: ID of the video
+        :param clips: Start and end time of each clip in seconds
+        :param download_path: Absolute path to the output destination folder
+        :param output_file_names: Name of the output video file of each clip
+        :param trim_mode: Mode of trimming, either stream copy (snapped to keyframes) or frame accurate smart cut
+        :param metrics: Metrics of the request, which the steps of the download such as the trim are recorded in
+        :param target_profile: Profile of the target platform the formats of the video are selected for
+        :param download_tuning: Tuning of the download for the request, over the tuning of the deployment
+        :return: Result of the download, with flag representing whether any clip completed downloading
         """
+        download_result = model_pb2.DownloadResult()
+        for (start_time_in_sec, end_time_in_sec), output_file_name in zip(clips, output_file_names):
+            try:
+                clip_result = self.download_video(
+                    video_id, start_time_in_sec, end_time_in_sec, download_path, output_file_name, trim_mode,
+                    metrics=metrics, target_profile=target_profile, download_tuning=download_tuning)
+            except VimeoUploaderInternalServerError as e:
+                logging.error("Failed to download clip %s of video id %s: %s", output_file_name, video_id, e)
+                continue
+            download_result.downloaded = download_result.downloaded or clip_result.downloaded
+            download_result.mode = clip_result.mode
+            download_result.bytes_downloaded += clip_result.bytes_downloaded
+            download_result.bytes_avoided += clip_result.bytes_avoided
+            download_result.format_id = clip_result.format_id
+            download_result.estimated_size_in_bytes = clip_result.estimated_size_in_bytes
+        return download_result
+
+    def can_stream_video(
+            self,
+            video_id: str,
+            trim_mode: model_pb2.TrimMode = model_pb2.TRIM_MODE_COPY,
+            target_profile: model_pb2.TargetProfile = None) -> bool:
+        """
+        Check whether the trimmed video can be streamed, so the caller downloads it to disk otherwise
+        :param video_id: ID of the video
+        :param trim_mode: Mode of trimming
+        :param target_profile: Profile of the target platform the formats of the video are selected for
+        :return: True if stream_video can produce the video
+        """
+        return False
 
-        def __init__(self, start_time_in_sec: int, end_time_in_sec: int):
-            super().__init__()
-            self.start_time_in_sec = start_time_in_sec
-            self.end_time_in_sec = end_time_in_sec
-
-        def run(self, information):
-            output_opts = [
-                '-ss', str(self.start_time_in_sec),
-                '-to', str(self.end_time_in_sec),
-                '-c',
-                'copy',
-            ]
-            filename = information['filepath']
-            temp_filename = prepend_extension(filename, 'temp')
-            # Ordering of inputs matters!
-            self.real_run_ffmpeg([(filename, [])], [
-                                 (temp_filename, output_opts)])
-            os.replace(temp_filename, filename)
-            return [], information
-
-
-class VimeoPlatform(StreamingPlatform):
-
-    def get_video_metadata(self, video_id) -> model_pb2.VideoMetadata:
-        raise NotImplementedError("This operation is not yet implemented")
-
-    def download_video(
+    def stream_video(
             self,
             video_id: str,
             start_time_in_sec: int,
             end_time_in_sec: int,
-            download_path: str,
-            output_file_name: str) -> bool:
+            trim_mode: model_pb2.TrimMode = model_pb2.TRIM_MODE_COPY,
+            target_profile: model_pb2.TargetProfile = None) -> ContextManager[BinaryIO]:
+        """
+        Stream the trimmed video from streaming service while it is being produced, without writing it to disk. The
+        stream must contain both video and audio channels, and raises on read if producing it failed
+        :param video_id: ID of the video
+        :param start_time_in_sec: Start time of trim in seconds
+        :param end_time_in_sec: End time of trim in seconds
+        :param trim_mode: Mode of trimming
+        :param target_profile: Profile of the target platform the formats of the video are selected for
+        :return: Context manager of the stream, stopping the production of the video on exit
+        """
         raise NotImplementedError("This operation is not yet implemented")
 
+    @abstractmethod
     def upload_video(self, video_path: str, title: str,
-                     image_path: str = None) -> str:
-        return self._upload_video(
-            vimeo.VimeoClient(
-                token=os.environ['VIMEO_CLIENT_TOKEN'],
-                key=os.environ['VIMEO_CLIENT_KEY'],
-                secret=os.environ['VIMEO_CLIENT_SECRET']
-            ),
-            video_path,
-            title,
-            image_path)
-
-    @staticmethod
-    def _upload_video(
-            vimeo_client: vimeo.VimeoClient,
-            video_path: str,
-            title: str,
-            thumbnail_image_path: str = None) -> str:
-        try:
-            # Upload the video, and call patch to set title
-            url = vimeo_client.upload(video_path)
-            vimeo_client.patch(
-                url,
-                data={
-                    'name': title,
-                    'privacy': {
-                        'comments': 'nobody'
-                    }
-                })
-        except vimeo.exceptions.VideoUploadFailure:
-            logging.error(
-                "Failed to upload video from path %s",
-                video_path
-            )
-            raise VimeoUploaderInternalServerError(
-                f"Failed to upload video from path {video_path}")
-
-        if url and thumbnail_image_path:
-            vimeo_client.upload_picture(
-                url, thumbnail_image_path, activate=True)
-
-        video_data = vimeo_client.get(url + '?fields=link').json()
-        upload_url = video_data['link']
-        return upload_url
+                     image_data: bytes = None,
+                     progress_callback: Callable[[float], None] = None,
+                     checkpoint: 'StageCheckpointer' = None,
+                     clip_key: str = None,
+                     video_sha256: str = None) -> str:
+        """
+        Upload the video to streaming service
+        :param video_path: Absolute path to the video
+        :param title: Title of the uploaded video
+        :param image_data: Content of the thumbnail image
+        :param progress_callback: Callback taking the uploaded fraction of the video, if the service reports it
+        :param checkpoint: Checkpoint of the upload, recording how to resume it after a failure, if the service can
+        :param clip_key: Key of the clip from its video, range and processing options, so the service can tell an upload
+        of a clip it already has
+        :param video_sha256: SHA-256 hash of the video file if already known, so the service does not hash it again
+        :return: URL of the uploaded video
+        """
+        pass
+
+    def upload_video_from_url(self, video_url: str, size: int, title: str, image_data: bytes = None) -> str:
+        """
+        Upload the video to streaming service from a URL the service fetches it from
+        :param video_url: URL of the video
+        :param size: Size of the video in bytes
+        :param title: Title of the uploaded video
+        :param image_data: Content of the thumbnail image
+        :return: URL of the uploaded video
+        """
+        raise NotImplementedError("This operation is not yet implemented")
+
+    def get_target_profile(self) -> Optional[model_pb2.TargetProfile]:
+        """
+        Get the profile of the videos uploaded to the streaming service, such as their maximum resolution, so only the
+        formats the service keeps are downloaded
+        :return: Profile of the uploaded videos, or None if the service keeps any video
+        """
+        return None
+
+    def get_clip_options(
+            self,
+            trim_mode: model_pb2.TrimMode = model_pb2.TRIM_MODE_COPY,
+            target_profile: model_pb2.TargetProfile = None) -> dict:
+        """
+        Get the options which change the content of a downloaded clip, used to tell apart cached clips
+        :param trim_mode: Mode of trimming
+        :param target_profile: Profile of the target platform the formats of the video are selected for
+        :return: Options of the clip by name
+        """
+        return {
+            'platform': type(self).__name__,
+            'trim_mode': model_pb2.TrimMode.Name(trim_mode),
+        }
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Optional
+
+from core.clients import get_s3_client
+from core.generated import model_pb2
+from core.metadata_cache import LocalMetadataStore, MetadataStore, S3MetadataStore
+
+# Entries found after this long are checked against the account before being reused, as the video may be deleted
+UPLOAD_INDEX_VERIFY_AFTER_IN_SEC: int = 24 * 3600
+
+
+class UploadIndex:
+    """
+    Index of the videos uploaded to each account, by the clip they were made from and the hash of the uploaded file, so
+    a clip uploaded again returns the existing video instead of uploading it twice. The index is an optimization, a
+    failure to read or write it uploads the clip as if it was never indexed.
+    """
+
+    def __init__(self, store: MetadataStore, verify_after_in_sec: int = UPLOAD_INDEX_VERIFY_AFTER_IN_SEC) -> None:
+        """
+        :param store: Store of the entries
+        :param verify_after_in_sec: Time after which an entry is checked against the account before being reused
+        """
+        self.store = store
+        self.verify_after_in_sec = verify_after_in_sec
+
+    @staticmethod
+    def get_key(account_key: str, clip_key: Optional[str], video_sha256: str) -> str:
+        """
+        Get the key of the uploaded clip.
+
+        :param account_key: Key of the account the clip is uploaded to, so accounts sharing the index never reuse the
+        videos of each other
+        :param clip_key: Key of the clip, from its video, range and processing options, or None if unknown
+        :param video_sha256: SHA-256 hash of the uploaded file
+        :return: Key of the entry
+        """
+        return hashlib.sha256(json.dumps([account_key, clip_key, video_sha256]).encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[model_pb2.UploadIndexEntry]:
+        """
+        :param key: Key of the entry
+        :return: Uploaded video, or None if the clip was not uploaded
+        """
+        try:
+            value = self.store.get(key)
+        except Exception as e:
+            logging.warning("Failed to read the upload index entry %s: %s", key, e)
+            return None
+        return model_pb2.UploadIndexEntry.FromString(value) if value else None
+
+    def put(self, key: str, entry: model_pb2.UploadIndexEntry) -> None:
+        """
+        :param key: Key of the entry
+        :param entry: Uploaded video
+        """
+        try:
+            self.store.put(key, entry.SerializeToString())
+        except Exception as e:
+            logging.warning("Failed to write the upload index entry %s: %s", key, e)
+
+    def delete(self, key: str) -> None:
+        """
+        :param key: Key of the entry
+        """
+        try:
+            self.store.delete(key)
+        except Exception as e:
+            logging.warning("Failed to delete the upload index entry %s: %s", key, e)
+
+    def needs_verification(self, entry: model_pb2.UploadIndexEntry) -> bool:
+        """
+        :param entry: Uploaded video
+        :return: True if the video was last seen on the account too long ago to be reused unchecked
+        """
+        return time.time() - entry.verified_at >= self.verify_after_in_sec
+
+
+def get_upload_index_from_env() -> Optional[UploadIndex]:
+    """
+    Get the upload index from the environment, shared by all containers on S3, or kept in a local database standing in
+    for it.
+
+    :return: Upload index, or None if no store is configured
+    """
+    if os.environ.get('UPLOAD_INDEX_BUCKET_NAME'):
+        store = S3MetadataStore(get_s3_client(), os.environ['UPLOAD_INDEX_BUCKET_NAME'], prefix="upload-index/")
+    elif os.environ.get('UPLOAD_INDEX_STORE_PATH'):
+        store = LocalMetadataStore(os.environ['UPLOAD_INDEX_STORE_PATH'])
+    else:
+        return None
+    return UploadIndex(store, int(os.environ.get('UPLOAD_INDEX_VERIFY_AFTER_IN_SEC', UPLOAD_INDEX_VERIFY_AFTER_IN_SEC)))
@@ -0,0 +1,213 @@
+import hashlib
+import logging
+import os
+import time
+from typing import TYPE_CHECKING, Callable, Optional
+
+from core.checkpoints import get_file_sha256
+from core.clients import get_vimeo_session
+from core.exceptions import VimeoUploaderInternalServerError
+from core.generated import model_pb2
+from core.streaming_platform import StreamingPlatform
+from core.upload_index import UploadIndex, get_upload_index_from_env
+
+if TYPE_CHECKING:
+    from core.checkpoints import StageCheckpointer
+    from core.vimeo_session import VimeoSession
+
+# Highest resolution kept by Vimeo on the basic plans, above which the downloaded bytes are wasted
+VIMEO_MAX_HEIGHT: int = 1080
+# Container recommended by Vimeo for uploads
+VIMEO_CONTAINER: str = "mp4"
+# Statuses of videos whose upload or transcode failed, which are uploaded again rather than reused
+VIMEO_FAILED_STATUSES: tuple = ('uploading_error', 'transcoding_error', 'quota_exceeded', 'total_cap_exceeded')
+
+
+class VimeoPlatform(StreamingPlatform):
+
+    def __init__(
+            self,
+            session: 'VimeoSession' = None,
+            target_profile: model_pb2.TargetProfile = None,
+            upload_index: UploadIndex = None) -> None:
+        """
+        :param session: Session to the Vimeo API, or None to use the session of the process on first upload
+        :param target_profile: Profile of the uploaded videos, or None to read it from the environment
+        :param upload_index: Index of the uploaded clips, or None to read it from the environment, if configured
+        """
+        self._session = session
+        self.target_profile = target_profile or self._get_target_profile_from_env()
+        self.upload_index = upload_index or get_upload_index_from_env()
+
+    @property
+    def session(self) -> 'VimeoSession':
+        if self._session is None:
+            self._session = get_vimeo_session()
+        return self._session
+
+    def get_video_metadata(self, video_id) -> model_pb2.VideoMetadata:
+        raise NotImplementedError("This operation is not yet implemented")
+
+    def download_video(
+            self,
+            video_id: str,
+            start_time_in_sec: int,
+            end_time_in_sec: int,
+            download_path: str,
+            output_file_name: str) -> model_pb2.DownloadResult:
+        raise NotImplementedError("This operation is not yet implemented")
+
+    def upload_video(self, video_path: str, title: str,
+                     image_data: bytes = None,
+                     progress_callback: Callable[[float], None] = None,
+                     checkpoint: 'StageCheckpointer' = None,
+                     clip_key: str = None,
+                     video_sha256: str = None) -> str:
+        size = os.path.getsize(video_path)
+        index_key = None
+        if self.upload_index:
+            index_key = self.upload_index.get_key(
+                self.session.account_key, clip_key, video_sha256 or get_file_sha256(video_path))
+            upload_url = self._reuse_video(index_key, title, image_data)
+            if upload_url:
+                if progress_callback:
+                    progress_callback(1.0)
+                return upload_url
+        try:
+            video, offset = self._resume_video(checkpoint, size) if checkpoint else (None, 0)
+            if video is None:
+                # Create the video with its title in the same request, then upload the file in chunks
+                video = self.session.create_video(size, self._get_video_data(title))
+                if checkpoint:
+                    checkpoint.update(
+                        artifact=video['link'],
+                        size=size,
+                        upload_id=video['upload']['upload_link'],
+                        attributes={
+                            'pictures_uri': video['metadata']['connections']['pictures']['uri'],
+                            'video_uri': video['uri'],
+                        })
+            with open(video_path, 'rb') as file:
+                file.seek(offset)
+                self.session.upload(video['upload']['upload_link'], file, size, progress_callback, offset)
+        except (OSError, VimeoUploaderInternalServerError) as e:
+            logging.error(
+                "Failed to upload video from path %s: %s",
+                video_path,
+                e
+            )
+            raise VimeoUploaderInternalServerError(
+                f"Failed to upload video from path {video_path}")
+
+        if image_data:
+            self.session.upload_picture(video['metadata']['connections']['pictures']['uri'], image_data)
+        if index_key and video.get('uri'):
+            now = int(time.time())
+            self.upload_index.put(index_key, model_pb2.UploadIndexEntry(
+                video_uri=video['uri'],
+                link=video['link'],
+                pictures_uri=video['metadata']['connections']['pictures']['uri'],
+                title=title,
+                image_sha256=hashlib.sha256(image_data).hexdigest() if image_data else '',
+                size=size,
+                indexed_at=now,
+                verified_at=now))
+        return video['link']
+
+    def get_target_profile(self) -> model_pb2.TargetProfile:
+        return self.target_profile
+
+    def upload_video_from_url(self, video_url: str, size: int, title: str, image_data: bytes = None) -> str:
+        # Vimeo fetches the video on its side, so the upload completes without sending it from here
+        video = self.session.create_video(size, self._get_video_data(title), link=video_url)
+        if image_data:
+            self.session.upload_picture(video['metadata']['connections']['pictures']['uri'], image_data)
+        return video['link']
+
+    def _resume_video(self, checkpoint: 'StageCheckpointer', size: int) -> tuple[Optional[dict], int]:
+        """
+        Get the video created by an earlier attempt at the upload, and the offset its upload link has received.
+        :param checkpoint: Checkpoint of the upload
+        :param size: Size of the video file in bytes
+        :return: Video and offset, or no video if there is no upload to resume
+        """
+        state = checkpoint.get()
+        if not state.upload_id or state.size != size:
+            return None, 0
+        try:
+            offset = self.session.get_offset(state.upload_id)
+        except VimeoUploaderInternalServerError as e:
+            # The upload link expired, so the video is created again
+            logging.warning("Failed to resume the upload of %s: %s", state.artifact, e)
+            return None, 0
+        logging.info("Resuming the upload of %s from offset %d", state.artifact, offset)
+        return {
+            'uri': state.attributes.get('video_uri'),
+            'link': state.artifact,
+            'upload': {'upload_link': state.upload_id},
+            'metadata': {'connections': {'pictures': {'uri': state.attributes['pictures_uri']}}},
+        }, offset
+
+    def _reuse_video(self, index_key: str, title: str, image_data: bytes = None) -> Optional[str]:
+        """
+        Reuse the video uploaded earlier from the same clip, changing its title and thumbnail if they differ. The video
+        is checked against the account first if it was last seen too long ago.
+        :param index_key: Key of the clip in the upload index
+        :param title: Title of the uploaded video
+        :param image_data: Content of the thumbnail image
+        :return: URL of the uploaded video, or None if the clip has to be uploaded
+        """
+        entry = self.upload_index.get(index_key)
+        if not entry:
+            return None
+        image_sha256 = hashlib.sha256(image_data).hexdigest() if image_data else ''
+        try:
+            if self.upload_index.needs_verification(entry):
+                video = self.session.get_video(entry.video_uri)
+                if not video or video.get('status') in VIMEO_FAILED_STATUSES:
+                    logging.info("Indexed video %s is no longer available, uploading the clip again", entry.link)
+                    self.upload_index.delete(index_key)
+                    return None
+                # The video may have been renamed on Vimeo since
+                entry.title = video.get('name', entry.title)
+                entry.verified_at = int(time.time())
+            if entry.title != title:
+                self.session.edit_video(entry.video_uri, self._get_video_data(title))
+                entry.title = title
+            if image_data and entry.image_sha256 != image_sha256:
+                self.session.upload_picture(entry.pictures_uri, image_data)
+                entry.image_sha256 = image_sha256
+        except VimeoUploaderInternalServerError as e:
+            logging.warning("Failed to reuse the indexed video %s, uploading the clip again: %s", entry.link, e)
+            return None
+        self.upload_index.put(index_key, entry)
+        logging.info("Clip was already uploaded as %s", entry.link)
+        return entry.link
+
+    @staticmethod
+    def _get_target_profile_from_env() -> model_pb2.TargetProfile:
+        """
+        Get the profile of the uploaded videos, with the maximum resolution of the account, the codecs preferred and the
+        maximum size of the download, from the environment
+        :return: Profile of the uploaded videos
+        """
+        return model_pb2.TargetProfile(
+            max_height=int(os.environ.get('VIMEO_MAX_HEIGHT', VIMEO_MAX_HEIGHT)),
+            video_codecs=[codec for codec in os.environ.get('VIMEO_VIDEO_CODECS', '').split(',') if codec],
+            audio_codecs=[codec for codec in os.environ.get('VIMEO_AUDIO_CODECS', '').split(',') if codec],
+            container=VIMEO_CONTAINER,
+            max_bytes=int(os.environ.get('VIMEO_MAX_DOWNLOAD_SIZE_IN_MB', 0)) * 1024 * 1024)
+
+    @staticmethod
+    def _get_video_data(title: str) -> dict:
+        """
+        Get the metadata of the uploaded video
+        :param title: Title of the uploaded video
+        :return: Metadata set when creating the video
+        """
+        return {
+            'name': title,
+            'privacy': {
+                'comments': 'nobody'
+            }
+        }
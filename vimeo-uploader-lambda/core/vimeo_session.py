@@ -0,0 +1,203 @@
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from core.exceptions import VimeoUploaderInternalServerError
+
+VIMEO_API_ROOT: str = "https://api.vimeo.com"
+VIMEO_ACCEPT_HEADER: str = "application/vnd.vimeo.*;version=3.4"
+TUS_VERSION: str = "1.0.0"
+# Size of each PATCH of the tus upload, read into memory one chunk ahead
+UPLOAD_CHUNK_SIZE: int = 64 * 1024 * 1024
+# Attempts at sending each chunk, resuming from the offset the server has
+UPLOAD_ATTEMPTS: int = 3
+# Connection and read timeouts of API requests in seconds, chunks get a longer read timeout
+API_TIMEOUT: tuple = (3, 30)
+UPLOAD_TIMEOUT: tuple = (3, 300)
+
+
+class VimeoSession:
+    """
+    Long-lived session to the Vimeo API, keeping the connections and their TLS sessions open across requests and
+    uploads. Videos are uploaded with the tus protocol (https://tus.io/), in chunks which are resumed after a failure.
+    """
+
+    def __init__(
+            self,
+            token: str,
+            api_root: str = VIMEO_API_ROOT,
+            chunk_size: int = UPLOAD_CHUNK_SIZE,
+            pool_size: int = 4) -> None:
+        """
+        :param token: Access token of the Vimeo app
+        :param api_root: Root URL of the Vimeo API
+        :param chunk_size: Size of each chunk of the upload in bytes
+        :param pool_size: Maximum number of connections kept open per host
+        """
+        self.api_root = api_root
+        self.chunk_size = chunk_size
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'Accept': VIMEO_ACCEPT_HEADER})
+        # Only sent to the API, not to the upload links
+        self.authorization = f"Bearer {token}"
+        # Tells apart the accounts sharing an upload index, without storing the token
+        self.account_key = hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Send a request to the Vimeo API.
+
+        :param method: HTTP method
+        :param url: URL, or path relative to the API root
+        :return: Response, raising for statuses other than success
+        """
+        if not url.startswith('http'):
+            url = self.api_root + url
+        kwargs.setdefault('timeout', API_TIMEOUT)
+        headers = {'Authorization': self.authorization, **kwargs.pop('headers', {})}
+        response = self.session.request(method, url, headers=headers, **kwargs)
+        if not response.ok:
+            raise VimeoUploaderInternalServerError(
+                f"Vimeo request {method} {url} failed with status {response.status_code}: {response.text[:200]}")
+        return response
+
+    def create_video(self, size: int, data: dict, link: str = None) -> dict:
+        """
+        Create the video with a tus upload, or pulled by Vimeo from the link, setting its metadata in the same request.
+
+        :param size: Size of the video file in bytes
+        :param data: Metadata of the video, such as name and privacy
+        :param link: URL Vimeo fetches the video from, or None to upload it with tus
+        :return: Created video, with its uri, link, upload link and pictures uri
+        """
+        upload = {'approach': 'pull', 'link': link} if link else {'approach': 'tus'}
+        return self.request('POST', '/me/videos', json={
+            **data,
+            'upload': {
+                **upload,
+                'size': size,
+            },
+        }, params={'fields': 'uri,link,upload.upload_link,metadata.connections.pictures.uri'}).json()
+
+    def get_video(self, video_uri: str) -> Optional[dict]:
+        """
+        Get the video, as the account sees it.
+
+        :param video_uri: URI of the video
+        :return: Video with its uri, name and status, or None if the video is deleted
+        """
+        response = self.session.get(
+            self.api_root + video_uri,
+            headers={'Authorization': self.authorization},
+            params={'fields': 'uri,name,status'},
+            timeout=API_TIMEOUT)
+        # A deleted video is not found, while a forbidden one may only be hidden from the app for now, so it is an error
+        if response.status_code == 404:
+            return None
+        if not response.ok:
+            raise VimeoUploaderInternalServerError(
+                f"Failed to get the video {video_uri}, with status {response.status_code}")
+        return response.json()
+
+    def edit_video(self, video_uri: str, data: dict) -> None:
+        """
+        Edit the metadata of the video, without uploading it again.
+
+        :param video_uri: URI of the video
+        :param data: Metadata of the video to change, such as name
+        """
+        self.request('PATCH', video_uri, json=data, params={'fields': 'uri'})
+
+    def upload(
+            self,
+            upload_link: str,
+            file: BinaryIO,
+            size: int,
+            progress_callback: Callable[[float], None] = None,
+            offset: int = 0) -> None:
+        """
+        Upload the file to the tus upload link, one chunk after another as the upload of Vimeo requires. The next chunk
+        is read while the current one is sent. A failed chunk is resumed from the offset the server received.
+
+        :param upload_link: Upload link of the created video
+        :param file: File to upload, read from its current position, which is the offset
+        :param size: Size of the file in bytes
+        :param progress_callback: Callback taking the uploaded fraction of the file, called after each chunk
+        :param offset: Offset the server already has, when resuming an earlier upload
+        """
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='vimeo-read') as reader:
+            next_chunk = reader.submit(file.read, self.chunk_size)
+            while offset < size:
+                chunk = next_chunk.result()
+                if not chunk:
+                    raise VimeoUploaderInternalServerError(
+                        f"File ended at {offset} bytes, before its size of {size} bytes")
+                next_chunk = reader.submit(file.read, self.chunk_size)
+                offset = self._upload_chunk(upload_link, chunk, offset)
+                if progress_callback:
+                    progress_callback(offset / size)
+
+    def upload_picture(self, pictures_uri: str, image_data: bytes) -> None:
+        """
+        Upload the picture of the video, and make it the active thumbnail.
+
+        :param pictures_uri: URI of the pictures of the video
+        :param image_data: Content of the thumbnail image
+        """
+        picture = self.request('POST', pictures_uri, params={'fields': 'uri,link'}).json()
+        self.request('PUT', picture['link'], data=image_data, timeout=UPLOAD_TIMEOUT)
+        self.request('PATCH', picture['uri'], json={'active': True})
+
+    def _upload_chunk(self, upload_link: str, chunk: bytes, offset: int) -> int:
+        """
+        Send the chunk starting at the offset, resuming from the offset the server has after a failure.
+
+        :param upload_link: Upload link of the created video
+        :param chunk: Bytes of the chunk
+        :param offset: Offset of the chunk in the file
+        :return: Offset after the chunk
+        """
+        end = offset + len(chunk)
+        sent = offset
+        failures = 0
+        while sent < end:
+            try:
+                response = self.session.patch(upload_link, data=chunk[sent - offset:], headers={
+                    'Tus-Resumable': TUS_VERSION,
+                    'Upload-Offset': str(sent),
+                    'Content-Type': 'application/offset+octet-stream',
+                }, timeout=UPLOAD_TIMEOUT)
+                if response.status_code == 204 and int(response.headers['Upload-Offset']) > sent:
+                    sent = int(response.headers['Upload-Offset'])
+                    continue
+                logging.warning("Chunk at offset %d failed with status %d", sent, response.status_code)
+            except requests.RequestException as e:
+                logging.warning("Chunk at offset %d failed: %s", sent, e)
+            failures += 1
+            if failures >= UPLOAD_ATTEMPTS:
+                raise VimeoUploaderInternalServerError(f"Failed to upload the chunk at offset {offset}")
+            sent = self.get_offset(upload_link)
+            if not offset <= sent <= end:
+                raise VimeoUploaderInternalServerError(
+                    f"Upload offset {sent} is outside of the chunk from {offset} to {end}")
+        return end
+
+    def get_offset(self, upload_link: str) -> int:
+        """
+        Get the offset the server has received the upload up to.
+
+        :param upload_link: Upload link of the created video
+        :return: Offset in bytes
+        """
+        response = self.session.head(upload_link, headers={'Tus-Resumable': TUS_VERSION}, timeout=API_TIMEOUT)
+        if not response.ok:
+            raise VimeoUploaderInternalServerError(
+                f"Failed to get the offset of the upload, with status {response.status_code}")
+        return int(response.headers['Upload-Offset'])
@@ -0,0 +1,1207 @@
+import contextlib
+import copy
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from fractions import Fraction
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import TYPE_CHECKING, BinaryIO, Callable, Iterator, Optional
+
+import yt_dlp
+from yt_dlp.downloader.external import FFmpegFD
+from yt_dlp.utils import Popen, PostProcessingError, download_range_func, prepend_extension
+
+from core.exceptions import VimeoUploaderInternalServerError
+from core.format_selector import FormatSelector, get_target_profile_key
+from core.generated import model_pb2
+from core.metrics import Metrics
+from core.streaming_platform import StreamingPlatform
+
+if TYPE_CHECKING:
+    from core.checkpoints import StageCheckpointer
+
+YOUTUBE_URL_PREFIX: str = "https://www.youtube.com/watch?v="
+DATE_FORMAT: str = "%Y-%m-%d"
+# Fetch the best video / audio
+DOWNLOAD_FORMAT: str = "bv*+ba/b"
+# Maximum number of videos looked up at the same time by a batch metadata lookup
+METADATA_CONCURRENCY: int = 8
+# Time an extraction of a video is reused for, well within the ~6 hours the stream URLs of YouTube stay valid
+EXTRACTED_INFO_TTL_IN_SEC: int = 30 * 60
+# Maximum number of extractions kept, as the info dict of a video with all its formats is large
+EXTRACTED_INFO_MAX_ENTRIES: int = 32
+# Extra seconds fetched around the requested range, so the keyframes the trim snaps to are present
+RANGE_DOWNLOAD_PADDING_IN_SEC: int = 10
+# Shortest sub-range of a segmented download, much longer than a GOP so every sub-range starts on its own keyframe
+SEGMENT_MIN_LENGTH_IN_SEC: int = 120
+# Maximum number of sub-ranges downloaded at the same time, each over its own connection
+SEGMENT_MAX_COUNT: int = 8
+# Attempts at downloading a sub-range, before the segmented download fails
+SEGMENT_DOWNLOAD_ATTEMPTS: int = 3
+# Encoder options matching the source codec, used by the smart cut to re-encode the partial GOPs
+SMART_TRIM_ENCODERS: dict = {
+    'h264': ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '18'],
+    'hevc': ['-c:v', 'libx265', '-preset', 'veryfast', '-crf', '20'],
+    'vp9': ['-c:v', 'libvpx-vp9', '-deadline', 'realtime', '-cpu-used', '8', '-crf', '24', '-b:v', '0'],
+    'av1': ['-c:v', 'libsvtav1', '-preset', '10', '-crf', '28'],
+}
+
+
+class DownloadProgressTracker:
+    """
+    Progress hook for yt-dlp, used for counting the bytes of completed downloads, and reporting the downloaded
+    fraction across the files of the video. It is also the logger of yt-dlp, so the statistics of the download include
+    the retries yt-dlp reports
+    """
+
+    def __init__(self, progress_callback: Callable[[float], None] = None) -> None:
+        """
+        :param progress_callback: Callback taking the downloaded fraction, called when the sizes of the files are known
+        """
+        self.bytes_downloaded = 0
+        self.progress_callback = progress_callback
+        self.files: dict[str, tuple[int, int]] = {}
+        self.started_at = None
+        self.finished_at = None
+        self.peak_speed = 0.0
+        self.initial_etas: dict[str, float] = {}
+        self.fragments: dict[str, int] = {}
+        self.retries = 0
+        # The files of a segmented download report their progress from their own threads
+        self.lock = threading.Lock()
+
+    def hook(self, progress: dict) -> None:
+        with self.lock:
+            now = time.monotonic()
+            self.started_at = self.started_at or now
+            filename = progress.get('filename')
+            if progress.get('speed'):
+                self.peak_speed = max(self.peak_speed, progress['speed'])
+            if progress.get('eta') is not None:
+                self.initial_etas.setdefault(filename, progress['eta'])
+            if progress.get('fragment_index'):
+                self.fragments[filename] = max(self.fragments.get(filename, 0), progress['fragment_index'])
+            if progress['status'] == 'finished':
+                self.bytes_downloaded += progress.get('total_bytes') or progress.get('downloaded_bytes') or 0
+                self.finished_at = now
+            if not self.progress_callback:
+                return
+            total_bytes = progress.get('total_bytes') or progress.get('total_bytes_estimate')
+            if total_bytes:
+                downloaded_bytes = total_bytes if progress['status'] == 'finished' else progress.get('downloaded_bytes', 0)
+                self.files[progress.get('filename')] = (downloaded_bytes, total_bytes)
+                self.progress_callback(
+                    sum(downloaded for downloaded, _ in self.files.values())
+                    / sum(total for _, total in self.files.values()))
+
+    def get_download_stats(self, tuning: model_pb2.DownloadTuning = None) -> model_pb2.DownloadStats:
+        """
+        Get the statistics of the download, for tuning the download from measured data
+        :param tuning: Tuning the download was made with
+        :return: Statistics of the download
+        """
+        with self.lock:
+            download_stats = model_pb2.DownloadStats(
+                bytes=self.bytes_downloaded,
+                peak_speed_in_bytes_per_sec=round(self.peak_speed, 1),
+                # The files of the video are downloaded one after another, so their estimates add up
+                initial_eta_in_sec=sum(self.initial_etas.values()),
+                fragments=sum(self.fragments.values()),
+                retries=self.retries,
+                tuning=tuning)
+            if self.started_at is not None and self.finished_at is not None:
+                elapsed = self.finished_at - self.started_at
+                download_stats.elapsed_in_sec = round(elapsed, 3)
+                if elapsed > 0:
+                    download_stats.average_speed_in_bytes_per_sec = round(self.bytes_downloaded / elapsed, 1)
+            return download_stats
+
+    def debug(self, message: str) -> None:
+        # yt-dlp writes both its debug and its screen messages at this level
+        if message.startswith('[debug] '):
+            logging.debug(message)
+        else:
+            self._count_retry(message)
+            logging.info(message)
+
+    def info(self, message: str) -> None:
+        logging.info(message)
+
+    def warning(self, message: str) -> None:
+        self._count_retry(message)
+        logging.warning(message)
+
+    def error(self, message: str) -> None:
+        logging.error(message)
+
+    def _count_retry(self, message: str) -> None:
+        """
+        Count the retry of a request or a fragment, which yt-dlp only reports in its messages
+        :param message: Message of yt-dlp
+        """
+        if '. Retrying' in message:
+            with self.lock:
+                self.retries += 1
+
+
+class FFmpegOutputStream:
+    """
+    Output of an ffmpeg process writing to a pipe, raising at the end of the output if ffmpeg failed
+    """
+
+    def __init__(self, process: subprocess.Popen, stderr_file: BinaryIO) -> None:
+        self.process = process
+        self.stderr_file = stderr_file
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.process.stdout.read(size)
+        if not data:
+            self._check_exit()
+        return data
+
+    def readinto(self, buffer) -> int:
+        size = self.process.stdout.readinto(buffer)
+        if not size:
+            self._check_exit()
+        return size
+
+    def _check_exit(self) -> None:
+        if self.process.wait() != 0:
+            self.stderr_file.seek(0)
+            raise VimeoUploaderInternalServerError(
+                f"ffmpeg failed with code {self.process.returncode}: "
+                f"{self.stderr_file.read().decode('utf-8', 'replace')[-500:]}")
+
+
+class YouTubePlatform(StreamingPlatform):
+
+    def __init__(
+            self,
+            range_download: bool = True,
+            extracted_info_ttl_in_sec: int = EXTRACTED_INFO_TTL_IN_SEC,
+            segmented_download: bool = True,
+            download_tuning: model_pb2.DownloadTuning = None) -> None:
+        """
+        :param range_download: True if only the requested time range should be downloaded when the format allows it
+        :param extracted_info_ttl_in_sec: Time in seconds an extraction of a video is reused, or 0 to always extract
+        :param segmented_download: True if a long time range should be split into sub-ranges downloaded concurrently
+        :param download_tuning: Tuning of the downloads by yt-dlp for the deployment, or None to read it from the
+        environment
+        """
+        self.range_download = range_download
+        self.segmented_download = segmented_download
+        self.download_tuning = download_tuning or self._get_download_tuning_from_env()
+        self.extracted_info_ttl_in_sec = extracted_info_ttl_in_sec
+        self.extracted_infos: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self.extracted_infos_lock = threading.Lock()
+
+    def get_video_metadata(self, video_id) -> model_pb2.VideoMetadata:
+        ydl_opts = {
+            'cachedir': '/tmp/yt-dlp'
+        }
+        try:
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                return self._get_video_metadata(ydl, video_id)
+        except Exception as e:
+            raise VimeoUploaderInternalServerError(e)
+
+    def get_videos_metadata(self, video_ids: list[str]) -> list[model_pb2.VideoMetadata]:
+        ydl_opts = {
+            'cachedir': '/tmp/yt-dlp'
+        }
+
+        def get_video_metadata(video_id):
+            try:
+                return self._get_video_metadata(ydl, video_id)
+            except Exception as e:
+                logging.error("Failed to get metadata with video id %s: %s", video_id, e)
+                return model_pb2.VideoMetadata(video_id=video_id, error=str(e))
+
+        # The extractor is set up once, and shared by all the lookups
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl, ThreadPoolExecutor(
+                max_workers=METADATA_CONCURRENCY, thread_name_prefix='metadata') as executor:
+            return list(executor.map(get_video_metadata, video_ids))
+
+    def download_video(
+            self,
+            video_id: str,
+            start_time_in_sec: int,
+            end_time_in_sec: int,
+            download_path: str,
+            output_file_name: str,
+            trim_mode: model_pb2.TrimMode = model_pb2.TRIM_MODE_COPY,
+            progress_callback: Callable[[float], None] = None,
+            metrics: Metrics = None,
+            target_profile: model_pb2.TargetProfile = None,
+            download_tuning: model_pb2.DownloadTuning = None) -> model_pb2.DownloadResult:
+        output_path = os.path.join(download_path, output_file_name)
+        progress_tracker = DownloadProgressTracker(progress_callback)
+        metrics = metrics or Metrics()
+        download_tuning = self._get_download_tuning(download_tuning)
+
+        # Download the video, and trim it using ffmpeg
+        try:
+            with yt_dlp.YoutubeDL(self._get_download_opts(output_path, progress_tracker, download_tuning)) as ydl:
+                with metrics.stage('extract'):
+                    info = self._extract_info(ydl, video_id, target_profile)
+                if self.range_download and self._supports_range_download(info):
+                    # Only fetch the section around the trim, keeping the source timestamps so the trim can use
+                    # the requested times as they are
+                    mode = model_pb2.DOWNLOAD_MODE_RANGE
+                    section_start, section_end = self._get_download_section(
+                        info, start_time_in_sec, end_time_in_sec)
+                    if trim_mode == model_pb2.TRIM_MODE_SMART:
+                        trim_pp = self.FFmpegSmartTrimPP(start_time_in_sec, end_time_in_sec)
+                    else:
+                        trim_pp = self.FFmpegTrimPP(start_time_in_sec, end_time_in_sec)
+                    self._add_trim_metrics(trim_pp, metrics)
+                    self._download_range_and_trim(
+                        ydl, info, output_path, section_start, section_end, trim_pp, progress_tracker)
+                else:
+                    mode = model_pb2.DOWNLOAD_MODE_FULL
+                    if trim_mode == model_pb2.TRIM_MODE_SMART:
+                        trim_pp = self.FFmpegSmartTrimPP(start_time_in_sec, end_time_in_sec)
+                    else:
+                        trim_pp = self.FFmpegMergeTrimPP(start_time_in_sec, end_time_in_sec)
+                    self._add_trim_metrics(trim_pp, metrics)
+                    self._download_and_merge_trim(ydl, info, output_path, trim_pp)
+        except Exception as e:
+            raise VimeoUploaderInternalServerError(e)
+
+        return self._get_download_result(video_id, info, mode, progress_tracker, download_tuning)
+
+    def estimate_download_size(
+            self,
+            video_id: str,
+            start_time_in_sec: int,
+            end_time_in_sec: int,
+            target_profile: model_pb2.TargetProfile = None) -> int:
+        if self.extracted_info_ttl_in_sec <= 0:
+            # Without reusing the extraction, the estimate would cost an extraction of its own
+            return 0
+        ydl_opts = {
+            'format': DOWNLOAD_FORMAT,
+            'cachedir': '/tmp/yt-dlp'
+        }
+        try:
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                info = self._extract_info(ydl, video_id, target_profile)
+        except Exception as e:
+            logging.warning("Failed to estimate the download size of video id %s: %s", video_id, e)
+            return 0
+        full_size = self._estimate_full_size(info)
+        duration = info.get('duration')
+        if not full_size or not duration:
+            return full_size
+        clip_size = full_size * (end_time_in_sec - start_time_in_sec) / duration
+        if self.range_download and self._supports_range_download(info):
+            # The downloaded section, and the clip trimmed out of it
+            section_start, section_end = self._get_download_section(info, start_time_in_sec, end_time_in_sec)
+            return int(full_size * (section_end - section_start) / duration + clip_size)
+        # The downloaded formats, and the clip merged and trimmed out of them
+        return int(full_size + clip_size)
+
+    def download_clips(
+            self,
+            video_id: str,
+            clips: list[tuple[int, int]],
+            download_path: str,
+            output_file_names: list[str],
+            trim_mode: model_pb2.TrimMode = model_pb2.TRIM_MODE_COPY,
+            metrics: Metrics = None,
+            target_profile: model_pb2.TargetProfile = None,
+            download_tuning: model_pb2.DownloadTuning = None) -> model_pb2.DownloadResult:
+        source_path = os.path.join(download_path, f"{video_id}.source.mkv")
+        progress_tracker = DownloadProgressTracker()
+        metrics = metrics or Metrics()
+        download_tuning = self._get_download_tuning(download_tuning)
+        multi_trim_pp = self.FFmpegMultiTrimPP(
+            [(start, end, os.path.join(download_path, output_file_name))
+             for (start, end), output_file_name in zip(clips, output_file_names)],
+            trim_mode)
+        self._add_trim_metrics(multi_trim_pp, metrics)
+
+        # Download the video once, covering all the clips, and cut the clips out of it using ffmpeg
+        try:
+            with yt_dlp.YoutubeDL(self._get_download_opts(source_path, progress_tracker, download_tuning)) as ydl:
+                with metrics.stage('extract'):
+                    info = self._extract_info(ydl, video_id, target_profile)
+                if self.range_download and self._supports_range_download(info):
+                    mode = model_pb2.DOWNLOAD_MODE_RANGE
+                    section_start, section_end = self._get_download_section(
+                        info, multi_trim_pp.start_time_in_sec, multi_trim_pp.end_time_in_sec)
+                    self._download_range_and_trim(
+                        ydl, info, source_path, section_start, section_end, multi_trim_pp, progress_tracker)
+                    if os.path.exists(source_path):
+                        os.remove(source_path)
+                else:
+                    mode = model_pb2.DOWNLOAD_MODE_FULL
+                    self._download_and_merge_trim(ydl, info, source_path, multi_trim_pp)
+        except Exception as e:
+            raise VimeoUploaderInternalServerError(e)
+
+        return self._get_download_result(video_id, info, mode, progress_tracker, download_tuning)
+
+    def can_stream_video(
+            self,
+            video_id: str,
+            trim_mode: model_pb2.TrimMode = model_pb2.TRIM_MODE_COPY,
+            target_profile: model_pb2.TargetProfile = None) -> bool:
+        if trim_mode != model_pb2.TRIM_MODE_COPY:
+            return False
+        with yt_dlp.YoutubeDL({'format': DOWNLOAD_FORMAT, 'cachedir': '/tmp/yt-dlp'}) as ydl:
+            try:
+                info = self._extract_info(ydl, video_id, target_profile)
+            except Exception as e:
+                logging.warning("Failed to check whether video id %s can be streamed: %s", video_id, e)
+                return False
+        return self._supports_range_download(info)
+
+    @contextlib.contextmanager
+    def stream_video(
+            self,
+            video_id: str,
+            start_time_in_sec: int,
+            end_time_in_sec: int,
+            trim_mode: model_pb2.TrimMode = model_pb2.TRIM_MODE_COPY,
+            target_profile: model_pb2.TargetProfile = None) -> Iterator[BinaryIO]:
+        if trim_mode != model_pb2.TRIM_MODE_COPY:
+            # The smart cut re-encodes the ends of the trim through intermediate files
+            raise VimeoUploaderInternalServerError("Only stream copy trims can be streamed")
+        ydl_opts = {
+            'format': DOWNLOAD_FORMAT,
+            'cachedir': '/tmp/yt-dlp'
+        }
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            try:
+                info = self._extract_info(ydl, video_id, target_profile)
+            except Exception as e:
+                raise VimeoUploaderInternalServerError(e)
+            if not self._supports_range_download(info):
+                raise VimeoUploaderInternalServerError(f"Video id {video_id} cannot be read by ffmpeg")
+            stream_trim_pp = self.FFmpegStreamTrimPP(start_time_in_sec, end_time_in_sec)
+            stream_trim_pp.set_downloader(ydl)
+            with stream_trim_pp.stream(info) as stream:
+                yield stream
+
+    def upload_video(self, video_path: str, title: str,
+                     image_data: bytes = None,
+                     progress_callback: Callable[[float], None] = None,
+                     checkpoint: 'StageCheckpointer' = None,
+                     clip_key: str = None,
+                     video_sha256: str = None) -> str:
+        raise NotImplementedError("This operation is not yet implemented")
+
+    def get_clip_options(
+            self,
+            trim_mode: model_pb2.TrimMode = model_pb2.TRIM_MODE_COPY,
+            target_profile: model_pb2.TargetProfile = None) -> dict:
+        return {
+            **super().get_clip_options(trim_mode, target_profile),
+            'format': get_target_profile_key(target_profile) or DOWNLOAD_FORMAT,
+        }
+
+    @staticmethod
+    def _get_youtube_url(video_id: str) -> str:
+        return YOUTUBE_URL_PREFIX + video_id
+
+    def _get_video_metadata(self, ydl: yt_dlp.YoutubeDL, video_id: str) -> model_pb2.VideoMetadata:
+        """
+        Extract the metadata about the video
+        :param ydl: YoutubeDL instance used for the extraction
+        :param video_id: ID of the video
+        :return: Metadata for the video
+        """
+        info = ydl.sanitize_info(self._extract_info(ydl, video_id))
+        return model_pb2.VideoMetadata(
+            video_id=info["id"],
+            title=info["title"],
+            author=info["uploader"],
+            length_in_sec=info["duration"],
+            publish_date=datetime.strptime(
+                info["upload_date"],
+                '%Y%m%d').strftime(DATE_FORMAT))
+
+    def _extract_info(
+            self,
+            ydl: yt_dlp.YoutubeDL,
+            video_id: str,
+            target_profile: model_pb2.TargetProfile = None) -> dict:
+        """
+        Extract the info dict of the video, reusing a recent extraction of the video. The extraction is kept before
+        processing, so the given YoutubeDL instance selects the formats with its own options without any network request
+        :param ydl: YoutubeDL instance used for the extraction
+        :param video_id: ID of the video
+        :param target_profile: Profile of the target platform the formats are selected for, or None for the best formats
+        :return: Info dict of the video, with formats selected
+        """
+        now = time.monotonic()
+        with self.extracted_infos_lock:
+            while self.extracted_infos and \
+                    next(iter(self.extracted_infos.values()))[0] + self.extracted_info_ttl_in_sec <= now:
+                self.extracted_infos.popitem(last=False)
+            entry = self.extracted_infos.get(video_id)
+        if entry:
+            logging.info("Reusing the extracted info for video id %s", video_id)
+            info = copy.deepcopy(entry[1])
+        else:
+            info = ydl.extract_info(self._get_youtube_url(video_id), download=False, process=False)
+            if self.extracted_info_ttl_in_sec > 0:
+                with self.extracted_infos_lock:
+                    self.extracted_infos[video_id] = (now, copy.deepcopy(info))
+                    self.extracted_infos.move_to_end(video_id)
+                    while len(self.extracted_infos) > EXTRACTED_INFO_MAX_ENTRIES:
+                        self.extracted_infos.popitem(last=False)
+        if target_profile:
+            selected = FormatSelector(target_profile).select(info.get('formats') or [], info.get('duration'))
+            if selected:
+                # The best formats remain the fallback, should the selected formats be rejected by yt-dlp
+                ydl.format_selector = ydl.build_format_selector(f"{selected.format_id}/{DOWNLOAD_FORMAT}")
+        return ydl.process_ie_result(info, download=False)
+
+    @staticmethod
+    def _get_download_opts(
+            output_path: str,
+            progress_tracker: DownloadProgressTracker,
+            download_tuning: model_pb2.DownloadTuning = None) -> dict:
+        """
+        Get the options of yt-dlp for downloading the video
+        :param output_path: Path of the downloaded video file
+        :param progress_tracker: Tracker counting the downloaded bytes
+        :param download_tuning: Tuning of the download, whose unset options keep the defaults of yt-dlp
+        :return: Options of yt-dlp
+        """
+        ydl_opts = {
+            'format': DOWNLOAD_FORMAT,
+            'outtmpl': output_path,
+            'cachedir': '/tmp/yt-dlp',
+            'merge_output_format': 'mkv',
+            'progress_hooks': [progress_tracker.hook],
+            'logger': progress_tracker
+        }
+        if not download_tuning:
+            return ydl_opts
+        if download_tuning.concurrent_fragment_downloads:
+            ydl_opts['concurrent_fragment_downloads'] = download_tuning.concurrent_fragment_downloads
+        if download_tuning.http_chunk_size:
+            ydl_opts['http_chunk_size'] = download_tuning.http_chunk_size
+        if download_tuning.buffer_size:
+            ydl_opts['buffersize'] = download_tuning.buffer_size
+        if download_tuning.external_downloader:
+            # Only the fragmented protocols, as a range download is always made by ffmpeg
+            ydl_opts['external_downloader'] = {
+                'dash': download_tuning.external_downloader,
+                'm3u8': download_tuning.external_downloader,
+            }
+        if download_tuning.retries:
+            ydl_opts['retries'] = download_tuning.retries
+        if download_tuning.fragment_retries:
+            ydl_opts['fragment_retries'] = download_tuning.fragment_retries
+        return ydl_opts
+
+    def _get_download_tuning(self, download_tuning: model_pb2.DownloadTuning = None) -> model_pb2.DownloadTuning:
+        """
+        Get the tuning of a download
+        :param download_tuning: Tuning of the request, or None to use the tuning of the deployment
+        :return: Tuning of the deployment, with the options set by the request overriding it
+        """
+        tuning = model_pb2.DownloadTuning()
+        tuning.CopyFrom(self.download_tuning)
+        if download_tuning:
+            tuning.MergeFrom(download_tuning)
+        return tuning
+
+    @staticmethod
+    def _get_download_tuning_from_env() -> model_pb2.DownloadTuning:
+        """
+        Get the tuning of the downloads for the deployment from the environment, leaving the defaults of yt-dlp for
+        unset options
+        :return: Tuning of the downloads
+        """
+        return model_pb2.DownloadTuning(
+            concurrent_fragment_downloads=int(os.environ.get('YTDLP_CONCURRENT_FRAGMENT_DOWNLOADS', 0)),
+            http_chunk_size=int(os.environ.get('YTDLP_HTTP_CHUNK_SIZE', 0)),
+            buffer_size=int(os.environ.get('YTDLP_BUFFER_SIZE', 0)),
+            external_downloader=os.environ.get('YTDLP_EXTERNAL_DOWNLOADER', ''),
+            retries=int(os.environ.get('YTDLP_RETRIES', 0)),
+            fragment_retries=int(os.environ.get('YTDLP_FRAGMENT_RETRIES', 0)))
+
+    def _get_download_result(
+            self,
+            video_id: str,
+            info: dict,
+            mode: model_pb2.DownloadMode,
+            progress_tracker: DownloadProgressTracker,
+            download_tuning: model_pb2.DownloadTuning = None) -> model_pb2.DownloadResult:
+        """
+        Get the result of a completed download
+        :param video_id: ID of the video
+        :param info: Info dict of the video, with formats selected
+        :param mode: Mode of the download
+        :param progress_tracker: Tracker which counted the downloaded bytes
+        :param download_tuning: Tuning the download was made with
+        :return: Result of the download
+        """
+        bytes_downloaded = progress_tracker.bytes_downloaded
+        if mode == model_pb2.DOWNLOAD_MODE_RANGE:
+            bytes_avoided = max(0, self._estimate_full_size(info) - bytes_downloaded)
+        else:
+            bytes_avoided = 0
+        download_stats = progress_tracker.get_download_stats(download_tuning)
+        logging.info(
+            "Downloaded %d bytes for video id %s, avoided %d bytes, in %.3f seconds at %.1f bytes per second",
+            bytes_downloaded,
+            video_id,
+            bytes_avoided,
+            download_stats.elapsed_in_sec,
+            download_stats.average_speed_in_bytes_per_sec)
+        return model_pb2.DownloadResult(
+            downloaded=True,
+            mode=mode,
+            bytes_downloaded=bytes_downloaded,
+            bytes_avoided=bytes_avoided,
+            format_id=info.get('format_id') or '',
+            estimated_size_in_bytes=self._estimate_full_size(info),
+            download_stats=download_stats)
+
+    def _download_range_and_trim(
+            self,
+            ydl: yt_dlp.YoutubeDL,
+            info: dict,
+            output_path: str,
+            section_start: int,
+            section_end: int,
+            trim_pp: yt_dlp.postprocessor.ffmpeg.FFmpegPostProcessor,
+            progress_tracker: DownloadProgressTracker) -> None:
+        """
+        Download the section of the video, keeping the source timestamps so the trim can use the requested times as
+        they are, then trim it. A long section is split into sub-ranges downloaded concurrently when the video and audio
+        come in separate formats, as each connection is throttled on its own
+        :param ydl: YoutubeDL instance which extracted the info
+        :param info: Info dict of the video, with formats selected
+        :param output_path: Path of the downloaded video file
+        :param section_start: Start time of the section in seconds
+        :param section_end: End time of the section in seconds
+        :param trim_pp: Post processor which trims the downloaded file
+        :param progress_tracker: Tracker counting the downloaded bytes
+        """
+        segments = self._get_download_segments(info, section_start, section_end) if self.segmented_download else []
+        if len(segments) > 1:
+            segmented_download_pp = self.FFmpegSegmentedDownloadPP(segments)
+            segmented_download_pp.set_downloader(ydl)
+            merged_path = self._get_merge_output_path(output_path)
+            try:
+                segmented_download_pp.download(info, merged_path, progress_tracker)
+            except PostProcessingError as e:
+                logging.warning("Falling back to downloading the section at once, as the segmented download failed: %s", e)
+            else:
+                trim_pp.set_downloader(ydl)
+                ydl.run_pp(trim_pp, {**info, 'filepath': merged_path})
+                return
+
+        ydl.params['download_ranges'] = download_range_func(None, [(section_start, section_end)])
+        ydl.params['external_downloader_args'] = {'ffmpeg_o': ['-copyts']}
+        ydl.add_post_processor(trim_pp)
+        ydl.process_ie_result(info, download=True)
+
+    @staticmethod
+    def _get_download_segments(info: dict, section_start: int, section_end: int) -> list[tuple[int, int]]:
+        """
+        Split the section of the video into sub-ranges, as many as the length of the section and the vCPUs allow
+        :param info: Info dict of the video, with formats selected
+        :param section_start: Start time of the section in seconds
+        :param section_end: End time of the section in seconds
+        :return: Start and end time of each sub-range in seconds, or no sub-range if the section is downloaded at once
+        """
+        formats = info.get('requested_formats') or []
+        # The video is split, and the audio downloaded at once along with it
+        if len(formats) != 2 or {fmt.get('vcodec') == 'none' for fmt in formats} != {True, False}:
+            return []
+        # The downloads wait on the network, each with an ffmpeg process copying the stream
+        count = min(
+            SEGMENT_MAX_COUNT,
+            (section_end - section_start) // SEGMENT_MIN_LENGTH_IN_SEC,
+            2 * (os.cpu_count() or 1))
+        if count < 2:
+            return []
+        bounds = [section_start + (section_end - section_start) * i // count for i in range(count + 1)]
+        return list(zip(bounds, bounds[1:]))
+
+    def _download_and_merge_trim(
+            self,
+            ydl: yt_dlp.YoutubeDL,
+            info: dict,
+            output_path: str,
+            trim_pp: yt_dlp.postprocessor.ffmpeg.FFmpegPostProcessor) -> None:
+        """
+        Download the selected formats to separate files, then merge and trim them with a single post processor
+        :param ydl: YoutubeDL instance which extracted the info
+        :param info: Info dict of the video, with formats selected
+        :param output_path: Path of the output video file
+        :param trim_pp: Post processor which merges and trims the downloaded files
+        """
+        output_path = self._get_merge_output_path(output_path)
+        output_root = os.path.splitext(output_path)[0]
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        files_to_merge = []
+        for fmt in info.get('requested_formats') or [info]:
+            format_info = {**info, **fmt}
+            format_info.pop('requested_formats', None)
+            format_path = f"{output_root}.f{fmt['format_id']}.{fmt['ext']}"
+            success, _ = ydl.dl(format_path, format_info)
+            if not success:
+                raise VimeoUploaderInternalServerError(
+                    f"Failed to download format {fmt['format_id']} of video id {info['id']}")
+            files_to_merge.append(format_path)
+
+        trim_pp.set_downloader(ydl)
+        ydl.run_pp(trim_pp, {
+            **info,
+            'filepath': output_path,
+            '__files_to_merge': files_to_merge
+        })
+
+    @staticmethod
+    def _add_trim_metrics(trim_pp: yt_dlp.postprocessor.PostProcessor, metrics: Metrics) -> None:
+        """
+        Record the run of the post processor as the trim stage, from the progress yt-dlp reports for post processors
+        :param trim_pp: Post processor which trims the video
+        :param metrics: Metrics of the request
+        """
+        started = []
+
+        def hook(progress: dict) -> None:
+            if progress['status'] == 'started':
+                started.append(time.perf_counter())
+            elif progress['status'] == 'finished' and started:
+                metrics.record('trim', time.perf_counter() - started.pop())
+
+        trim_pp.add_progress_hook(hook)
+
+    @staticmethod
+    def _get_merge_output_path(output_path: str) -> str:
+        """
+        Get the path of the merged video, with the same extension yt-dlp would give the merged output
+        :param output_path: Path of the output video file, with or without extension
+        :return: Path of the output video file with mkv extension
+        """
+        return output_path if output_path.endswith('.mkv') else f"{output_path}.mkv"
+
+    @staticmethod
+    def _supports_range_download(info: dict) -> bool:
+        """
+        Check whether the selected formats can be partially downloaded, which requires ffmpeg to read the stream
+        :param info: Info dict of the video, with formats selected
+        :return: True if only a time range of the video can be downloaded
+        """
+        return bool(info.get('protocol')) and not info.get('is_live') and FFmpegFD.can_download(info)
+
+    @staticmethod
+    def _get_download_section(
+            info: dict,
+            start_time_in_sec: int,
+            end_time_in_sec: int) -> tuple[int, int]:
+        """
+        Get the section of the video to download, padded on both sides for keyframes
+        :param info: Info dict of the video
+        :param start_time_in_sec: Start time of trim in seconds
+        :param end_time_in_sec: End time of trim in seconds
+        :return: Start and end time of the section in seconds
+        """
+        section_start = max(0, start_time_in_sec - RANGE_DOWNLOAD_PADDING_IN_SEC)
+        section_end = end_time_in_sec + RANGE_DOWNLOAD_PADDING_IN_SEC
+        if info.get('duration'):
+            section_end = min(section_end, int(info['duration']))
+        return section_start, section_end
+
+    @staticmethod
+    def _estimate_full_size(info: dict) -> int:
+        """
+        Estimate the size of the selected formats, if the whole video were downloaded
+        :param info: Info dict of the video, with formats selected
+        :return: Estimated size in bytes, or 0 if unknown
+        """
+        formats = info.get('requested_formats') or [info]
+        return int(sum(f.get('filesize') or f.get('filesize_approx') or 0 for f in formats))
+
+    class FFmpegTrimPP(yt_dlp.postprocessor.ffmpeg.FFmpegFixupPostProcessor):
+        """
+        Custom post processor used for trimming video
+        """
+
+        def __init__(self, start_time_in_sec: int, end_time_in_sec: int):
+            super().__init__()
+            self.start_time_in_sec = start_time_in_sec
+            self.end_time_in_sec = end_time_in_sec
+
+        def run(self, information):
+            # Seek by the timestamps of the file, as a partially downloaded file keeps the source timestamps
+            input_opts = [
+                '-seek_timestamp', '1',
+                '-ss', str(self.start_time_in_sec),
+                '-to', str(self.end_time_in_sec),
+            ]
+            output_opts = [
+                '-c',
+                'copy',
+            ]
+            filename = information['filepath']
+            temp_filename = prepend_extension(filename, 'temp')
+            # Ordering of inputs matters!
+            self.real_run_ffmpeg([(filename, input_opts)], [
+                                 (temp_filename, output_opts)])
+            os.replace(temp_filename, filename)
+            return [], information
+
+    class FFmpegMergeTrimPP(yt_dlp.postprocessor.ffmpeg.FFmpegPostProcessor):
+        """
+        Custom post processor used for merging the video/audio and trimming it in a single pass
+        """
+
+        def __init__(self, start_time_in_sec: int, end_time_in_sec: int):
+            super().__init__()
+            self.start_time_in_sec = start_time_in_sec
+            self.end_time_in_sec = end_time_in_sec
+
+        def run(self, information):
+            # Seek on the input side, so ffmpeg does not demux everything up to the start of the trim. Seek by the
+            # timestamps of the files, as a partially downloaded file keeps the source timestamps
+            input_opts = [
+                '-seek_timestamp', '1',
+                '-ss', str(self.start_time_in_sec),
+                '-to', str(self.end_time_in_sec),
+            ]
+            files_to_merge = information['__files_to_merge']
+            formats = information.get('requested_formats') or [information]
+            output_opts = ['-c', 'copy', *self._get_map_opts(files_to_merge, formats)]
+            # Ordering of inputs matters!
+            self.real_run_ffmpeg(
+                [(filename, input_opts) for filename in files_to_merge],
+                [(information['filepath'], output_opts)])
+            return files_to_merge, information
+
+        def _get_map_opts(self, files_to_merge: list[str], formats: list[dict], first_input: int = 0) -> list[str]:
+            """
+            Get the options mapping the video and audio of the inputs to the output
+            :param files_to_merge: Paths of the inputs
+            :param formats: Formats of the inputs
+            :param first_input: Index of the first input in the ffmpeg invocation
+            :return: Output options
+            """
+            map_opts = []
+            for i, (filename, fmt) in enumerate(zip(files_to_merge, formats), first_input):
+                if fmt.get('vcodec') != 'none':
+                    map_opts.extend(['-map', f'{i}:v:0?'])
+                if fmt.get('acodec') != 'none':
+                    map_opts.extend(['-map', f'{i}:a:0?'])
+                    # Same fixup as the yt-dlp merger, for AAC audio from HLS
+                    if (fmt.get('protocol') or '').startswith('m3u8') and self.get_audio_codec(filename) == 'aac':
+                        map_opts.extend(['-bsf:a', 'aac_adtstoasc'])
+            return map_opts
+
+    class FFmpegStreamTrimPP(FFmpegMergeTrimPP):
+        """
+        Custom post processor used for merging and trimming the video/audio straight from their URLs, writing the
+        trimmed video to a pipe as it is produced
+        """
+
+        @contextlib.contextmanager
+        def stream(self, information: dict) -> Iterator[FFmpegOutputStream]:
+            """
+            Start ffmpeg writing the trimmed video as Matroska, which needs no seeking back in its output
+            :param information: Info dict of the video, with formats selected
+            :return: Context manager of the output, killing ffmpeg on exit if it is still running
+            """
+            formats = information.get('requested_formats') or [information]
+            cmd = [self.executable, '-y', '-loglevel', 'error', '-nostdin']
+            for fmt in formats:
+                if fmt.get('http_headers') and fmt['url'].startswith('http'):
+                    cmd.extend(['-headers', ''.join(f"{key}: {value}\r\n" for key, value in fmt['http_headers'].items())])
+                # Seeking on the input side requests only the bytes from the keyframe before the start
+                cmd.extend(['-ss', str(self.start_time_in_sec), '-to', str(self.end_time_in_sec), '-i', fmt['url']])
+            cmd.extend(['-c', 'copy', *self._get_map_opts([fmt['url'] for fmt in formats], formats)])
+            cmd.extend(['-f', 'matroska', 'pipe:1'])
+            with tempfile.TemporaryFile() as stderr_file:
+                process = Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=stderr_file)
+                try:
+                    yield FFmpegOutputStream(process, stderr_file)
+                finally:
+                    if process.poll() is None:
+                        process.kill()
+                    process.wait()
+                    process.stdout.close()
+
+    class FFmpegSegmentedDownloadPP(yt_dlp.postprocessor.ffmpeg.FFmpegPostProcessor):
+        """
+        Custom post processor used for downloading the sub-ranges of the video concurrently, along with the audio, then
+        joining them losslessly. Each sub-range starts on the keyframe ffmpeg lands on when seeking, and is cut on the
+        keyframe the next sub-range starts on, so the concatenated video has every frame once.
+        """
+
+        def __init__(self, segments: list[tuple[int, int]]):
+            """
+            :param segments: Start and end time of each sub-range in seconds
+            """
+            super().__init__()
+            self.segments = segments
+
+        def download(self, information: dict, output_path: str, progress_tracker: DownloadProgressTracker) -> None:
+            """
+            Download the video to a file keeping the source timestamps, as a range download by yt-dlp would
+            :param information: Info dict of the video, with separate video and audio formats selected
+            :param output_path: Path of the downloaded video file
+            :param progress_tracker: Tracker counting the downloaded bytes
+            """
+            if not self.probe_available:
+                raise PostProcessingError('ffprobe is required for the segmented download')
+            formats = information['requested_formats']
+            video_format = next(fmt for fmt in formats if fmt.get('vcodec') != 'none')
+            audio_format = next(fmt for fmt in formats if fmt.get('vcodec') == 'none')
+            section_start, section_end = self.segments[0][0], self.segments[-1][1]
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            with tempfile.TemporaryDirectory(dir=os.path.dirname(output_path)) as segment_dir:
+                downloads = [
+                    (video_format, start, end, os.path.join(segment_dir, f'video{i}.mkv'), '0:v:0')
+                    for i, (start, end) in enumerate(self.segments)]
+                downloads.append((audio_format, section_start, section_end, os.path.join(segment_dir, 'audio.mka'), '0:a:0'))
+                with ThreadPoolExecutor(max_workers=len(downloads), thread_name_prefix='segment') as executor:
+                    futures = [
+                        executor.submit(self._download_segment, *download, information.get('duration'), progress_tracker)
+                        for download in downloads]
+                    paths = [future.result() for future in futures]
+                self._concat(paths[:-1], paths[-1], output_path, segment_dir)
+
+        def _download_segment(
+                self,
+                fmt: dict,
+                start: int,
+                end: int,
+                path: str,
+                stream: str,
+                duration: Optional[float],
+                progress_tracker: DownloadProgressTracker) -> str:
+            """
+            Download a sub-range of a format, keeping the source timestamps, retrying it on its own if it fails
+            :param fmt: Format of the video
+            :param start: Start time of the sub-range in seconds
+            :param end: End time of the sub-range in seconds
+            :param path: Path of the downloaded file
+            :param stream: Stream of the format to download
+            :param duration: Duration of the video in seconds, to estimate the size of the sub-range
+            :param progress_tracker: Tracker counting the downloaded bytes
+            :return: Path of the downloaded file
+            """
+            total_bytes = fmt.get('filesize') or fmt.get('filesize_approx')
+            if total_bytes and duration:
+                progress_tracker.hook({
+                    'status': 'downloading',
+                    'filename': path,
+                    'downloaded_bytes': 0,
+                    'total_bytes_estimate': int(total_bytes * (end - start) / duration),
+                })
+            cmd = [self.executable, '-y', '-loglevel', 'error', '-nostdin']
+            if fmt.get('http_headers') and fmt['url'].startswith('http'):
+                cmd.extend(['-headers', ''.join(f"{key}: {value}\r\n" for key, value in fmt['http_headers'].items())])
+            # Seeking on the input side requests only the bytes from the keyframe before the start
+            cmd.extend([
+                '-copyts', '-ss', str(start), '-to', str(end), '-i', fmt['url'],
+                '-map', stream, '-c', 'copy', '-f', 'matroska', path,
+            ])
+            for attempt in range(1, SEGMENT_DOWNLOAD_ATTEMPTS + 1):
+                self.write_debug(f'ffmpeg command line: {cmd}')
+                _, stderr, returncode = Popen.run(
+                    cmd, text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL)
+                if returncode == 0:
+                    progress_tracker.hook({'status': 'finished', 'filename': path, 'total_bytes': os.path.getsize(path)})
+                    return path
+                logging.warning(
+                    "Failed attempt %d at downloading %s to %s of format %s: %s",
+                    attempt, start, end, fmt.get('format_id'), stderr.strip())
+            raise PostProcessingError(f'Failed to download {start} to {end} of format {fmt.get("format_id")}')
+
+        def _concat(self, video_paths: list[str], audio_path: str, output_path: str, segment_dir: str) -> None:
+            """
+            Cut each sub-range of the video on the keyframe the next one starts on, concatenate them and mux them with
+            the audio, keeping the source timestamps
+            :param video_paths: Paths of the sub-ranges of the video, in order
+            :param audio_path: Path of the audio
+            :param output_path: Path of the joined video file
+            :param segment_dir: Directory for the intermediate segments
+            """
+            starts = [self._get_start_time(path) for path in video_paths]
+            if any(start >= next_start for start, next_start in zip(starts, starts[1:])):
+                raise PostProcessingError(f'Sub-ranges overlap on their keyframes {starts}')
+            segment_paths = []
+            for i, path in enumerate(video_paths[:-1]):
+                # Timestamps start at 0 without -copyts, so the cut is relative to the start of the sub-range
+                split_pattern = os.path.join(segment_dir, f'cut{i}_%d.mkv')
+                cmd = [
+                    self.executable, '-y', '-loglevel', 'error', '-i', self._ffmpeg_filename_argument(path),
+                    '-map', '0:v:0', '-c', 'copy',
+                    '-f', 'segment', '-segment_format', 'matroska', '-reset_timestamps', '1',
+                    '-segment_times', f'{starts[i + 1] - starts[i]:.3f}', '-segment_time_delta', '0.01',
+                    split_pattern,
+                ]
+                self.write_debug(f'ffmpeg command line: {cmd}')
+                _, stderr, returncode = Popen.run(
+                    cmd, text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE)
+                if returncode != 0:
+                    raise PostProcessingError(f'Failed to cut the sub-range on its last keyframe: {stderr.strip()}')
+                segment_paths.append(split_pattern % 0)
+            segment_paths.append(video_paths[-1])
+
+            concat_path = os.path.join(segment_dir, 'concat.txt')
+            with open(concat_path, 'w') as file:
+                file.writelines(f"file '{path}'\n" for path in segment_paths)
+            # The concatenated video starts at 0, and is shifted back to the source timestamp of its first keyframe
+            self.real_run_ffmpeg(
+                [(concat_path, ['-copyts', '-itsoffset', f'{starts[0]:.3f}', '-f', 'concat', '-safe', '0']),
+                 (audio_path, [])],
+                [(output_path, ['-map', '0:v:0', '-map', '1:a:0', '-c', 'copy'])])
+
+        def _get_start_time(self, path: str) -> float:
+            """
+            :param path: Path of a sub-range of the video
+            :return: Timestamp of its first packet in seconds, which is the keyframe ffmpeg landed on
+            """
+            metadata = self.get_metadata_object(path, [
+                '-select_streams', 'v:0', '-read_intervals', '%+#1', '-show_entries', 'packet=pts_time'])
+            packets = metadata.get('packets') or []
+            if not packets or packets[0].get('pts_time') in (None, 'N/A'):
+                raise PostProcessingError(f'No packets found in {path}')
+            return float(packets[0]['pts_time'])
+
+    class FFmpegMultiTrimPP(FFmpegMergeTrimPP):
+        """
+        Custom post processor used for cutting many clips out of the same download. Stream copied clips are cut in a
+        single ffmpeg invocation with an output per clip, smart cut clips one after another.
+        """
+
+        def __init__(
+                self,
+                clips: list[tuple[int, int, str]],
+                trim_mode: model_pb2.TrimMode = model_pb2.TRIM_MODE_COPY):
+            """
+            :param clips: Start time, end time and output path of each clip
+            :param trim_mode: Mode of trimming
+            """
+            super().__init__(min(start for start, _, _ in clips), max(end for _, end, _ in clips))
+            self.clips = clips
+            self.trim_mode = trim_mode
+
+        def run(self, information):
+            if '__files_to_merge' in information:
+                # Downloaded separately, the inputs are removed once the clips are cut
+                files_to_merge = information['__files_to_merge']
+                formats = information.get('requested_formats') or [information]
+                files_to_delete = files_to_merge
+            else:
+                # Downloaded as one file by yt-dlp, which keeps track of it
+                files_to_merge = [information['filepath']]
+                formats = [information]
+                files_to_delete = []
+
+            if self.trim_mode == model_pb2.TRIM_MODE_SMART:
+                for start, end, output_path in self.clips:
+                    smart_trim_pp = YouTubePlatform.FFmpegSmartTrimPP(start, end)
+                    smart_trim_pp.set_downloader(self._downloader)
+                    smart_trim_pp.run({
+                        **information,
+                        'filepath': output_path,
+                        'requested_formats': formats,
+                        '__files_to_merge': files_to_merge
+                    })
+                return files_to_delete, information
+
+            inputs = []
+            outputs = []
+            for start, end, output_path in self.clips:
+                input_opts = ['-seek_timestamp', '1', '-ss', str(start), '-to', str(end)]
+                output_opts = ['-c', 'copy', *self._get_map_opts(files_to_merge, formats, len(inputs))]
+                inputs.extend((filename, input_opts) for filename in files_to_merge)
+                outputs.append((output_path, output_opts))
+            # Ordering of inputs matters!
+            self.real_run_ffmpeg(inputs, outputs)
+            return files_to_delete, information
+
+    class FFmpegSmartTrimPP(yt_dlp.postprocessor.ffmpeg.FFmpegPostProcessor):
+        """
+        Custom post processor used for frame accurate trimming. Only the partial GOPs at the start and end of the trim
+        are re-encoded, the video in between is stream copied, and the pieces are concatenated losslessly.
+        Falls back to the stream copy trim when the video cannot be smart cut.
+        """
+
+        def __init__(self, start_time_in_sec: int, end_time_in_sec: int):
+            super().__init__()
+            self.start_time_in_sec = start_time_in_sec
+            self.end_time_in_sec = end_time_in_sec
+
+        def run(self, information):
+            filename = information['filepath']
+            if '__files_to_merge' in information:
+                files_to_merge = information['__files_to_merge']
+                formats = information.get('requested_formats') or [information]
+            else:
+                files_to_merge = [filename]
+                formats = [information]
+            video_path = next(
+                (f for f, fmt in zip(files_to_merge, formats) if fmt.get('vcodec') != 'none'), None)
+            audio_path = next(
+                (f for f, fmt in zip(files_to_merge, formats) if fmt.get('acodec') != 'none'), None)
+
+            temp_filename = prepend_extension(filename, 'temp')
+            try:
+                if video_path is None or not self.probe_available:
+                    raise PostProcessingError('ffprobe and a video stream are required for smart cut')
+                with tempfile.TemporaryDirectory(dir=os.path.dirname(filename)) as segment_dir:
+                    self._smart_cut(video_path, audio_path, temp_filename, segment_dir)
+            except PostProcessingError as e:
+                self.report_warning(f'Falling back to stream copy trim, as smart cut failed: {e}')
+                if '__files_to_merge' in information:
+                    fallback_pp = YouTubePlatform.FFmpegMergeTrimPP(self.start_time_in_sec, self.end_time_in_sec)
+                else:
+                    fallback_pp = YouTubePlatform.FFmpegTrimPP(self.start_time_in_sec, self.end_time_in_sec)
+                fallback_pp.set_downloader(self._downloader)
+                return fallback_pp.run(information)
+
+            os.replace(temp_filename, filename)
+            return [f for f in files_to_merge if f != filename], information
+
+        def _smart_cut(self, video_path: str, audio_path: str, output_path: str, segment_dir: str) -> None:
+            """
+            Cut the video into re-encoded head, stream copied middle and re-encoded tail, then concatenate them and mux
+            with the audio trimmed by stream copy
+            :param video_path: Path of the file with the video stream
+            :param audio_path: Path of the file with the audio stream, if any
+            :param output_path: Path of the trimmed output file
+            :param segment_dir: Directory for the intermediate segments
+            """
+            codec_name, pix_fmt, keyframes = self._probe_video(video_path)
+            if codec_name not in SMART_TRIM_ENCODERS:
+                raise PostProcessingError(f'Smart cut is not supported for codec {codec_name}')
+            encoder_opts = SMART_TRIM_ENCODERS[codec_name]
+
+            segment_paths = []
+            for i, (start, end, encode) in enumerate(self._get_segments(keyframes)):
+                if encode:
+                    segment_path = os.path.join(segment_dir, f'segment{i}.mkv')
+                    self.real_run_ffmpeg(
+                        [(video_path, ['-seek_timestamp', '1', '-ss', str(start), '-to', str(end)])],
+                        [(segment_path, ['-map', '0:v:0', '-an', *encoder_opts, '-pix_fmt', pix_fmt])])
+                else:
+                    segment_path = self._copy_segment(video_path, start, end, segment_dir)
+                segment_paths.append(segment_path)
+
+            concat_path = os.path.join(segment_dir, 'concat.txt')
+            with open(concat_path, 'w') as file:
+                file.writelines(f"file '{path}'\n" for path in segment_paths)
+            # The concat demuxer converts H.264 to Annex B, so each segment keeps its own parameter sets
+            input_path_opts = [(concat_path, ['-f', 'concat', '-safe', '0'])]
+            output_opts = ['-map', '0:v:0', '-c', 'copy']
+            if audio_path:
+                # Audio packets are all keyframes, so dropping the packets before the seek point on the output side
+                # trims the audio exactly, even when the demuxer lands early
+                audio_segment_path = os.path.join(segment_dir, 'audio.mka')
+                self.real_run_ffmpeg(
+                    [(audio_path, ['-seek_timestamp', '1', '-ss', str(self.start_time_in_sec)])],
+                    [(audio_segment_path, [
+                        '-map', '0:a:0', '-c:a', 'copy',
+                        '-ss', '0', '-t', str(self.end_time_in_sec - self.start_time_in_sec),
+                    ])])
+                input_path_opts.append((audio_segment_path, []))
+                output_opts.extend(['-map', '1:a:0'])
+            self.real_run_ffmpeg(input_path_opts, [(output_path, output_opts)])
+
+        def _copy_segment(self, video_path: str, start: float, end: float, segment_dir: str) -> str:
+            """
+            Stream copy the video between two keyframes. Stream copy keeps the packets from the keyframe the demuxer
+            lands on when seeking, which can be earlier than the requested one, so the landing keyframe is found first
+            and the segment muxer splits exactly on the requested keyframes.
+            :param video_path: Path of the file with the video stream
+            :param start: Timestamp of the keyframe starting the segment
+            :param end: Timestamp of the keyframe ending the segment
+            :param segment_dir: Directory for the intermediate segments
+            :return: Path of the segment
+            """
+            seek_opts = ['-seek_timestamp', '1', '-ss', str(start)]
+            landing_path = os.path.join(segment_dir, 'landing.framecrc')
+            self.real_run_ffmpeg(
+                [(video_path, ['-copyts', *seek_opts])],
+                [(landing_path, ['-map', '0:v:0', '-c', 'copy', '-frames:v', '1', '-f', 'framecrc'])])
+            landing = self._read_first_pts(landing_path)
+
+            # Segment times are relative to the landing keyframe
+            split_times = [t - landing for t in (start, end) if t > landing]
+            split_pattern = os.path.join(segment_dir, 'copy%d.mkv')
+            cmd = [
+                self.executable, '-y', '-loglevel', 'error',
+                *seek_opts, '-to', str(end + 1), '-i', self._ffmpeg_filename_argument(video_path),
+                '-map', '0:v:0', '-an', '-c:v', 'copy',
+                '-f', 'segment', '-segment_format', 'matroska', '-reset_timestamps', '1',
+                '-segment_times', ','.join(f'{t:.3f}' for t in split_times),
+                split_pattern,
+            ]
+            self.write_debug(f'ffmpeg command line: {cmd}')
+            _, stderr, returncode = Popen.run(
+                cmd, text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE)
+            if returncode != 0:
+                raise PostProcessingError(f'Failed to split the video on keyframes: {stderr.strip()}')
+            return split_pattern % (len(split_times) - 1)
+
+        @staticmethod
+        def _read_first_pts(framecrc_path: str) -> float:
+            """
+            Read the timestamp of the first packet written by the framecrc muxer
+            :param framecrc_path: Path of the framecrc output
+            :return: Timestamp of the first packet in seconds
+            """
+            time_base = None
+            with open(framecrc_path) as file:
+                for line in file:
+                    if line.startswith('#tb 0:'):
+                        time_base = Fraction(line.split(':')[1].strip())
+                    elif not line.startswith('#') and time_base is not None:
+                        return float(int(line.split(',')[2]) * time_base)
+            raise PostProcessingError(f'No packets found in {framecrc_path}')
+
+        def _probe_video(self, video_path: str) -> tuple[str, str, list[float]]:
+            """
+            Probe the video stream for its codec, pixel format and the keyframes within the trim
+            :param video_path: Path of the file with the video stream
+            :return: Codec name, pixel format and timestamps of the keyframes
+            """
+            metadata = self.get_metadata_object(video_path, [
+                '-select_streams', 'v:0',
+                '-read_intervals', f'{self.start_time_in_sec}%{self.end_time_in_sec}',
+                '-show_entries', 'packet=pts_time,flags',
+            ])
+            stream = metadata['streams'][0]
+            keyframes = sorted(
+                float(packet['pts_time']) for packet in metadata.get('packets', [])
+                if 'K' in packet.get('flags', '') and packet.get('pts_time') not in (None, 'N/A'))
+            return stream['codec_name'], stream['pix_fmt'], keyframes
+
+        def _get_segments(self, keyframes: list[float]) -> list[tuple[float, float, bool]]:
+            """
+            Split the trim on the first and last keyframe within it
+            :param keyframes: Timestamps of the keyframes of the video
+            :return: Start time, end time and whether to re-encode, for each segment
+            """
+            start, end = self.start_time_in_sec, self.end_time_in_sec
+            inner_keyframes = [k for k in keyframes if start <= k <= end]
+            if len(inner_keyframes) < 2:
+                # No whole GOP to copy, so the clip is short enough to re-encode
+                return [(start, end, True)]
+            first_keyframe, last_keyframe = inner_keyframes[0], inner_keyframes[-1]
+            segments = []
+            if first_keyframe > start:
+                segments.append((start, first_keyframe, True))
+            segments.append((first_keyframe, last_keyframe, False))
+            if end > last_keyframe:
+                segments.append((last_keyframe, end, True))
+            return segments
@@ -0,0 +1,184 @@
+import json
+from unittest import mock
+
+import app
+from core.generated import model_pb2
+from core.jobs import SQLiteJobStore, create_job
+
+PROCESS_VIDEO_REQUEST = {
+    'download_platform': 'youtube',
+    'upload_platform': 'vimeo',
+    'video_id': 'XsX3ATc3FbA',
+    'start_time_in_sec': 60,
+    'end_time_in_sec': 120,
+    'image_identifier': '8961de50-6033-4d2f-9ecc-b1279d450906',
+    'title': 'BTS MV',
+    'download': True,
+}
+
+
+def test_handle_process_video_upload_invalid_trim_mode() -> None:
+    """
+    Test rejecting an unknown trim mode with a bad request response, rather than failing the invocation
+    :return: Nothing
+    """
+    response = app.handle_process_video_upload({'body': {**PROCESS_VIDEO_REQUEST, 'trim_mode': 'fast'}}, None)
+    assert response['statusCode'] == 400
+    assert json.loads(response['body']) == {'error': "Trim mode fast is not supported"}
+
+    response = app.handle_process_video_clips_upload({'body': {
+        **PROCESS_VIDEO_REQUEST, 'clips': [], 'trim_mode': 'fast'}}, None)
+    assert response['statusCode'] == 400
+
+
+def test_handle_process_video_upload_invalid_download_tuning() -> None:
+    """
+    Test rejecting a malformed download tuning, or an external downloader the request may not pick, with a bad request
+    response
+    :return: Nothing
+    """
+    for download_tuning in [{'retries': 'many'}, {'external_downloader': '/tmp/downloader'}]:
+        response = app.handle_process_video_upload({'body': {
+            **PROCESS_VIDEO_REQUEST, 'download_tuning': download_tuning}}, None)
+        assert response['statusCode'] == 400
+
+        response = app.handle_process_video_clips_upload({'body': {
+            **PROCESS_VIDEO_REQUEST, 'clips': [], 'download_tuning': download_tuning}}, None)
+        assert response['statusCode'] == 400
+
+
+def test_handle_process_video_clips_upload_invalid_request() -> None:
+    """
+    Test rejecting a malformed clip, or a request missing a required key, with a bad request response
+    :return: Nothing
+    """
+    request = {**PROCESS_VIDEO_REQUEST, 'clips': [{'start_time_in_sec': 'start'}]}
+    response = app.handle_process_video_clips_upload({'body': request}, None)
+    assert response['statusCode'] == 400
+    assert json.loads(response['body'])['error'].startswith("Clip is invalid")
+
+    for key in ['clips', 'video_id', 'upload_platform']:
+        response = app.handle_process_video_clips_upload({'body': {
+            name: value for name, value in {**PROCESS_VIDEO_REQUEST, 'clips': []}.items() if name != key}}, None)
+        assert response['statusCode'] == 400
+        assert json.loads(response['body']) == {'error': f"Request is missing {key}"}
+
+
+def test_handle_get_video_metadata_invalid_cache_control() -> None:
+    """
+    Test rejecting an unknown cache query parameter with a bad request response
+    :return: Nothing
+    """
+    response = app.handle_get_video_metadata({'queryStringParameters': {
+        'platform': 'youtube', 'video_id': 'XsX3ATc3FbA', 'cache': 'refresh'}}, None)
+    assert response['statusCode'] == 400
+    assert json.loads(response['body']) == {'error': "Cache control refresh is not supported"}
+
+    response = app.handle_get_videos_metadata({'queryStringParameters': {
+        'platform': 'youtube', 'video_ids': 'XsX3ATc3FbA', 'cache': 'refresh'}}, None)
+    assert response['statusCode'] == 400
+
+
+def test_handle_submit_video_job(tmpdir, monkeypatch) -> None:
+    """
+    Test submitting a job, which invokes the worker with its id, and rejecting an invalid request before storing it
+    :return: Nothing
+    """
+    monkeypatch.setenv('JOB_WORKER_FUNCTION_NAME', 'process-video-job')
+    job_store = SQLiteJobStore(str(tmpdir.join('jobs.sqlite')))
+    lambda_client = mock.MagicMock()
+    with mock.patch('app.get_lambda_client', return_value=lambda_client):
+        response = app._handle_submit_video_job(PROCESS_VIDEO_REQUEST, job_store)
+        assert response['statusCode'] == 202
+        job_id = json.loads(response['body'])['jobId']
+        assert job_store.get(job_id).status == model_pb2.JOB_STATUS_PENDING
+        lambda_client.invoke.assert_called_once_with(
+            FunctionName='process-video-job', InvocationType='Event', Payload=json.dumps({'job_id': job_id}))
+
+        lambda_client.reset_mock()
+        for request in [
+                {key: value for key, value in PROCESS_VIDEO_REQUEST.items() if key != 'title'},
+                {**PROCESS_VIDEO_REQUEST, 'upload_platform': 'dailymotion'},
+                {**PROCESS_VIDEO_REQUEST, 'trim_mode': 'fast'},
+                {**PROCESS_VIDEO_REQUEST, 'download_tuning': {'retries': 'many'}}]:
+            assert app._handle_submit_video_job(request, job_store)['statusCode'] == 400
+        lambda_client.invoke.assert_not_called()
+        response = app._handle_submit_video_job({**PROCESS_VIDEO_REQUEST, 'upload_platform': 'dailymotion'}, job_store)
+        assert json.loads(response['body']) == {'error': "Platform dailymotion is not supported"}
+
+
+def test_handle_process_video_job(tmpdir) -> None:
+    """
+    Test running a job to its result, and failing the job rather than the invocation when its driver cannot be built
+    :return: Nothing
+    """
+    job_store = SQLiteJobStore(str(tmpdir.join('jobs.sqlite')))
+    job_state = create_job(job_store, PROCESS_VIDEO_REQUEST)
+    driver = mock.MagicMock()
+    driver.process_video.return_value = model_pb2.VideoProcessResult(upload_url='https://vimeo.com/1')
+    app._handle_process_video_job(job_state.job_id, job_store, driver)
+
+    job_state = job_store.get(job_state.job_id)
+    assert job_state.status == model_pb2.JOB_STATUS_SUCCEEDED
+    assert job_state.result.upload_url == 'https://vimeo.com/1'
+    assert driver.process_video.call_args.args[:6] == ('XsX3ATc3FbA', 60, 120, PROCESS_VIDEO_REQUEST['image_identifier'],
+                                                       'BTS MV', True)
+
+    job_state = create_job(job_store, {
+        key: value for key, value in PROCESS_VIDEO_REQUEST.items() if key != 'download_platform'})
+    app._handle_process_video_job(job_state.job_id, job_store)
+    job_state = job_store.get(job_state.job_id)
+    assert job_state.status == model_pb2.JOB_STATUS_FAILED
+    assert job_state.error
+
+    assert app._handle_process_video_job('missing', job_store) is None
+
+
+def test_handle_process_video_job_delivered_twice(tmpdir) -> None:
+    """
+    Test that a job delivered again to the worker, once it is running or done, is not processed again
+    :return: Nothing
+    """
+    job_store = SQLiteJobStore(str(tmpdir.join('jobs.sqlite')))
+    job_state = create_job(job_store, PROCESS_VIDEO_REQUEST)
+    driver = mock.MagicMock()
+
+    def process_video(*args, progress=None):
+        # Delivered again while the first delivery is processing the video
+        app._handle_process_video_job(job_state.job_id, job_store, driver)
+        return model_pb2.VideoProcessResult(upload_url='https://vimeo.com/1')
+
+    driver.process_video.side_effect = process_video
+    app._handle_process_video_job(job_state.job_id, job_store, driver)
+    app._handle_process_video_job(job_state.job_id, job_store, driver)
+
+    driver.process_video.assert_called_once()
+    assert job_store.get(job_state.job_id).status == model_pb2.JOB_STATUS_SUCCEEDED
+
+
+def test_handle_get_video_job(tmpdir) -> None:
+    """
+    Test reporting a job, a missing job and a failing job store
+    :return: Nothing
+    """
+    job_store = SQLiteJobStore(str(tmpdir.join('jobs.sqlite')))
+    job_state = create_job(job_store, PROCESS_VIDEO_REQUEST)
+    response = app._handle_get_video_job(job_state.job_id, job_store)
+    assert response['statusCode'] == 200
+    assert json.loads(response['body'])['jobId'] == job_state.job_id
+
+    assert app._handle_get_video_job('missing', job_store)['statusCode'] == 404
+
+    job_store = mock.MagicMock()
+    job_store.get.side_effect = Exception("Access denied")
+    assert app._handle_get_video_job(job_state.job_id, job_store)['statusCode'] == 500
+
+
+def test_job_handlers_without_job_store(monkeypatch) -> None:
+    """
+    Test that a job store which cannot be created is reported with an internal server error response
+    :return: Nothing
+    """
+    monkeypatch.setattr(app, 'get_job_store', mock.MagicMock(side_effect=Exception("JOB_STORE_BUCKET_NAME is required")))
+    assert app._handle_submit_video_job(PROCESS_VIDEO_REQUEST)['statusCode'] == 500
+    assert app._handle_get_video_job('job')['statusCode'] == 500
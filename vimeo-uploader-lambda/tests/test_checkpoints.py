@@ -0,0 +1,44 @@
+from unittest import mock
+
+from core.checkpoints import Checkpointer, get_checkpoint_key
+from core.metadata_cache import LocalMetadataStore
+
+
+def test_checkpoint_key() -> None:
+    options = {'platform': 'YouTubePlatform', 'trim_mode': 'TRIM_MODE_COPY'}
+    assert get_checkpoint_key("XsX3ATc3FbA", 60, 120, options) == get_checkpoint_key(
+        "XsX3ATc3FbA", 60, 120, dict(reversed(options.items())))
+    assert get_checkpoint_key("XsX3ATc3FbA", 60, 120, options) != get_checkpoint_key(
+        "XsX3ATc3FbA", 60, 121, options)
+
+
+def test_checkpointer(tmpdir) -> None:
+    store = LocalMetadataStore(str(tmpdir.join('checkpoints')))
+    checkpointer = Checkpointer(store, 'clip')
+    checkpointer.stage('download').update(completed=True, artifact='/tmp/clip.mkv', size=1024)
+    checkpointer.stage('upload', {'title': "BTS MV"}).update(upload_id='upload', attributes={'pictures_uri': 'uri'})
+
+    # A retry loads the checkpoint, and forgets the stages made with other inputs
+    checkpointer = Checkpointer(store, 'clip')
+    assert checkpointer.get('download').completed
+    assert checkpointer.stage('upload', {'title': "BTS MV"}).get().attributes['pictures_uri'] == 'uri'
+    assert checkpointer.stage('upload', {'title': "Renamed"}).get().upload_id == ''
+    assert checkpointer.get('missing').artifact == ''
+
+
+def test_checkpointer_expiration(tmpdir) -> None:
+    store = LocalMetadataStore(str(tmpdir.join('checkpoints')))
+    with mock.patch('core.checkpoints.time.time', return_value=1000):
+        Checkpointer(store, 'clip').stage('download').update(completed=True)
+    with mock.patch('core.checkpoints.time.time', return_value=1000 + 24 * 3600):
+        assert not Checkpointer(store, 'clip').get('download').completed
+
+
+def test_checkpointer_store_failure() -> None:
+    store = mock.MagicMock()
+    store.get.side_effect = ConnectionError("Connection reset")
+    store.put.side_effect = ConnectionError("Connection reset")
+    # Checkpoints are an optimization, the request goes on without them
+    checkpointer = Checkpointer(store, 'clip')
+    checkpointer.stage('download').update(completed=True)
+    assert checkpointer.get('download').completed
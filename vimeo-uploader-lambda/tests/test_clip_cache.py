@@ -0,0 +1,47 @@
+from unittest import mock
+
+from botocore.exceptions import ClientError
+
+from core.clip_cache import ClipCache
+
+OPTIONS = {'platform': 'YouTubePlatform', 'trim_mode': 'TRIM_MODE_COPY', 'format': 'bv*+ba/b'}
+
+
+def test_get_object_key() -> None:
+    """
+    Test that the key depends on the clip options, but not on their order
+    :return: Nothing
+    """
+    object_key = ClipCache.get_object_key("XsX3ATc3FbA", 60, 120, OPTIONS)
+    assert object_key.startswith("XsX3ATc3FbA_60_120_")
+    assert object_key == ClipCache.get_object_key("XsX3ATc3FbA", 60, 120, dict(reversed(OPTIONS.items())))
+    assert object_key != ClipCache.get_object_key(
+        "XsX3ATc3FbA", 60, 120, {**OPTIONS, 'trim_mode': 'TRIM_MODE_SMART'})
+
+
+def test_lookup_hit() -> None:
+    s3_client = mock.MagicMock()
+    s3_client.head_object.return_value = {'ContentLength': 1024, 'Metadata': ClipCache.get_metadata(OPTIONS)}
+    clip_cache = ClipCache(s3_client, "vimeo-uploader-videos")
+    assert clip_cache.lookup("XsX3ATc3FbA_60_120_key", OPTIONS) == 1024
+    s3_client.head_object.assert_called_with(Bucket="vimeo-uploader-videos", Key="XsX3ATc3FbA_60_120_key")
+
+
+def test_lookup_miss() -> None:
+    s3_client = mock.MagicMock()
+    s3_client.head_object.side_effect = ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+    clip_cache = ClipCache(s3_client, "vimeo-uploader-videos")
+    assert clip_cache.lookup("XsX3ATc3FbA_60_120_key", OPTIONS) is None
+
+
+def test_lookup_other_options() -> None:
+    """
+    Test that a clip stored with other options is not reused
+    :return: Nothing
+    """
+    s3_client = mock.MagicMock()
+    s3_client.head_object.return_value = {
+        'ContentLength': 1024,
+        'Metadata': ClipCache.get_metadata({**OPTIONS, 'trim_mode': 'TRIM_MODE_SMART'})}
+    clip_cache = ClipCache(s3_client, "vimeo-uploader-videos")
+    assert clip_cache.lookup("XsX3ATc3FbA_60_120_key", OPTIONS) is None
@@ -0,0 +1,162 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import pytest
+from botocore.exceptions import ClientError
+
+from core.coalescing import DynamoDBLeaseStore, RequestCoalescer, SQLiteLeaseStore, get_request_key
+from core.exceptions import VimeoUploaderInternalServerError
+from core.generated import model_pb2
+
+RESULT = model_pb2.VideoProcessResult(upload_url="https://vimeo.com/XsX3ATc3FbA")
+
+
+def test_request_key() -> None:
+    assert get_request_key(video_id=" XsX3ATc3FbA", start_time_in_sec=60) == get_request_key(
+        start_time_in_sec=60, video_id="XsX3ATc3FbA")
+    assert get_request_key(video_id="XsX3ATc3FbA", start_time_in_sec=60) != get_request_key(
+        video_id="XsX3ATc3FbA", start_time_in_sec=61)
+
+
+def test_coalesce_in_process() -> None:
+    coalescer = RequestCoalescer()
+    started = threading.Event()
+    release = threading.Event()
+    process = mock.MagicMock()
+
+    def run() -> model_pb2.VideoProcessResult:
+        started.set()
+        release.wait()
+        process()
+        return RESULT
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        leader = executor.submit(coalescer.run, 'clip', run)
+        started.wait()
+        followers = [executor.submit(coalescer.run, 'clip', run) for _ in range(2)]
+        # The followers wait for the leader rather than processing the request
+        time.sleep(0.1)
+        release.set()
+        results = [leader.result()] + [follower.result() for follower in followers]
+
+    process.assert_called_once()
+    assert results == [RESULT] * 3
+    assert not coalescer.flights
+
+
+def test_coalesce_across_instances(tmpdir) -> None:
+    path = str(tmpdir.join('leases.sqlite'))
+    # Each coalescer stands in for another container, sharing the lease store
+    leader = RequestCoalescer(SQLiteLeaseStore(path))
+    follower = RequestCoalescer(SQLiteLeaseStore(path), poll_interval_in_sec=0.05)
+    started = threading.Event()
+    leader_process = mock.MagicMock(return_value=RESULT)
+    process = mock.MagicMock(return_value=RESULT)
+
+    def run() -> model_pb2.VideoProcessResult:
+        started.set()
+        time.sleep(0.2)
+        return leader_process()
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(leader.run, 'clip', run)
+        started.wait()
+        assert follower.run('clip', process) == RESULT
+        assert future.result() == RESULT
+
+    process.assert_not_called()
+    leader_process.assert_called_once()
+
+
+def test_coalesce_crashed_leader(tmpdir) -> None:
+    lease_store = SQLiteLeaseStore(str(tmpdir.join('leases.sqlite')))
+    # The leader crashed without releasing its lease
+    assert lease_store.acquire('clip', 'crashed', 0.2)
+    follower = RequestCoalescer(lease_store, poll_interval_in_sec=0.05)
+
+    assert follower.run('clip', lambda: RESULT) == RESULT
+    assert lease_store.get('clip').result == RESULT.SerializeToString()
+
+
+def test_coalesce_failed_leader(tmpdir) -> None:
+    lease_store = SQLiteLeaseStore(str(tmpdir.join('leases.sqlite')))
+    coalescer = RequestCoalescer(lease_store)
+
+    def fail() -> model_pb2.VideoProcessResult:
+        raise VimeoUploaderInternalServerError("Failed to upload")
+
+    with pytest.raises(VimeoUploaderInternalServerError):
+        coalescer.run('clip', fail)
+    # The lease is released, so the next request processes it again
+    assert lease_store.get('clip') is None
+    assert coalescer.run('clip', lambda: RESULT) == RESULT
+
+
+def test_coalesce_renews_lease(tmpdir) -> None:
+    lease_store = SQLiteLeaseStore(str(tmpdir.join('leases.sqlite')))
+    coalescer = RequestCoalescer(lease_store, lease_ttl_in_sec=0.15)
+
+    def run() -> model_pb2.VideoProcessResult:
+        time.sleep(0.4)
+        # The leader still holds the lease, long after its time to live
+        assert not lease_store.acquire('clip', 'other', 0.15)
+        return RESULT
+
+    assert coalescer.run('clip', run) == RESULT
+
+
+def test_dynamodb_lease_store() -> None:
+    dynamodb_client = mock.MagicMock()
+    lease_store = DynamoDBLeaseStore(dynamodb_client, 'leases')
+    assert lease_store.acquire('clip', 'leader', 60)
+    assert dynamodb_client.put_item.call_args.kwargs['ConditionExpression'] == \
+        'attribute_not_exists(lease_key) OR expires_at < :now'
+
+    dynamodb_client.put_item.side_effect = ClientError(
+        {'Error': {'Code': 'ConditionalCheckFailedException'}}, 'PutItem')
+    assert not lease_store.acquire('clip', 'follower', 60)
+
+    dynamodb_client.get_item.return_value = {'Item': {
+        'lease_key': {'S': 'clip'},
+        'lease_owner': {'S': 'leader'},
+        'expires_at': {'N': '1000.5'},
+        'result': {'B': b'result'},
+    }}
+    lease = lease_store.get('clip')
+    assert (lease.owner, lease.expires_at, lease.result) == ('leader', 1000.5, b'result')
+
+
+def test_coalesce_result_ttl(tmpdir) -> None:
+    lease_store = SQLiteLeaseStore(str(tmpdir.join('leases.sqlite')))
+    process = mock.MagicMock(return_value=RESULT)
+
+    # By default the result is only kept for the followers polling for it
+    coalescer = RequestCoalescer(lease_store, poll_interval_in_sec=0.05)
+    assert coalescer.run('clip', process) == RESULT
+    assert lease_store.get('clip').expires_at <= time.time() + 0.1
+    time.sleep(0.15)
+    assert coalescer.run('clip', process) == RESULT
+    assert process.call_count == 2
+
+    # A longer time to live is opted into
+    coalescer = RequestCoalescer(lease_store, result_ttl_in_sec=60)
+    assert coalescer.run('other', process) == RESULT
+    assert RequestCoalescer(lease_store).run('other', process) == RESULT
+    assert process.call_count == 3
+
+
+def test_coalesce_failed_release() -> None:
+    lease_store = mock.MagicMock()
+    lease_store.acquire.return_value = True
+    lease_store.release.side_effect = ClientError({'Error': {'Code': 'ThrottlingException'}}, 'DeleteItem')
+    coalescer = RequestCoalescer(lease_store)
+
+    def fail() -> model_pb2.VideoProcessResult:
+        raise VimeoUploaderInternalServerError("Failed to upload")
+
+    # The error of the request is raised, rather than the error releasing the lease
+    with pytest.raises(VimeoUploaderInternalServerError):
+        coalescer.run('clip', fail)
+    lease_store.release.assert_called_once()
@@ -1,9 +1,75 @@
 import base64
+import hashlib
+import io
+import json
 import os
+import subprocess
+import sys
 from unittest import mock
 
-from core.driver import Driver
+import pytest
+from botocore.exceptions import ClientError
+
+from core.checkpoints import get_checkpoint_key, get_file_sha256
+from core.driver import Driver, get_download_tuning, get_streaming_platform, get_trim_mode
+from core.exceptions import VimeoUploaderInternalServerError, VimeoUploaderInvalidRequestError
 from core.generated import model_pb2
+from core.metadata_cache import CacheControl, LocalMetadataStore, MetadataCache
+from core.s3_transfer import MIN_PART_SIZE
+from core.scratch import ScratchSpace
+
+CLIP_OPTIONS = {'platform': 'YouTubePlatform', 'trim_mode': 'TRIM_MODE_COPY'}
+
+
+def download_video_to_file(download_result: model_pb2.DownloadResult):
+    """
+    Get a fake of download_video writing an empty output file, so the file can be uploaded
+    :param download_result: Result of the download
+    :return: Fake download_video
+    """
+    def download_video(
+            video_id, start_time_in_sec, end_time_in_sec, download_path, output_file_name, trim_mode,
+            progress_callback=None, metrics=None, target_profile=None, download_tuning=None):
+        os.makedirs(download_path, exist_ok=True)
+        open(os.path.join(download_path, output_file_name), 'w').close()
+        return download_result
+    return download_video
+
+
+def test_get_streaming_platform_lazy() -> None:
+    """
+    Test that importing the driver loads no platform SDK, and that each platform is created once on first use
+    :return: Nothing
+    """
+    script = (
+        "import sys; from core.driver import get_streaming_platform; "
+        "loaded = [m for m in ('boto3', 'yt_dlp', 'vimeo') if m in sys.modules]; "
+        "platform = get_streaming_platform('youtube'); "
+        "assert platform is get_streaming_platform('youtube'); "
+        "print(loaded, [m for m in ('boto3', 'yt_dlp', 'vimeo') if m in sys.modules])")
+    output = subprocess.run([sys.executable, '-c', script], check=True, capture_output=True, text=True).stdout
+    assert output.strip() == "[] ['yt_dlp']"
+    assert get_streaming_platform('unknown') is None
+
+
+def test_get_trim_mode() -> None:
+    assert get_trim_mode(None) == model_pb2.TRIM_MODE_COPY
+    assert get_trim_mode('smart') == model_pb2.TRIM_MODE_SMART
+    with pytest.raises(VimeoUploaderInvalidRequestError):
+        get_trim_mode('fast')
+
+
+def test_get_download_tuning() -> None:
+    assert get_download_tuning(None) is None
+    assert get_download_tuning({'concurrent_fragment_downloads': 8, 'external_downloader': 'aria2c'}) == \
+        model_pb2.DownloadTuning(concurrent_fragment_downloads=8, external_downloader='aria2c')
+    # Options beyond the limits of a request are lowered to them, or unset to keep the tuning of the deployment
+    assert get_download_tuning({'concurrent_fragment_downloads': 10_000, 'retries': -1}) == \
+        model_pb2.DownloadTuning(concurrent_fragment_downloads=16)
+    with pytest.raises(VimeoUploaderInvalidRequestError):
+        get_download_tuning({'external_downloader': '/tmp/downloader'})
+    with pytest.raises(VimeoUploaderInvalidRequestError):
+        get_download_tuning({'retries': 'many'})
 
 
 def test_get_video_metadata() -> None:
@@ -29,6 +95,40 @@ def test_get_video_metadata() -> None:
     assert video_metadata.publish_date == publish_date
 
 
+def test_get_videos_metadata() -> None:
+    download_platform = mock.MagicMock()
+    download_platform.get_videos_metadata.return_value = [
+        model_pb2.VideoMetadata(video_id="XsX3ATc3FbA", title="BTS MV"),
+        model_pb2.VideoMetadata(video_id="missing", error="Video unavailable")]
+    driver = Driver(download_platform=download_platform)
+    batch_video_metadata_result = driver.get_videos_metadata(["XsX3ATc3FbA", "missing"])
+    download_platform.get_videos_metadata.assert_called_with(["XsX3ATc3FbA", "missing"])
+    assert batch_video_metadata_result.video_metadata[0].title == "BTS MV"
+    assert batch_video_metadata_result.video_metadata[1].error == "Video unavailable"
+
+
+def test_get_videos_metadata_cached() -> None:
+    download_platform = mock.MagicMock()
+    download_platform.get_videos_metadata.return_value = [model_pb2.VideoMetadata(video_id="second", title="second")]
+    metadata_cache = MetadataCache(disk_path=None)
+    driver = Driver(download_platform=download_platform, metadata_cache=metadata_cache)
+    metadata_cache.put(driver._get_metadata_cache_key("first"), model_pb2.VideoMetadata(video_id="first"))
+
+    batch_video_metadata_result = driver.get_videos_metadata(["first", "second"])
+    # Only the video missing from the cache is looked up
+    download_platform.get_videos_metadata.assert_called_once_with(["second"])
+    assert [video_metadata.video_id for video_metadata in batch_video_metadata_result.video_metadata] == [
+        "first", "second"]
+
+    assert driver.get_video_metadata("second").title == "second"
+    download_platform.get_video_metadata.assert_not_called()
+    download_platform.get_video_metadata.return_value = model_pb2.VideoMetadata(video_id="second", title="renamed")
+    assert driver.get_video_metadata("second", CacheControl.BYPASS).title == "renamed"
+    assert driver.get_video_metadata("second").title == "second"
+    assert driver.get_video_metadata("second", CacheControl.INVALIDATE).title == "renamed"
+    assert driver.get_video_metadata("second").title == "renamed"
+
+
 def test_process_video() -> None:
     video_id = "XsX3ATc3FbA"
     start_time_in_sec = 60
@@ -40,11 +140,19 @@ def test_process_video() -> None:
     download_url = "https://s3.amazon.com/XsX3ATc3FbA"
     s3_video_bucket_name = "vimeo-uploader-videos"
     s3_thumbnail_bucket_name = "vimeo-uploader-thumbnails"
+    download_result = model_pb2.DownloadResult(
+        downloaded=True,
+        mode=model_pb2.DOWNLOAD_MODE_RANGE,
+        bytes_downloaded=1024,
+        bytes_avoided=4096)
     download_platform = mock.MagicMock()
-    download_platform.download_video.return_value = True
+    download_platform.get_clip_options.return_value = CLIP_OPTIONS
+    download_platform.download_video.side_effect = download_video_to_file(download_result)
+    download_platform.estimate_download_size.return_value = 1024
     upload_platform = mock.MagicMock()
     upload_platform.upload_video.return_value = upload_url
     s3_client = mock.MagicMock()
+    s3_client.get_object.return_value = {'Body': io.BytesIO(b"image")}
     s3_client.generate_presigned_url.return_value = download_url
     os.environ['S3_VIDEO_BUCKET_NAME'] = s3_video_bucket_name
     os.environ['S3_THUMBNAIL_BUCKET_NAME'] = s3_thumbnail_bucket_name
@@ -56,40 +164,485 @@ def test_process_video() -> None:
         image_identifier,
         title,
         download)
+    # Each request downloads into a directory of its own
+    download_path = download_platform.download_video.call_args.args[3]
+    assert download_path.startswith(f"/tmp/scratch/{video_id}_")
     download_platform.download_video.assert_called_with(
         video_id,
         start_time_in_sec,
         end_time_in_sec,
-        f"/tmp/{video_id}",
-        f"{video_id}_{start_time_in_sec}_{end_time_in_sec}.mkv")
-    s3_client.download_file.assert_called_with(
-        s3_thumbnail_bucket_name, image_identifier, os.path.join(
-            '/tmp', image_identifier))
+        download_path,
+        f"{video_id}_{start_time_in_sec}_{end_time_in_sec}.mkv",
+        model_pb2.TRIM_MODE_COPY,
+        progress_callback=None,
+        metrics=mock.ANY,
+        target_profile=upload_platform.get_target_profile.return_value,
+        download_tuning=None)
+    # The thumbnail goes from S3 to the upload platform in memory
+    s3_client.get_object.assert_called_with(Bucket=s3_thumbnail_bucket_name, Key=image_identifier)
+    s3_client.download_file.assert_not_called()
     upload_platform.upload_video.assert_called_with(
-        f"/tmp/{video_id}/{video_id}_{str(start_time_in_sec)}_{str(end_time_in_sec)}.mkv",
+        f"{download_path}/{video_id}_{start_time_in_sec}_{end_time_in_sec}.mkv",
         title,
-        os.path.join('/tmp', image_identifier))
+        b"image",
+        progress_callback=None,
+        checkpoint=None,
+        clip_key=get_checkpoint_key(video_id, start_time_in_sec, end_time_in_sec, CLIP_OPTIONS),
+        video_sha256=None)
+    assert video_process_result.download_url == download_url
+    assert video_process_result.upload_url == upload_url
+    assert video_process_result.download_result == download_result
+
+    # Concurrent requests for the same range never share a directory
+    s3_client.get_object.return_value = {'Body': io.BytesIO(b"image")}
+    driver.process_video(video_id, start_time_in_sec, end_time_in_sec, image_identifier, title, download)
+    assert download_platform.download_video.call_args.args[3] != download_path
+
+
+def test_process_video_concurrent() -> None:
+    video_id = "XsX3ATc3FbA"
+    image_identifier = "8961de50-6033-4d2f-9ecc-b1279d450906"
+    upload_url = "https://vimeo.com/XsX3ATc3FbA"
+    download_url = "https://s3.amazon.com/XsX3ATc3FbA"
+    download_platform = mock.MagicMock()
+    download_platform.get_clip_options.return_value = CLIP_OPTIONS
+    download_platform.download_video.side_effect = download_video_to_file(model_pb2.DownloadResult(downloaded=True))
+    download_platform.estimate_download_size.return_value = 1024
+    upload_platform = mock.MagicMock()
+    upload_platform.upload_video.return_value = upload_url
+    s3_client = mock.MagicMock()
+    s3_client.get_object.return_value = {'Body': io.BytesIO(b"image")}
+    s3_client.generate_presigned_url.return_value = download_url
+    os.environ['S3_VIDEO_BUCKET_NAME'] = "vimeo-uploader-videos"
+    os.environ['S3_THUMBNAIL_BUCKET_NAME'] = "vimeo-uploader-thumbnails"
+    driver = Driver(download_platform, upload_platform, s3_client, concurrent=True)
+    video_process_result = driver.process_video(
+        video_id, 60, 120, image_identifier, "BTS MV", True)
+    upload_platform.upload_video.assert_called_with(
+        f"{download_platform.download_video.call_args.args[3]}/{video_id}_60_120.mkv",
+        "BTS MV",
+        b"image",
+        progress_callback=None,
+        checkpoint=None,
+        clip_key=mock.ANY,
+        video_sha256=None)
+    assert video_process_result.download_url == download_url
+    assert video_process_result.upload_url == upload_url
+
+
+def test_process_video_concurrent_failure() -> None:
+    download_platform = mock.MagicMock()
+    download_platform.get_clip_options.return_value = CLIP_OPTIONS
+    download_platform.download_video.return_value = model_pb2.DownloadResult(downloaded=True)
+    download_platform.estimate_download_size.return_value = 1024
+    upload_platform = mock.MagicMock()
+    s3_client = mock.MagicMock()
+    s3_client.get_object.side_effect = ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+    os.environ['S3_THUMBNAIL_BUCKET_NAME'] = "vimeo-uploader-thumbnails"
+    driver = Driver(download_platform, upload_platform, s3_client, concurrent=True)
+    with pytest.raises(VimeoUploaderInternalServerError):
+        driver.process_video(
+            "XsX3ATc3FbA", 60, 120, "8961de50-6033-4d2f-9ecc-b1279d450906", "BTS MV", False)
+    upload_platform.upload_video.assert_not_called()
+
+
+def test_process_video_fan_out() -> None:
+    video_id = "XsX3ATc3FbA"
+    upload_url = "https://vimeo.com/XsX3ATc3FbA"
+    download_platform = mock.MagicMock()
+    download_platform.get_clip_options.return_value = CLIP_OPTIONS
+    download_platform.download_video.side_effect = download_video_to_file(model_pb2.DownloadResult(downloaded=True))
+    download_platform.estimate_download_size.return_value = 1024
+    vimeo_platform = mock.MagicMock()
+    vimeo_platform.upload_video.return_value = upload_url
+    other_platform = mock.MagicMock()
+    other_platform.upload_video.side_effect = Exception("Quota exceeded")
+    s3_client = mock.MagicMock()
+    s3_client.get_object.return_value = {'Body': io.BytesIO(b"image")}
+    s3_client.generate_presigned_url.return_value = "https://s3.amazon.com/XsX3ATc3FbA"
+    os.environ['S3_VIDEO_BUCKET_NAME'] = "vimeo-uploader-videos"
+    os.environ['S3_THUMBNAIL_BUCKET_NAME'] = "vimeo-uploader-thumbnails"
+    driver = Driver(download_platform, s3_client=s3_client, upload_platforms={
+        'vimeo': vimeo_platform, 'other': other_platform, 'unknown': None})
+    video_process_result = driver.process_video(
+        video_id, 60, 120, "8961de50-6033-4d2f-9ecc-b1279d450906", "BTS MV", True)
+    # The clip is downloaded once and uploaded to every platform
+    download_platform.download_video.assert_called_once()
+    for upload_platform in (vimeo_platform, other_platform):
+        upload_platform.upload_video.assert_called_once_with(
+            f"{download_platform.download_video.call_args.args[3]}/{video_id}_60_120.mkv",
+            "BTS MV",
+            b"image",
+            progress_callback=None,
+            checkpoint=None,
+            clip_key=mock.ANY,
+            video_sha256=None)
+    # The platforms have different profiles, so no profile is targeted
+    assert download_platform.download_video.call_args.kwargs['target_profile'] is None
+    upload_results = video_process_result.upload_results
+    assert upload_results['vimeo'] == model_pb2.UploadResult(uploaded=True, upload_url=upload_url)
+    assert not upload_results['other'].uploaded
+    assert "Quota exceeded" in upload_results['other'].error
+    assert upload_results['unknown'].error == "Platform unknown is not supported"
+    assert video_process_result.upload_url == upload_url
+    assert video_process_result.download_url == "https://s3.amazon.com/XsX3ATc3FbA"
+
+    vimeo_platform.upload_video.side_effect = Exception("Unavailable")
+    with pytest.raises(VimeoUploaderInternalServerError):
+        driver.process_video(video_id, 60, 120, "8961de50-6033-4d2f-9ecc-b1279d450906", "BTS MV", True)
+
+
+def test_process_video_cache_hit() -> None:
+    video_id = "XsX3ATc3FbA"
+    download_url = "https://s3.amazon.com/XsX3ATc3FbA"
+    upload_url = "https://vimeo.com/XsX3ATc3FbA"
+    clip_options = {'platform': 'YouTubePlatform', 'trim_mode': 'TRIM_MODE_COPY'}
+    download_platform = mock.MagicMock()
+    download_platform.get_clip_options.return_value = clip_options
+    upload_platform = mock.MagicMock()
+    upload_platform.upload_video.return_value = upload_url
+    s3_client = mock.MagicMock()
+    s3_client.head_object.return_value = {'ContentLength': 1024, 'Metadata': clip_options}
+    s3_client.download_file.side_effect = lambda bucket, key, path, **kwargs: open(path, 'w').close()
+    s3_client.generate_presigned_url.return_value = download_url
+    os.environ['S3_VIDEO_BUCKET_NAME'] = "vimeo-uploader-videos"
+    driver = Driver(download_platform, upload_platform, s3_client, cache_clips=True)
+    video_process_result = driver.process_video(video_id, 60, 120, None, "BTS MV", True)
+    object_key = s3_client.head_object.call_args.kwargs['Key']
+    download_platform.download_video.assert_not_called()
+    s3_client.upload_file.assert_not_called()
+    assert s3_client.download_file.call_args.args[:2] == ("vimeo-uploader-videos", object_key)
+    assert s3_client.download_file.call_args.args[2] == upload_platform.upload_video.call_args.args[0]
+    assert s3_client.download_file.call_args.args[2].endswith(f"/{video_id}_60_120.mkv")
+    # The size found by the lookup splits the download into parts
+    assert s3_client.download_file.call_args.kwargs['Config'].multipart_chunksize == MIN_PART_SIZE
     assert video_process_result.download_url == download_url
     assert video_process_result.upload_url == upload_url
+    assert video_process_result.download_result.mode == model_pb2.DOWNLOAD_MODE_CACHE
+
+
+def test_process_video_cache_miss() -> None:
+    video_id = "XsX3ATc3FbA"
+    clip_options = {'platform': 'YouTubePlatform', 'trim_mode': 'TRIM_MODE_COPY'}
+    download_platform = mock.MagicMock()
+    download_platform.get_clip_options.return_value = clip_options
+    download_platform.download_video.side_effect = download_video_to_file(model_pb2.DownloadResult(downloaded=True))
+    download_platform.estimate_download_size.return_value = 1024
+    s3_client = mock.MagicMock()
+    s3_client.head_object.return_value = {'ContentLength': 1024, 'Metadata': {}}
+    os.environ['S3_VIDEO_BUCKET_NAME'] = "vimeo-uploader-videos"
+    driver = Driver(download_platform, mock.MagicMock(), s3_client, allow_upload=False, cache_clips=True)
+    video_process_result = driver.process_video(video_id, 60, 120, None, "BTS MV", False)
+    object_key = s3_client.head_object.call_args.kwargs['Key']
+    download_platform.download_video.assert_called_once()
+    # The clip is stored for the next request, even without download requested
+    assert s3_client.upload_file.call_args.args == (
+        f"{download_platform.download_video.call_args.args[3]}/{video_id}_60_120.mkv", "vimeo-uploader-videos",
+        object_key)
+    assert s3_client.upload_file.call_args.kwargs['ExtraArgs'] == {'Metadata': clip_options}
+    assert video_process_result.download_url == ""
 
+    # Failing to store the clip does not fail a request which asked for no download
+    s3_client.upload_file.side_effect = FileNotFoundError("missing")
+    assert driver.process_video(video_id, 60, 120, None, "BTS MV", False).download_url == ""
+    with pytest.raises(VimeoUploaderInternalServerError):
+        driver.process_video(video_id, 60, 120, None, "BTS MV", True)
 
-def test_upload_file_to_s3(tmpdir) -> None:
+
+def test_process_video_progress() -> None:
+    video_id = "XsX3ATc3FbA"
+    download_result = model_pb2.DownloadResult(downloaded=True)
+
+    def download_video(*args, progress_callback=None, metrics=None, target_profile=None, download_tuning=None):
+        progress_callback(0.5)
+        return download_video_to_file(download_result)(*args)
+
+    def upload_video(*args, progress_callback=None, checkpoint=None, clip_key=None, video_sha256=None):
+        progress_callback(0.5)
+        return "https://vimeo.com/XsX3ATc3FbA"
+
+    download_platform = mock.MagicMock()
+    download_platform.get_clip_options.return_value = CLIP_OPTIONS
+    download_platform.download_video.side_effect = download_video
+    download_platform.estimate_download_size.return_value = 1024
+    upload_platform = mock.MagicMock()
+    upload_platform.upload_video.side_effect = upload_video
+    progress = mock.MagicMock()
+    progress.get_callback.side_effect = lambda stage: lambda fraction: progress.update(stage, fraction)
+    s3_client = mock.MagicMock()
+    s3_client.generate_presigned_url.return_value = "https://s3.amazon.com/XsX3ATc3FbA"
+    os.environ['S3_VIDEO_BUCKET_NAME'] = "vimeo-uploader-videos"
+    driver = Driver(download_platform, upload_platform, s3_client)
+    driver.process_video(video_id, 60, 120, None, "BTS MV", True, progress=progress)
+    # Each stage reports its progress through the platforms, and is complete once it returns
+    assert progress.update.call_args_list == [
+        mock.call('download', 0.5),
+        mock.call('download', 1.0),
+        mock.call('upload', 0.5),
+        mock.call('upload', 1.0),
+        mock.call('upload_to_s3', 1.0),
+    ]
+
+
+def test_process_video_metrics(capsys) -> None:
+    download_platform = mock.MagicMock()
+    download_platform.get_clip_options.return_value = CLIP_OPTIONS
+    download_platform.download_video.side_effect = download_video_to_file(
+        model_pb2.DownloadResult(downloaded=True, bytes_downloaded=1024))
+    download_platform.estimate_download_size.return_value = 1024
+    upload_platform = mock.MagicMock()
+    upload_platform.upload_video.return_value = "https://vimeo.com/XsX3ATc3FbA"
+    s3_client = mock.MagicMock()
+    s3_client.get_object.return_value = {'Body': io.BytesIO(b"image")}
+    s3_client.generate_presigned_url.return_value = "https://s3.amazon.com/XsX3ATc3FbA"
+    os.environ['S3_VIDEO_BUCKET_NAME'] = "vimeo-uploader-videos"
+    os.environ['S3_THUMBNAIL_BUCKET_NAME'] = "vimeo-uploader-thumbnails"
+    driver = Driver(download_platform, upload_platform, s3_client, emit_metrics=True, extended_result=True)
+    video_process_result = driver.process_video("XsX3ATc3FbA", 60, 120, "image", "BTS MV", True)
+
+    stage_metrics = {stage_metrics.stage: stage_metrics for stage_metrics in video_process_result.stage_metrics}
+    assert set(stage_metrics) == {'download', 'thumbnail', 'upload', 'upload_to_s3', 'total'}
+    assert stage_metrics['download'].bytes == 1024
+    assert stage_metrics['thumbnail'].bytes == len(b"image")
+    # The S3 transfer records its part size, and the bytes it moved
+    assert stage_metrics['upload_to_s3'].part_size_in_bytes >= MIN_PART_SIZE
+    assert not stage_metrics['upload'].part_size_in_bytes
+    # The platform records the steps of the download into the metrics of the request
+    assert download_platform.download_video.call_args.kwargs['metrics'] is not None
+    emitted = [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith('{')]
+    assert {line['Stage'] for line in emitted if 'Stage' in line} == set(stage_metrics)
+    assert [line['Stage'] for line in emitted if 'PartSize' in line] == ['upload_to_s3']
+    assert [line['Operation'] for line in emitted if 'ProcessPeakRSS' in line] == ['process_video']
+    assert {line['Operation'] for line in emitted} == {'process_video'}
+
+
+def test_process_video_upload_to_s3_failure() -> None:
+    download_platform = mock.MagicMock()
+    download_platform.get_clip_options.return_value = CLIP_OPTIONS
+    download_platform.download_video.side_effect = download_video_to_file(model_pb2.DownloadResult(downloaded=True))
+    download_platform.estimate_download_size.return_value = 1024
+    s3_client = mock.MagicMock()
+    s3_client.upload_file.side_effect = ClientError({'Error': {'Code': 'AccessDenied'}}, 'PutObject')
+    os.environ['S3_VIDEO_BUCKET_NAME'] = "vimeo-uploader-videos"
+    driver = Driver(download_platform, mock.MagicMock(), s3_client)
+
+    # An error of S3 is returned as an internal server error, rather than as the error of the client
+    with pytest.raises(VimeoUploaderInternalServerError, match="Failed to upload the file to s3"):
+        driver.process_video("XsX3ATc3FbA", 60, 120, None, "BTS MV", True)
+
+
+def test_process_video_checkpoint(tmpdir) -> None:
+    video_id = "XsX3ATc3FbA_checkpoint"
+    upload_url = "https://vimeo.com/XsX3ATc3FbA"
+    download_platform = mock.MagicMock()
+    download_platform.get_clip_options.return_value = CLIP_OPTIONS
+    download_platform.download_video.side_effect = download_video_to_file(model_pb2.DownloadResult(downloaded=True))
+    download_platform.estimate_download_size.return_value = 1024
+    upload_platform = mock.MagicMock()
+    upload_platform.upload_video.side_effect = [VimeoUploaderInternalServerError("Failed to upload"), upload_url]
+    s3_client = mock.MagicMock()
+    s3_client.generate_presigned_url.return_value = "https://s3.amazon.com/XsX3ATc3FbA"
+    os.environ['S3_VIDEO_BUCKET_NAME'] = "vimeo-uploader-videos"
+    driver = Driver(
+        download_platform, upload_platform, s3_client,
+        checkpoint_store=LocalMetadataStore(str(tmpdir.join('checkpoints'))),
+        scratch_space=ScratchSpace(str(tmpdir.join('scratch'))))
+    with pytest.raises(VimeoUploaderInternalServerError):
+        driver.process_video(video_id, 60, 120, None, "BTS MV", True)
+    # The retry resumes the upload, reusing the video kept in the scratch space instead of downloading it again
+    video_process_result = driver.process_video(video_id, 60, 120, None, "BTS MV", True)
+    assert video_process_result.upload_url == upload_url
+    download_platform.download_video.assert_called_once()
+    assert driver.scratch_space.stats['reuses'] == 1
+    assert upload_platform.upload_video.call_args.kwargs['checkpoint'] is not None
+    # The hash recorded by the download is passed on, so the platform does not hash the video again
+    assert upload_platform.upload_video.call_args.kwargs['video_sha256'] == get_file_sha256(
+        upload_platform.upload_video.call_args.args[0])
+    # The kept video is named by the clip, so a request for the same range with other options does not reuse it
+    clip_key = get_checkpoint_key(video_id, 60, 120, CLIP_OPTIONS)
+    assert upload_platform.upload_video.call_args.args[0] == str(
+        tmpdir.join('scratch', f"{video_id}_{clip_key[:16]}", f"{video_id}_60_120.mkv"))
+
+    # Once every stage is complete, the request returns the same result without processing again
+    video_process_result = driver.process_video(video_id, 60, 120, None, "BTS MV", True)
+    assert video_process_result.upload_url == upload_url
+    assert video_process_result.download_url == "https://s3.amazon.com/XsX3ATc3FbA"
+    assert upload_platform.upload_video.call_count == 2
+    s3_client.upload_file.assert_called_once()
+
+
+def test_process_video_coalesced() -> None:
+    download_platform = mock.MagicMock()
+    download_platform.get_clip_options.return_value = CLIP_OPTIONS
+    download_platform.download_video.side_effect = download_video_to_file(model_pb2.DownloadResult(downloaded=True))
+    download_platform.estimate_download_size.return_value = 1024
+    upload_platform = mock.MagicMock()
+    upload_platform.upload_video.return_value = "https://vimeo.com/XsX3ATc3FbA"
+    coalescer = mock.MagicMock()
+    coalescer.run.side_effect = lambda key, process: process()
+    os.environ['S3_VIDEO_BUCKET_NAME'] = "vimeo-uploader-videos"
+    driver = Driver(download_platform, upload_platform, mock.MagicMock(), coalescer=coalescer)
+    driver.process_video("XsX3ATc3FbA", 60, 120, None, "BTS MV", False)
+    driver.process_video(" XsX3ATc3FbA", 60.0, 120, "", "BTS MV", False)
+    driver.process_video("XsX3ATc3FbA", 60, 120, None, "Renamed", False)
+
+    # Identical requests share their key, once normalized
+    keys = [call.args[0] for call in coalescer.run.call_args_list]
+    assert keys[0] == keys[1]
+    assert keys[0] != keys[2]
+    assert upload_platform.upload_video.call_count == 3
+
+
+def test_process_video_stream() -> None:
+    video_id = "XsX3ATc3FbA"
+    download_url = "https://s3.amazon.com/XsX3ATc3FbA"
+    upload_url = "https://vimeo.com/XsX3ATc3FbA"
+    download_platform = mock.MagicMock()
+    download_platform.get_clip_options.return_value = CLIP_OPTIONS
+    download_platform.stream_video.return_value.__enter__.return_value = io.BytesIO(b"clip")
+    upload_platform = mock.MagicMock()
+    upload_platform.upload_video_from_url.return_value = upload_url
+    s3_client = mock.MagicMock()
+    s3_client.create_multipart_upload.return_value = {'UploadId': 'upload'}
+    s3_client.upload_part.return_value = {'ETag': 'etag'}
+    s3_client.generate_presigned_url.return_value = download_url
+    os.environ['S3_VIDEO_BUCKET_NAME'] = "vimeo-uploader-videos"
+    driver = Driver(download_platform, upload_platform, s3_client, stream=True)
+    video_process_result = driver.process_video(video_id, 60, 120, None, "BTS MV", True)
+
+    # The clip goes from the download platform to S3 without a local file, and the target platform fetches it
+    download_platform.stream_video.assert_called_once_with(
+        video_id, 60, 120, model_pb2.TRIM_MODE_COPY, upload_platform.get_target_profile.return_value)
+    download_platform.download_video.assert_not_called()
+    s3_client.upload_file.assert_not_called()
+    s3_client.complete_multipart_upload.assert_called_once()
+    upload_platform.upload_video.assert_not_called()
+    upload_platform.upload_video_from_url.assert_called_once_with(download_url, 4, "BTS MV", None)
+    assert video_process_result.download_url == download_url
+    assert video_process_result.upload_url == upload_url
+    assert video_process_result.download_result.mode == model_pb2.DOWNLOAD_MODE_STREAM
+    assert video_process_result.download_result.bytes_downloaded == 4
+
+
+def test_process_video_stream_failure() -> None:
+    download_platform = mock.MagicMock()
+    download_platform.get_clip_options.return_value = CLIP_OPTIONS
+    download_platform.stream_video.return_value.__enter__.side_effect = VimeoUploaderInternalServerError("ffmpeg")
+    upload_platform = mock.MagicMock()
+    os.environ['S3_VIDEO_BUCKET_NAME'] = "vimeo-uploader-videos"
+    driver = Driver(download_platform, upload_platform, mock.MagicMock(), stream=True)
+    with pytest.raises(VimeoUploaderInternalServerError):
+        driver.process_video("XsX3ATc3FbA", 60, 120, None, "BTS MV", True)
+    upload_platform.upload_video_from_url.assert_not_called()
+
+
+def test_process_video_stream_unsupported() -> None:
+    video_id = "XsX3ATc3FbA"
+    upload_url = "https://vimeo.com/XsX3ATc3FbA"
+    download_platform = mock.MagicMock()
+    download_platform.get_clip_options.return_value = CLIP_OPTIONS
+    download_platform.can_stream_video.return_value = False
+    download_platform.download_video.side_effect = download_video_to_file(model_pb2.DownloadResult(downloaded=True))
+    download_platform.estimate_download_size.return_value = 1024
+    upload_platform = mock.MagicMock()
+    upload_platform.upload_video.return_value = upload_url
+    s3_client = mock.MagicMock()
+    os.environ['S3_VIDEO_BUCKET_NAME'] = "vimeo-uploader-videos"
+    driver = Driver(download_platform, upload_platform, s3_client, stream=True)
+    video_process_result = driver.process_video(video_id, 60, 120, None, "BTS MV", False)
+
+    # A video which cannot be streamed is downloaded to disk and uploaded from there
+    download_platform.can_stream_video.assert_called_once_with(
+        video_id, model_pb2.TRIM_MODE_COPY, upload_platform.get_target_profile.return_value)
+    download_platform.stream_video.assert_not_called()
+    s3_client.create_multipart_upload.assert_not_called()
+    download_platform.download_video.assert_called_once()
+    upload_platform.upload_video_from_url.assert_not_called()
+    upload_platform.upload_video.assert_called_once()
+    assert video_process_result.upload_url == upload_url
+    assert video_process_result.download_result.mode != model_pb2.DOWNLOAD_MODE_STREAM
+
+
+def test_process_clips() -> None:
+    video_id = "XsX3ATc3FbA_batch"
+    image_identifier = "8961de50-6033-4d2f-9ecc-b1279d450906"
+    clips = [
+        model_pb2.Clip(start_time_in_sec=60, end_time_in_sec=120, title="Chorus", image_identifier=image_identifier),
+        model_pb2.Clip(start_time_in_sec=150, end_time_in_sec=180, title="Bridge", download=True),
+        model_pb2.Clip(start_time_in_sec=200, end_time_in_sec=230, title="Outro"),
+    ]
+    download_platform = mock.MagicMock()
+
+    def download_clips(
+            video_id, clips, download_path, output_file_names, trim_mode, metrics=None, target_profile=None,
+            download_tuning=None):
+        # The last clip fails to download
+        os.makedirs(download_path, exist_ok=True)
+        for output_file_name in output_file_names[:-1]:
+            open(os.path.join(download_path, output_file_name), 'w').close()
+        return model_pb2.DownloadResult(downloaded=True, mode=model_pb2.DOWNLOAD_MODE_RANGE)
+
+    download_platform.download_clips.side_effect = download_clips
+    download_platform.estimate_download_size.return_value = 1024
+    upload_platform = mock.MagicMock()
+    upload_platform.upload_video.side_effect = lambda video_path, title, image_data: f"https://vimeo.com/{title}"
+    s3_client = mock.MagicMock()
+    s3_client.generate_presigned_url.return_value = "https://s3.amazon.com/XsX3ATc3FbA"
+    os.environ['S3_VIDEO_BUCKET_NAME'] = "vimeo-uploader-videos"
+    os.environ['S3_THUMBNAIL_BUCKET_NAME'] = "vimeo-uploader-thumbnails"
+    driver = Driver(download_platform, upload_platform, s3_client)
+    batch_result = driver.process_clips(video_id, clips)
+
+    download_path = download_platform.download_clips.call_args.args[2]
+    assert download_path.startswith(f"/tmp/scratch/{video_id}_clips_")
+    download_platform.download_clips.assert_called_once_with(
+        video_id,
+        [(60, 120), (150, 180), (200, 230)],
+        download_path,
+        [f"{video_id}_60_120.mkv", f"{video_id}_150_180.mkv", f"{video_id}_200_230.mkv"],
+        model_pb2.TRIM_MODE_COPY,
+        metrics=mock.ANY,
+        target_profile=upload_platform.get_target_profile.return_value,
+        download_tuning=None)
+    s3_client.upload_file.assert_called_once()
+    assert s3_client.upload_file.call_args.args == (
+        f"{download_path}/{video_id}_150_180.mkv", "vimeo-uploader-videos", f"{video_id}_150_180")
+    # The clips are deleted once processed
+    assert not os.path.exists(download_path)
+    assert batch_result.video_id == video_id
+    assert [clip_result.processed for clip_result in batch_result.clip_results] == [True, True, False]
+    assert batch_result.clip_results[0].upload_url == "https://vimeo.com/Chorus"
+    assert batch_result.clip_results[0].download_url == ""
+    assert batch_result.clip_results[1].download_url == "https://s3.amazon.com/XsX3ATc3FbA"
+    assert batch_result.clip_results[2].clip == clips[2]
+    assert batch_result.clip_results[2].error
+
+
+def test_upload_thumbnail_image_to_s3() -> None:
     download_url = "https://s3.amazon.com/thumbnail.png"
     s3_bucket_name = "vimeo-uploader-thumbnails"
-    object_key = "8961de50-6033-4d2f-9ecc-b1279d450906"
     object_path = os.path.join('tests', 'resources', 'thumbnail.jpg')
     with open(object_path, 'rb') as file:
-        object_content = base64.b64encode(file.read()).decode('utf-8')
+        object_data = file.read()
+    object_key = hashlib.sha256(object_data).hexdigest()
     s3_client = mock.MagicMock()
+    s3_client.head_object.side_effect = ClientError({'Error': {'Code': '404'}}, 'HeadObject')
     s3_client.generate_presigned_url.return_value = download_url
     os.environ['S3_THUMBNAIL_BUCKET_NAME'] = s3_bucket_name
     driver = Driver(None, None, s3_client)
-    thumbnail_upload_result = driver.upload_thumbnail_image_to_s3(
-        tmpdir, object_key, object_content)
-    s3_client.upload_file.assert_called_with(
-        os.path.join(tmpdir, object_key),
-        s3_bucket_name,
-        object_key
-    )
+    thumbnail_upload_result = driver.upload_thumbnail_image_to_s3(base64.b64encode(object_data).decode('utf-8'))
+    s3_client.put_object.assert_called_once_with(Bucket=s3_bucket_name, Key=object_key, Body=object_data)
+    s3_client.upload_file.assert_not_called()
     assert thumbnail_upload_result.object_key == object_key
     assert thumbnail_upload_result.s3_url == download_url
+
+
+def test_upload_thumbnail_image_to_s3_duplicate() -> None:
+    s3_client = mock.MagicMock()
+    s3_client.generate_presigned_url.return_value = "https://s3.amazon.com/thumbnail.png"
+    os.environ['S3_THUMBNAIL_BUCKET_NAME'] = "vimeo-uploader-thumbnails"
+    driver = Driver(None, None, s3_client)
+    thumbnail_upload_result = driver.upload_thumbnail_image_to_s3(base64.b64encode(b"image").decode('utf-8'))
+    # The same image is already on S3 under the hash of its content
+    s3_client.put_object.assert_not_called()
+    assert thumbnail_upload_result.object_key == hashlib.sha256(b"image").hexdigest()
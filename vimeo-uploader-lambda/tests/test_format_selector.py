@@ -0,0 +1,59 @@
+from core.format_selector import FormatSelector, get_codec_name
+from core.generated import model_pb2
+
+FORMATS = [
+    {'format_id': 'sb0', 'ext': 'mhtml', 'vcodec': 'none', 'acodec': 'none'},
+    {'format_id': '18', 'ext': 'mp4', 'vcodec': 'avc1.42001E', 'acodec': 'mp4a.40.2', 'height': 360, 'tbr': 500},
+    {'format_id': '139', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.5', 'abr': 48, 'filesize': 2_000_000},
+    {'format_id': '140', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'abr': 128, 'filesize': 6_000_000},
+    {'format_id': '251', 'ext': 'webm', 'vcodec': 'none', 'acodec': 'opus', 'abr': 130, 'filesize': 5_000_000},
+    {'format_id': '136', 'ext': 'mp4', 'vcodec': 'avc1.4d401f', 'acodec': 'none', 'height': 720,
+     'filesize': 90_000_000},
+    {'format_id': '247', 'ext': 'webm', 'vcodec': 'vp9', 'acodec': 'none', 'height': 720, 'filesize': 60_000_000},
+    {'format_id': '137', 'ext': 'mp4', 'vcodec': 'avc1.640028', 'acodec': 'none', 'height': 1080,
+     'filesize': 180_000_000},
+    {'format_id': '313', 'ext': 'webm', 'vcodec': 'vp9', 'acodec': 'none', 'height': 2160, 'filesize': 900_000_000},
+]
+
+
+def test_get_codec_name() -> None:
+    """
+    Test naming the codecs reported by yt-dlp
+    :return: Nothing
+    """
+    assert get_codec_name('avc1.640028') == 'h264'
+    assert get_codec_name('vp09.00.40.08') == 'vp9'
+    assert get_codec_name('mp4a.40.2') == 'aac'
+    assert get_codec_name('none') is None
+    assert get_codec_name('theora') == 'theora'
+
+
+def test_select_formats_for_target_profile() -> None:
+    """
+    Test selecting the cheapest formats of the best resolution within the target, preferring formats which can be
+    stream copied into the target container
+    :return: Nothing
+    """
+    # The 4K video is above the target, and the 720p VP9 video and Opus audio do not go into mp4
+    selected = FormatSelector(model_pb2.TargetProfile(max_height=720, container='mp4')).select(FORMATS, 600)
+    assert selected.format_id == '136+140'
+    assert selected.height == 720
+    assert selected.size == 96_000_000
+
+    # Without a container, the cheapest formats of the resolution are selected
+    selected = FormatSelector(model_pb2.TargetProfile(max_height=1080)).select(FORMATS, 600)
+    assert selected.format_id == '137+251'
+
+    # Over the budget, the resolution goes down, down to the single format with video and audio
+    selected = FormatSelector(model_pb2.TargetProfile(max_bytes=100_000_000, container='mp4')).select(FORMATS, 600)
+    assert selected.format_id == '136+140'
+    selected = FormatSelector(model_pb2.TargetProfile(max_bytes=50_000_000)).select(FORMATS, 600)
+    assert selected.format_id == '18'
+    assert selected.muxed
+    assert selected.size == 37_500_000
+
+    # Preferences which no format meets are relaxed
+    selected = FormatSelector(model_pb2.TargetProfile(max_height=144, video_codecs=['av1'])).select(FORMATS, 600)
+    assert selected.format_id == '18'
+
+    assert FormatSelector(model_pb2.TargetProfile(max_height=720)).select(FORMATS[:1]) is None
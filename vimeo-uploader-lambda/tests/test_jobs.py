@@ -0,0 +1,118 @@
+import io
+import json
+from unittest import mock
+
+import pytest
+from botocore.exceptions import ClientError
+
+from core import jobs
+from core.exceptions import VimeoUploaderInternalServerError
+from core.generated import model_pb2
+from core.jobs import JOB_TIMEOUT_IN_SEC, JobProgress, S3JobStore, SQLiteJobStore, create_job, run_job
+
+
+def test_sqlite_job_store(tmpdir) -> None:
+    job_store = SQLiteJobStore(str(tmpdir.join('jobs.sqlite')))
+    job_state = create_job(job_store, {'video_id': "XsX3ATc3FbA"})
+
+    assert job_store.get(job_state.job_id) == job_state
+    assert job_state.status == model_pb2.JOB_STATUS_PENDING
+    assert json.loads(job_state.request) == {'video_id': "XsX3ATc3FbA"}
+    assert job_store.get("missing") is None
+
+
+def test_job_progress() -> None:
+    job_store = mock.MagicMock()
+    job_state = model_pb2.JobState(job_id="job")
+    progress = JobProgress(job_store, job_state, interval_in_sec=60)
+    progress.get_callback('download')(0.5)
+    # Saves closer together than the interval are skipped, unless the stage completes
+    progress.update('download', 0.8)
+    assert job_store.put.call_count == 1
+    progress.update('download', 1.0)
+    progress.update('upload', 0.5)
+
+    assert job_store.put.call_count == 2
+    assert job_state.stage == 'upload'
+    assert job_state.percent_complete == 70
+
+
+def test_run_job(tmpdir) -> None:
+    job_store = SQLiteJobStore(str(tmpdir.join('jobs.sqlite')))
+    job_state = create_job(job_store, {})
+
+    def run(progress: JobProgress) -> model_pb2.VideoProcessResult:
+        assert job_store.get(job_state.job_id).status == model_pb2.JOB_STATUS_RUNNING
+        progress.update('download', 1.0)
+        assert job_store.get(job_state.job_id).percent_complete == 50
+        return model_pb2.VideoProcessResult(upload_url="https://vimeo.com/XsX3ATc3FbA")
+
+    run_job(job_store, job_state, run)
+    job_state = job_store.get(job_state.job_id)
+
+    assert job_state.status == model_pb2.JOB_STATUS_SUCCEEDED
+    assert job_state.percent_complete == 100
+    assert job_state.result.upload_url == "https://vimeo.com/XsX3ATc3FbA"
+
+
+def test_run_job_failure(tmpdir) -> None:
+    job_store = SQLiteJobStore(str(tmpdir.join('jobs.sqlite')))
+    job_state = create_job(job_store, {})
+
+    def run(progress: JobProgress) -> model_pb2.VideoProcessResult:
+        raise ValueError("Failed to download the video")
+
+    run_job(job_store, job_state, run)
+    job_state = job_store.get(job_state.job_id)
+
+    assert job_state.status == model_pb2.JOB_STATUS_FAILED
+    assert job_state.error == "Failed to download the video"
+
+
+def test_run_job_not_pending(tmpdir) -> None:
+    job_store = SQLiteJobStore(str(tmpdir.join('jobs.sqlite')))
+    job_state = create_job(job_store, {})
+    run = mock.MagicMock(return_value=model_pb2.VideoProcessResult())
+    run_job(job_store, job_store.get(job_state.job_id), run)
+    # A stale copy of the pending job is not started again
+    run_job(job_store, job_state, run)
+    run.assert_called_once()
+
+    # A job left running past the timeout of an invocation was killed, so it is failed instead of run
+    job_state = create_job(job_store, {})
+    job_state.status = model_pb2.JOB_STATUS_RUNNING
+    job_state.updated_at -= JOB_TIMEOUT_IN_SEC
+    job_store.put(job_state)
+    run_job(job_store, job_store.get(job_state.job_id), run)
+    run.assert_called_once()
+    assert job_store.get(job_state.job_id).status == model_pb2.JOB_STATUS_FAILED
+
+
+def test_s3_job_store_put_if_unchanged() -> None:
+    job_state = model_pb2.JobState(job_id="job", status=model_pb2.JOB_STATUS_RUNNING)
+    previous = model_pb2.JobState(job_id="job")
+    s3_client = mock.MagicMock()
+    s3_client.get_object.return_value = {'Body': io.BytesIO(previous.SerializeToString()), 'ETag': '"etag"'}
+    job_store = S3JobStore(s3_client, "jobs")
+    assert job_store.put_if_unchanged(job_state, previous)
+    assert s3_client.put_object.call_args.kwargs['IfMatch'] == '"etag"'
+
+    # Written by someone else between the read and the write
+    s3_client.get_object.return_value = {'Body': io.BytesIO(previous.SerializeToString()), 'ETag': '"etag"'}
+    s3_client.put_object.side_effect = ClientError({'Error': {'Code': 'PreconditionFailed'}}, 'PutObject')
+    assert not job_store.put_if_unchanged(job_state, previous)
+
+    s3_client.get_object.return_value = {'Body': io.BytesIO(job_state.SerializeToString()), 'ETag': '"other"'}
+    assert not job_store.put_if_unchanged(job_state, previous)
+
+
+def test_get_job_store_on_lambda(monkeypatch) -> None:
+    """
+    Test failing fast on Lambda without a job store bucket, as a local job store is not shared between the functions
+    :return: Nothing
+    """
+    monkeypatch.setenv('AWS_LAMBDA_FUNCTION_NAME', 'submit-video-job')
+    monkeypatch.delenv('JOB_STORE_BUCKET_NAME', raising=False)
+    monkeypatch.setattr(jobs, '_job_store', None)
+    with pytest.raises(VimeoUploaderInternalServerError):
+        jobs.get_job_store()
@@ -0,0 +1,80 @@
+import os
+from unittest import mock
+
+import pytest
+
+from core.exceptions import VimeoUploaderInvalidRequestError
+from core.generated import model_pb2
+from core.metadata_cache import CacheControl, LocalMetadataStore, MetadataCache, get_cache_control
+
+VIDEO_METADATA = model_pb2.VideoMetadata(
+    video_id="XsX3ATc3FbA",
+    title="BTS MV",
+    author="HYBE LABELS",
+    length_in_sec=253,
+    publish_date="2019-04-12")
+
+
+def test_memory_lru_eviction() -> None:
+    metadata_cache = MetadataCache(max_entries=2, disk_path=None)
+    metadata_cache.put('first', VIDEO_METADATA)
+    metadata_cache.put('second', VIDEO_METADATA)
+    # Using the first entry makes the second the least recently used
+    assert metadata_cache.get('first') == VIDEO_METADATA
+    metadata_cache.put('third', VIDEO_METADATA)
+
+    assert metadata_cache.get('second') is None
+    assert metadata_cache.get('first') == VIDEO_METADATA
+    assert metadata_cache.stats['evictions'] == 1
+    assert metadata_cache.stats['memory_hits'] == 2
+    assert metadata_cache.stats['misses'] == 1
+
+
+def test_expiration(tmpdir) -> None:
+    metadata_cache = MetadataCache(ttl_in_sec=60, disk_path=str(tmpdir))
+    with mock.patch('core.metadata_cache.time.time', return_value=1000):
+        metadata_cache.put('key', VIDEO_METADATA)
+        assert metadata_cache.get('key') == VIDEO_METADATA
+    with mock.patch('core.metadata_cache.time.time', return_value=1060):
+        assert metadata_cache.get('key') is None
+
+    assert metadata_cache.stats['expirations'] == 2
+    assert not os.listdir(tmpdir)
+
+
+def test_disk_tier(tmpdir) -> None:
+    """
+    Test that the on-disk tier serves a new cache, as after the process restarts in a warm container
+    :return: Nothing
+    """
+    MetadataCache(disk_path=str(tmpdir)).put('key', VIDEO_METADATA)
+
+    metadata_cache = MetadataCache(disk_path=str(tmpdir))
+    assert metadata_cache.get('key') == VIDEO_METADATA
+    assert metadata_cache.get('key') == VIDEO_METADATA
+    assert metadata_cache.stats['disk_hits'] == 1
+    assert metadata_cache.stats['memory_hits'] == 1
+
+
+def test_shared_tier(tmpdir) -> None:
+    """
+    Test that the shared tier serves a cache on another container, and fills the tiers above
+    :return: Nothing
+    """
+    shared_store = LocalMetadataStore(os.path.join(tmpdir, 'store'))
+    MetadataCache(disk_path=os.path.join(tmpdir, 'first'), shared_store=shared_store).put('key', VIDEO_METADATA)
+
+    metadata_cache = MetadataCache(disk_path=os.path.join(tmpdir, 'second'), shared_store=shared_store)
+    assert metadata_cache.get('key') == VIDEO_METADATA
+    assert metadata_cache.stats['shared_hits'] == 1
+    assert os.listdir(os.path.join(tmpdir, 'second'))
+
+    metadata_cache.invalidate('key')
+    assert MetadataCache(disk_path=os.path.join(tmpdir, 'third'), shared_store=shared_store).get('key') is None
+
+
+def test_get_cache_control() -> None:
+    assert get_cache_control(None) == CacheControl.DEFAULT
+    assert get_cache_control('Bypass') == CacheControl.BYPASS
+    with pytest.raises(VimeoUploaderInvalidRequestError):
+        get_cache_control('refresh')
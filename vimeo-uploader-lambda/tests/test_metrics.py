@@ -0,0 +1,54 @@
+import json
+from unittest import mock
+
+from core.metrics import Metrics
+
+
+@mock.patch('core.metrics.time.perf_counter', side_effect=[0.0, 2.0, 10.0, 12.0])
+def test_metrics(_) -> None:
+    metrics = Metrics()
+    # A stage recorded twice, such as the upload of two clips, adds up
+    for size in [1024, 3072]:
+        with metrics.stage('upload'):
+            pass
+        metrics.add_bytes('upload', size)
+    metrics.record('trim', 0.5)
+
+    upload_metrics, trim_metrics = metrics.get_stage_metrics()
+    assert upload_metrics.stage == 'upload'
+    assert upload_metrics.duration_in_sec == 4.0
+    assert upload_metrics.bytes == 4096
+    assert upload_metrics.throughput_in_bytes_per_sec == 1024.0
+    assert trim_metrics.stage == 'trim'
+    assert trim_metrics.throughput_in_bytes_per_sec == 0
+
+
+def test_metrics_record_transfer() -> None:
+    metrics = Metrics()
+    metrics.record('restore', 2.0)
+    metrics.record_transfer('restore', {'size_in_bytes': 4096, 'part_size_in_bytes': 8 * 1024 * 1024})
+
+    restore_metrics, = metrics.get_stage_metrics()
+    assert restore_metrics.bytes == 4096
+    assert restore_metrics.throughput_in_bytes_per_sec == 2048.0
+    assert restore_metrics.part_size_in_bytes == 8 * 1024 * 1024
+
+
+def test_metrics_emit(capsys) -> None:
+    metrics = Metrics()
+    metrics.record('download', 2.0, 4096)
+    metrics.emit('process_video')
+
+    # Each stage is written as a single line in the CloudWatch Embedded Metric Format, then the peak memory of the
+    # process for the invocation
+    line, process_line = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert line['_aws']['CloudWatchMetrics'][0]['Dimensions'] == [['Operation', 'Stage']]
+    assert {metric['Name'] for metric in line['_aws']['CloudWatchMetrics'][0]['Metrics']} == {
+        'Duration', 'Bytes', 'Throughput'}
+    assert line['Operation'] == 'process_video'
+    assert line['Stage'] == 'download'
+    assert line['Duration'] == 2.0
+    assert line['Throughput'] == 2048.0
+    assert process_line['_aws']['CloudWatchMetrics'][0]['Dimensions'] == [['Operation']]
+    assert process_line['Operation'] == 'process_video'
+    assert process_line['ProcessPeakRSS'] > 0
@@ -0,0 +1,80 @@
+import threading
+import time
+
+import pytest
+
+from core.exceptions import VimeoUploaderInternalServerError
+from core.pipeline import Stage, run_stages
+
+
+def test_run_stages_sequential() -> None:
+    """
+    Test running the stages one after another, passing the results of completed stages
+    :return: Nothing
+    """
+    order = []
+
+    def stage(name, value):
+        def func(results):
+            order.append(name)
+            return value(results)
+        return func
+
+    results = run_stages([
+        Stage('a', stage('a', lambda _: 1)),
+        Stage('b', stage('b', lambda _: 2)),
+        Stage('c', stage('c', lambda results: results['a'] + results['b']), ['a', 'b']),
+    ])
+
+    assert order == ['a', 'b', 'c']
+    assert results == {'a': 1, 'b': 2, 'c': 3}
+
+
+def test_run_stages_concurrent() -> None:
+    """
+    Test running independent stages in parallel, with dependent stages waiting for their dependencies
+    :return: Nothing
+    """
+    barrier = threading.Barrier(2, timeout=5)
+
+    def independent(_):
+        # Only passes if both independent stages run at the same time
+        barrier.wait()
+        return True
+
+    results = run_stages([
+        Stage('a', independent),
+        Stage('b', independent),
+        Stage('c', lambda results: results['a'] and results['b'], ['a', 'b']),
+    ], concurrent=True)
+
+    assert results == {'a': True, 'b': True, 'c': True}
+
+
+def test_run_stages_concurrent_failure() -> None:
+    """
+    Test surfacing the first failure as internal server error once the running stages return, skipping the stages
+    which depend on it
+    :return: Nothing
+    """
+    ran = []
+    started = threading.Event()
+
+    def fail(_):
+        started.wait()
+        raise FileNotFoundError("missing")
+
+    def slow(_):
+        started.set()
+        time.sleep(0.1)
+        ran.append('slow')
+
+    with pytest.raises(VimeoUploaderInternalServerError):
+        run_stages([
+            Stage('fail', fail),
+            Stage('slow', slow),
+            Stage('dependent', lambda _: ran.append('dependent'), ['fail', 'slow']),
+        ], concurrent=True)
+
+    # The running stage has returned by the time the failure is raised
+    assert ran == ['slow']
@@ -0,0 +1,185 @@
+import io
+import os
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from core.checkpoints import Checkpointer
+from core.exceptions import VimeoUploaderInternalServerError
+from core.metadata_cache import LocalMetadataStore
+from core.s3_transfer import MAX_PART_SIZE, MAX_PARTS, MIB, MIN_PART_SIZE, S3Transfer, get_transfer_config
+
+
+def test_get_transfer_config_small_file() -> None:
+    """
+    Test that a small file is sent in a single request
+    :return: Nothing
+    """
+    config = get_transfer_config(2 * MIB, cpu_count=2, memory_in_mb=0)
+    assert config.multipart_threshold == MIN_PART_SIZE
+    assert config.max_concurrency == 1
+
+
+def test_get_transfer_config_large_file() -> None:
+    """
+    Test that a large file is split into parts for every thread, with more threads on more vCPUs
+    :return: Nothing
+    """
+    config = get_transfer_config(1024 * MIB, cpu_count=2, memory_in_mb=0)
+    assert config.multipart_chunksize == 64 * MIB
+    assert config.max_concurrency == 16
+    assert get_transfer_config(1024 * MIB, cpu_count=4, memory_in_mb=0).multipart_chunksize == 32 * MIB
+
+    config = get_transfer_config(100 * 1024 * MIB, cpu_count=6, memory_in_mb=0)
+    assert config.multipart_chunksize == MAX_PART_SIZE
+    assert config.max_concurrency == 32
+
+
+def test_get_transfer_config_limits() -> None:
+    """
+    Test that the parts in flight fit in the memory, and that no upload has more parts than S3 allows
+    :return: Nothing
+    """
+    config = get_transfer_config(1024 * MIB, cpu_count=2, memory_in_mb=1024)
+    assert config.max_concurrency == 4
+
+    size = 2 * 1024 * 1024 * MIB
+    config = get_transfer_config(size, cpu_count=1, memory_in_mb=0)
+    assert config.multipart_chunksize * MAX_PARTS >= size
+
+
+def test_upload_file(tmpdir) -> None:
+    """
+    Test uploading a file with the config for its size, and measuring its throughput
+    :return: Nothing
+    """
+    file_path = tmpdir.join('clip.mkv')
+    file_path.write_binary(b'0' * 1024)
+    s3_client = mock.MagicMock()
+    s3_client.upload_file.side_effect = lambda *args, Callback, **kwargs: Callback(1024)
+
+    metrics = S3Transfer(s3_client, cpu_count=1, memory_in_mb=0).upload_file(
+        str(file_path), 'bucket', 'clip', {'Metadata': {'trim_mode': 'copy'}})
+
+    assert s3_client.upload_file.call_args.args == (str(file_path), 'bucket', 'clip')
+    assert s3_client.upload_file.call_args.kwargs['ExtraArgs'] == {'Metadata': {'trim_mode': 'copy'}}
+    assert s3_client.upload_file.call_args.kwargs['Config'].max_concurrency == 1
+    assert metrics['operation'] == 'upload'
+    assert metrics['size_in_bytes'] == 1024
+    assert metrics['part_size_in_bytes'] == MIN_PART_SIZE
+    assert metrics['throughput_in_mib_per_sec'] >= 0
+
+
+def test_download_file() -> None:
+    """
+    Test downloading an object of known size in parts
+    :return: Nothing
+    """
+    s3_client = mock.MagicMock()
+
+    metrics = S3Transfer(s3_client, cpu_count=1, memory_in_mb=0).download_file(
+        'bucket', 'clip', '/tmp/clip.mkv', 256 * MIB)
+
+    assert s3_client.download_file.call_args.args == ('bucket', 'clip', '/tmp/clip.mkv')
+    assert s3_client.download_file.call_args.kwargs['Config'].multipart_chunksize == 32 * MIB
+    assert metrics['concurrency'] == 8
+
+
+def test_upload_stream() -> None:
+    """
+    Test uploading a stream of unknown size in parts, with no more parts in flight than buffers in the ring
+    :return: Nothing
+    """
+    data = os.urandom(5 * MIB + 100)
+    in_flight = []
+    max_in_flight = []
+    lock = threading.Lock()
+
+    def upload_part(PartNumber, Body, **kwargs):
+        with lock:
+            in_flight.append(PartNumber)
+            max_in_flight.append(len(in_flight))
+        time.sleep(0.01)
+        uploaded[PartNumber] = bytes(Body)
+        with lock:
+            in_flight.remove(PartNumber)
+        return {'ETag': f"etag-{PartNumber}"}
+
+    uploaded = {}
+    s3_client = mock.MagicMock()
+    s3_client.create_multipart_upload.return_value = {'UploadId': 'upload'}
+    s3_client.upload_part.side_effect = upload_part
+
+    metrics = S3Transfer(s3_client).upload_stream(
+        io.BytesIO(data), 'bucket', 'clip', {'Metadata': {'trim_mode': 'copy'}}, part_size=MIB, buffer_count=2)
+
+    s3_client.create_multipart_upload.assert_called_once_with(
+        Bucket='bucket', Key='clip', Metadata={'trim_mode': 'copy'})
+    s3_client.complete_multipart_upload.assert_called_once_with(
+        Bucket='bucket', Key='clip', UploadId='upload', MultipartUpload={'Parts': [
+            {'PartNumber': part_number, 'ETag': f"etag-{part_number}"} for part_number in range(1, 7)]})
+    s3_client.abort_multipart_upload.assert_not_called()
+    assert b''.join(uploaded[part_number] for part_number in range(1, 7)) == data
+    assert max(max_in_flight) <= 2
+    assert metrics['size_in_bytes'] == len(data)
+
+
+def test_upload_stream_failure() -> None:
+    """
+    Test aborting the multipart upload when the stream fails
+    :return: Nothing
+    """
+    stream = mock.MagicMock()
+    stream.readinto.side_effect = [MIB, VimeoUploaderInternalServerError("ffmpeg failed")]
+    s3_client = mock.MagicMock()
+    s3_client.create_multipart_upload.return_value = {'UploadId': 'upload'}
+
+    with pytest.raises(VimeoUploaderInternalServerError):
+        S3Transfer(s3_client).upload_stream(stream, 'bucket', 'clip', part_size=MIB)
+
+    s3_client.complete_multipart_upload.assert_not_called()
+    s3_client.abort_multipart_upload.assert_called_once_with(Bucket='bucket', Key='clip', UploadId='upload')
+
+
+def test_upload_file_resume(tmpdir) -> None:
+    """
+    Test resuming a failed multipart upload from its checkpoint, uploading only the parts S3 does not have
+    :return: Nothing
+    """
+    file_path = str(tmpdir.join('clip.mkv'))
+    with open(file_path, 'wb') as file:
+        file.write(os.urandom(20 * MIB))
+    checkpointer = Checkpointer(LocalMetadataStore(str(tmpdir.join('checkpoints'))), 'clip')
+    s3_client = mock.MagicMock()
+    s3_client.create_multipart_upload.return_value = {'UploadId': 'upload'}
+    uploaded = {}
+
+    def upload_part(PartNumber, Body, **kwargs):
+        if PartNumber == 2 and not uploaded.get('failed'):
+            uploaded['failed'] = True
+            raise ConnectionError("Connection reset")
+        uploaded[PartNumber] = len(Body)
+        return {'ETag': f"etag{PartNumber}"}
+
+    s3_client.upload_part.side_effect = upload_part
+    s3_transfer = S3Transfer(s3_client, cpu_count=1, memory_in_mb=0)
+    with pytest.raises(ConnectionError):
+        s3_transfer.upload_file(file_path, 'bucket', 'clip', checkpoint=checkpointer.stage('upload_to_s3'))
+    s3_client.abort_multipart_upload.assert_not_called()
+    assert checkpointer.get('upload_to_s3').upload_id == 'upload'
+
+    s3_client.list_parts.return_value = {'Parts': [
+        {'PartNumber': 1, 'Size': 8 * MIB, 'ETag': 'etag1'},
+        {'PartNumber': 3, 'Size': 4 * MIB, 'ETag': 'etag3'},
+    ]}
+    s3_client.upload_part.reset_mock()
+    metrics = s3_transfer.upload_file(file_path, 'bucket', 'clip', checkpoint=checkpointer.stage('upload_to_s3'))
+
+    s3_client.create_multipart_upload.assert_called_once()
+    assert [call.kwargs['PartNumber'] for call in s3_client.upload_part.call_args_list] == [2]
+    assert s3_client.complete_multipart_upload.call_args.kwargs['MultipartUpload'] == {'Parts': [
+        {'PartNumber': 1, 'ETag': 'etag1'}, {'PartNumber': 2, 'ETag': 'etag2'}, {'PartNumber': 3, 'ETag': 'etag3'}]}
+    assert metrics['size_in_bytes'] == 20 * MIB
+    assert checkpointer.get('upload_to_s3').upload_id == ''
@@ -0,0 +1,72 @@
+import os
+
+import pytest
+
+from core.exceptions import VimeoUploaderInternalServerError
+from core.scratch import ScratchSpace
+
+MIB = 1024 * 1024
+
+
+def write_file(path: str, size: int) -> None:
+    with open(path, 'wb') as file:
+        file.write(b'\0' * size)
+
+
+def test_scratch_space_temporary(tmpdir) -> None:
+    scratch_space = ScratchSpace(str(tmpdir), reserved_bytes=0)
+    with scratch_space.allocate('clip', MIB) as path:
+        write_file(os.path.join(path, 'clip.mkv'), MIB)
+        # The directory is kept while another request uses it
+        with scratch_space.allocate('clip'):
+            pass
+        assert os.path.exists(os.path.join(path, 'clip.mkv'))
+    assert not os.path.exists(path)
+    assert scratch_space.stats['allocations'] == 2
+
+
+def test_scratch_space_eviction(tmpdir) -> None:
+    scratch_space = ScratchSpace(str(tmpdir), reserved_bytes=0, quota_bytes=3 * MIB)
+    for name in ['first', 'second']:
+        with scratch_space.allocate(name, MIB, reusable=True) as path:
+            write_file(os.path.join(path, f"{name}.mkv"), MIB)
+    with scratch_space.allocate('first', MIB, reusable=True):
+        pass
+
+    # The least recently used artifact is evicted first
+    with scratch_space.allocate('third', 2 * MIB, reusable=True):
+        assert not os.path.exists(tmpdir.join('second'))
+        assert os.path.exists(tmpdir.join('first'))
+        # Artifacts in use are never evicted, and their estimate counts against the quota
+        with pytest.raises(VimeoUploaderInternalServerError):
+            with scratch_space.allocate('fourth', 2 * MIB):
+                pass
+        assert os.path.exists(tmpdir.join('third'))
+    assert scratch_space.stats['evictions'] == 2
+    assert scratch_space.stats['evicted_bytes'] == 2 * MIB
+    assert not os.path.exists(tmpdir.join('fourth'))
+
+
+def test_scratch_space_leftovers(tmpdir) -> None:
+    os.makedirs(tmpdir.join('clip'))
+    write_file(str(tmpdir.join('clip', 'clip.mkv')), MIB)
+
+    # Artifacts of an earlier process are adopted, and can be evicted
+    scratch_space = ScratchSpace(str(tmpdir), reserved_bytes=0, quota_bytes=MIB)
+    with scratch_space.allocate('other', MIB):
+        assert not os.path.exists(tmpdir.join('clip'))
+
+
+def test_scratch_space_stores(tmpdir) -> None:
+    scratch_space = ScratchSpace(
+        str(tmpdir.join('scratch')), reserved_bytes=0, quota_bytes=3 * MIB, stores_root=str(tmpdir.join('stores')))
+    path = scratch_space.get_store_path('jobs.sqlite')
+    assert path == str(tmpdir.join('stores', 'jobs.sqlite'))
+    write_file(path, MIB)
+
+    # The stores count against the quota
+    assert scratch_space.get_free_bytes() == 2 * MIB
+    with pytest.raises(VimeoUploaderInternalServerError):
+        with scratch_space.allocate('clip', 3 * MIB):
+            pass
+    assert os.path.exists(path)
@@ -0,0 +1,42 @@
+import time
+from unittest import mock
+
+from core.generated import model_pb2
+from core.metadata_cache import LocalMetadataStore
+from core.upload_index import UploadIndex
+
+
+def test_upload_index(tmpdir) -> None:
+    """
+    Test indexing uploaded videos by clip and content, and verifying old entries
+    :return: Nothing
+    """
+    upload_index = UploadIndex(LocalMetadataStore(str(tmpdir.join('upload-index'))), verify_after_in_sec=3600)
+    key = upload_index.get_key('account', 'clip', 'sha256')
+    assert key != upload_index.get_key('account', 'other clip', 'sha256')
+    assert key != upload_index.get_key('account', 'clip', 'other sha256')
+    assert key != upload_index.get_key('other account', 'clip', 'sha256')
+    assert upload_index.get(key) is None
+
+    entry = model_pb2.UploadIndexEntry(video_uri='/videos/1', link='https://vimeo.com/1', verified_at=int(time.time()))
+    upload_index.put(key, entry)
+    assert upload_index.get(key) == entry
+    assert not upload_index.needs_verification(entry)
+    entry.verified_at -= 3600
+    assert upload_index.needs_verification(entry)
+
+    upload_index.delete(key)
+    assert upload_index.get(key) is None
+
+
+def test_upload_index_store_failure() -> None:
+    """
+    Test that a failing store reads as a missing entry, so the clip is uploaded
+    :return: Nothing
+    """
+    store = mock.MagicMock()
+    store.get.side_effect = Exception("Access denied")
+    store.put.side_effect = Exception("Access denied")
+    upload_index = UploadIndex(store)
+    assert upload_index.get('key') is None
+    upload_index.put('key', model_pb2.UploadIndexEntry(link='https://vimeo.com/1'))
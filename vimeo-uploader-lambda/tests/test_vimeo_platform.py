@@ -0,0 +1,329 @@
+import json
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import urlparse
+
+import pytest
+
+from core.checkpoints import Checkpointer, get_file_sha256
+from core.exceptions import VimeoUploaderInternalServerError
+from core.metadata_cache import LocalMetadataStore
+from core.upload_index import UploadIndex
+from core.vimeo_platform import VimeoPlatform
+from core.vimeo_session import VimeoSession
+
+
+class FakeVimeoHandler(BaseHTTPRequestHandler):
+    """
+    Fake of the Vimeo API and its tus upload, recording the requests it receives on the server
+    """
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.requests.append(('POST', self.path, self.headers.get('Authorization')))
+        if self.path.startswith('/me/videos'):
+            self.server.created = json.loads(body)
+            self._send_json(201, {
+                'uri': '/videos/1',
+                'link': 'https://vimeo.com/1',
+                'upload': {'upload_link': f"http://{self.headers['Host']}/upload/1"},
+                'metadata': {'connections': {'pictures': {'uri': '/videos/1/pictures'}}},
+            })
+        else:
+            self._send_json(201, {'uri': '/videos/1/pictures/2', 'link': f"http://{self.headers['Host']}/picture/2"})
+
+    def do_PATCH(self) -> None:
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.requests.append(('PATCH', self.path, self.headers.get('Authorization')))
+        if urlparse(self.path).path == '/videos/1':
+            self.server.edited = json.loads(body)
+            self._send_json(200, {'uri': '/videos/1'})
+            return
+        if not self.path.startswith('/upload'):
+            self.server.picture = json.loads(body)
+            self._send_json(200, {})
+            return
+        if int(self.headers['Upload-Offset']) != len(self.server.uploaded):
+            self._send_json(409, {})
+            return
+        if self.server.failures:
+            # Keep half of the chunk, as if the connection dropped midway
+            self.server.failures -= 1
+            self.server.uploaded += body[:len(body) // 2]
+            self._send_json(500, {})
+            return
+        self.server.uploaded += body
+        self.send_response(204)
+        self.send_header('Upload-Offset', str(len(self.server.uploaded)))
+        self.end_headers()
+
+    def do_HEAD(self) -> None:
+        self.send_response(200)
+        self.send_header('Upload-Offset', str(len(self.server.uploaded)))
+        self.end_headers()
+
+    def do_GET(self) -> None:
+        self.server.requests.append(('GET', self.path, self.headers.get('Authorization')))
+        if self.server.deleted:
+            self._send_json(404, {})
+        elif self.server.forbidden:
+            self._send_json(403, {})
+        else:
+            self._send_json(200, {'uri': '/videos/1', 'name': 'renamed on vimeo', 'status': 'available'})
+
+    def do_PUT(self) -> None:
+        self.server.requests.append(('PUT', self.path, self.headers.get('Authorization')))
+        self.server.picture_data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self._send_json(200, {})
+
+    def _send_json(self, status: int, data: dict) -> None:
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeVimeoHandler)
+    server.requests = []
+    server.uploaded = b''
+    server.failures = 0
+    server.deleted = False
+    server.forbidden = False
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def video_path():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'combined.mp4')
+        with open(path, 'wb') as file:
+            file.write(os.urandom(1000))
+        yield path
+
+
+def test_upload_video_to_vimeo(video_path) -> None:
+    """
+    Test uploading video to vimeo using mock client
+    :return: Nothing
+    """
+    session = mock.MagicMock()
+    upload_url = "https://vimeo.com/video_id"
+    session.create_video.return_value = {
+        'uri': '/videos/video_id',
+        'link': upload_url,
+        'upload': {'upload_link': 'https://upload.vimeo.com/video_id'},
+        'metadata': {'connections': {'pictures': {'uri': '/videos/video_id/pictures'}}},
+    }
+    video_title = "video title"
+    thumbnail_image_data = b'image'
+
+    platform = VimeoPlatform(session)
+    assert platform.upload_video(
+        video_path,
+        video_title,
+        thumbnail_image_data) == upload_url
+
+    create_data_json = {
+        'name': video_title,
+        'privacy': {
+            'comments': 'nobody'
+        }
+    }
+
+    session.create_video.assert_called_with(1000, create_data_json)
+    assert session.upload.call_args.args[0] == 'https://upload.vimeo.com/video_id'
+    session.upload_picture.assert_called_with(
+        '/videos/video_id/pictures', thumbnail_image_data)
+
+
+def test_upload_video_to_vimeo_tus(server, video_path) -> None:
+    """
+    Test uploading video to vimeo in chunks, with the title set when creating the video
+    :return: Nothing
+    """
+    session = VimeoSession('token', api_root=f"http://127.0.0.1:{server.server_port}", chunk_size=300)
+    fractions = []
+    upload_url = VimeoPlatform(session).upload_video(video_path, 'video title', b'image', fractions.append)
+
+    assert upload_url == 'https://vimeo.com/1'
+    assert server.created == {
+        'name': 'video title',
+        'privacy': {'comments': 'nobody'},
+        'upload': {'approach': 'tus', 'size': 1000},
+    }
+    with open(video_path, 'rb') as file:
+        assert server.uploaded == file.read()
+    assert fractions == [0.3, 0.6, 0.9, 1.0]
+    assert server.picture_data == b'image'
+    assert server.picture == {'active': True}
+    assert [request[:2] for request in server.requests] == [
+        ('POST', '/me/videos?fields=uri%2Clink%2Cupload.upload_link%2Cmetadata.connections.pictures.uri'),
+        ('PATCH', '/upload/1'),
+        ('PATCH', '/upload/1'),
+        ('PATCH', '/upload/1'),
+        ('PATCH', '/upload/1'),
+        ('POST', '/videos/1/pictures?fields=uri%2Clink'),
+        ('PUT', '/picture/2'),
+        ('PATCH', '/videos/1/pictures/2'),
+    ]
+    # The token is sent to the API only
+    assert [urlparse(request[1]).path for request in server.requests if request[2] is None] == ['/upload/1'] * 4
+
+
+def test_upload_video_to_vimeo_resumes_chunk(server, video_path) -> None:
+    """
+    Test resuming a failed chunk from the offset the server has
+    :return: Nothing
+    """
+    server.failures = 2
+    session = VimeoSession('token', api_root=f"http://127.0.0.1:{server.server_port}", chunk_size=300)
+
+    VimeoPlatform(session).upload_video(video_path, 'video title')
+
+    with open(video_path, 'rb') as file:
+        assert server.uploaded == file.read()
+
+
+def test_upload_video_to_vimeo_failure(server, video_path) -> None:
+    """
+    Test failing the upload once every attempt at a chunk failed
+    :return: Nothing
+    """
+    server.failures = 3
+    session = VimeoSession('token', api_root=f"http://127.0.0.1:{server.server_port}", chunk_size=300)
+
+    with pytest.raises(VimeoUploaderInternalServerError):
+        VimeoPlatform(session).upload_video(video_path, 'video title')
+
+
+def test_upload_video_to_vimeo_from_url(server) -> None:
+    """
+    Test uploading video to vimeo by having vimeo pull it from a URL
+    :return: Nothing
+    """
+    session = VimeoSession('token', api_root=f"http://127.0.0.1:{server.server_port}")
+
+    upload_url = VimeoPlatform(session).upload_video_from_url('https://s3.amazon.com/clip', 1000, 'video title')
+
+    assert upload_url == 'https://vimeo.com/1'
+    assert server.created == {
+        'name': 'video title',
+        'privacy': {'comments': 'nobody'},
+        'upload': {'approach': 'pull', 'link': 'https://s3.amazon.com/clip', 'size': 1000},
+    }
+    assert server.uploaded == b''
+
+
+def test_upload_video_to_vimeo_resumes_upload(server, video_path, tmpdir) -> None:
+    """
+    Test resuming the upload of a failed attempt from its checkpoint, without creating the video again
+    :return: Nothing
+    """
+    server.failures = 3
+    session = VimeoSession('token', api_root=f"http://127.0.0.1:{server.server_port}", chunk_size=300)
+    checkpointer = Checkpointer(LocalMetadataStore(str(tmpdir.join('checkpoints'))), 'clip')
+    with pytest.raises(VimeoUploaderInternalServerError):
+        VimeoPlatform(session).upload_video(video_path, 'video title', checkpoint=checkpointer.stage('upload'))
+    assert checkpointer.get('upload').upload_id.endswith('/upload/1')
+
+    upload_url = VimeoPlatform(session).upload_video(
+        video_path, 'video title', b'image', checkpoint=checkpointer.stage('upload'))
+
+    assert upload_url == 'https://vimeo.com/1'
+    with open(video_path, 'rb') as file:
+        assert server.uploaded == file.read()
+    assert server.picture_data == b'image'
+    assert [request[:2] for request in server.requests].count(
+        ('POST', '/me/videos?fields=uri%2Clink%2Cupload.upload_link%2Cmetadata.connections.pictures.uri')) == 1
+
+
+def test_vimeo_target_profile(monkeypatch) -> None:
+    """
+    Test the profile of the videos uploaded to Vimeo, capped at 1080p by default
+    :return: Nothing
+    """
+    target_profile = VimeoPlatform().get_target_profile()
+    assert target_profile.max_height == 1080
+    assert target_profile.container == 'mp4'
+    assert not target_profile.max_bytes
+
+    monkeypatch.setenv('VIMEO_MAX_HEIGHT', '2160')
+    monkeypatch.setenv('VIMEO_VIDEO_CODECS', 'h264,av1')
+    monkeypatch.setenv('VIMEO_MAX_DOWNLOAD_SIZE_IN_MB', '100')
+    target_profile = VimeoPlatform().get_target_profile()
+    assert target_profile.max_height == 2160
+    assert list(target_profile.video_codecs) == ['h264', 'av1']
+    assert target_profile.max_bytes == 100 * 1024 * 1024
+
+
+def test_upload_video_to_vimeo_dedup(server, video_path, tmpdir) -> None:
+    """
+    Test reusing the video uploaded from the same clip, only renaming it, and uploading the clip again once the indexed
+    video is deleted from the account
+    :return: Nothing
+    """
+    session = VimeoSession('token', api_root=f"http://127.0.0.1:{server.server_port}", chunk_size=300)
+    upload_index = UploadIndex(LocalMetadataStore(str(tmpdir.join('upload-index'))))
+    platform = VimeoPlatform(session, upload_index=upload_index)
+    create = ('POST', '/me/videos?fields=uri%2Clink%2Cupload.upload_link%2Cmetadata.connections.pictures.uri')
+
+    assert platform.upload_video(video_path, 'video title', clip_key='clip') == 'https://vimeo.com/1'
+    fractions = []
+    assert platform.upload_video(
+        video_path, 'other title', progress_callback=fractions.append, clip_key='clip') == 'https://vimeo.com/1'
+    assert [request[:2] for request in server.requests].count(create) == 1
+    assert server.edited == {'name': 'other title', 'privacy': {'comments': 'nobody'}}
+    assert fractions == [1.0]
+
+    # The same file processed from another clip is uploaded on its own
+    server.uploaded = b''
+    platform.upload_video(video_path, 'video title', clip_key='other clip')
+    assert [request[:2] for request in server.requests].count(create) == 2
+
+    # Another account sharing the index does not reuse the video of this one
+    server.uploaded = b''
+    other_session = VimeoSession('other token', api_root=f"http://127.0.0.1:{server.server_port}", chunk_size=300)
+    VimeoPlatform(other_session, upload_index=upload_index).upload_video(video_path, 'video title', clip_key='clip')
+    assert [request[:2] for request in server.requests].count(create) == 3
+
+    # A hash already known to the caller finds the same entry without hashing the file again
+    with mock.patch('core.vimeo_platform.get_file_sha256') as file_sha256:
+        assert platform.upload_video(
+            video_path, 'video title', clip_key='clip', video_sha256=get_file_sha256(video_path)) == 'https://vimeo.com/1'
+        file_sha256.assert_not_called()
+    assert [request[:2] for request in server.requests].count(create) == 3
+
+    # Entries are checked against the account once they are old enough
+    server.requests.clear()
+    upload_index.verify_after_in_sec = 0
+    assert platform.upload_video(video_path, 'renamed on vimeo', clip_key='clip') == 'https://vimeo.com/1'
+    assert [request[:2] for request in server.requests] == [('GET', '/videos/1?fields=uri%2Cname%2Cstatus')]
+
+    # A video the app is forbidden to see may still be on the account, so its entry is kept
+    server.forbidden = True
+    server.uploaded = b''
+    with mock.patch.object(upload_index, 'delete') as delete:
+        platform.upload_video(video_path, 'renamed on vimeo', clip_key='clip')
+        delete.assert_not_called()
+    assert [request[:2] for request in server.requests].count(create) == 1
+    server.forbidden = False
+
+    server.requests.clear()
+    server.deleted = True
+    server.uploaded = b''
+    platform.upload_video(video_path, 'video title', clip_key='clip')
+    assert [request[:2] for request in server.requests].count(create) == 1
@@ -0,0 +1,598 @@
+import os
+import time
+from os.path import exists
+from unittest import mock
+
+import pytest
+import yt_dlp
+from moviepy.video.io.VideoFileClip import VideoFileClip
+
+from core.exceptions import VimeoUploaderInternalServerError
+from core.generated import model_pb2
+from core.metrics import Metrics
+from core.youtube_platform import EXTRACTED_INFO_TTL_IN_SEC, YOUTUBE_URL_PREFIX, DownloadProgressTracker, YouTubePlatform
+
+
+def test_youtube_platform_get_video_metadata() -> None:
+    platform = YouTubePlatform()
+    video_metadata = platform.get_video_metadata("XsX3ATc3FbA")
+
+    assert video_metadata.video_id == "XsX3ATc3FbA"
+    assert video_metadata.title == "BTS (방탄소년단) '작은 것들을 위한 시 (Boy With Luv) (feat. Halsey)' Official MV"
+    assert video_metadata.author == "HYBE LABELS"
+    assert video_metadata.length_in_sec == 253
+    assert video_metadata.publish_date == "2019-04-12"
+
+
+@mock.patch('core.youtube_platform.yt_dlp.YoutubeDL')
+def test_youtube_platform_get_videos_metadata(mock_youtube_dl) -> None:
+    """
+    Test looking up many videos with a shared extractor, reporting the error of the videos which failed
+    :return: Nothing
+    """
+    ydl = mock_youtube_dl.return_value.__enter__.return_value
+    ydl.sanitize_info.side_effect = lambda info: info
+
+    def extract_info(url, download, process):
+        video_id = url.split('=')[-1]
+        if video_id == 'missing':
+            raise yt_dlp.utils.DownloadError('Video unavailable')
+        return {'id': video_id, 'title': 'title', 'uploader': 'uploader', 'duration': 60, 'upload_date': '20190412'}
+
+    ydl.extract_info.side_effect = extract_info
+    ydl.process_ie_result.side_effect = lambda info, download: info
+
+    platform = YouTubePlatform()
+    videos_metadata = platform.get_videos_metadata(['first', 'missing', 'second'])
+
+    mock_youtube_dl.assert_called_once()
+    assert [video_metadata.video_id for video_metadata in videos_metadata] == ['first', 'missing', 'second']
+    assert videos_metadata[0].publish_date == '2019-04-12'
+    assert not videos_metadata[0].error
+    assert 'Video unavailable' in videos_metadata[1].error
+
+
+@mock.patch('core.youtube_platform.yt_dlp.YoutubeDL')
+def test_youtube_platform_reuse_extracted_info(mock_youtube_dl) -> None:
+    """
+    Test downloading with the info extracted by the metadata lookup, processing it again instead of re-extracting
+    :return: Nothing
+    """
+    ydl = mock_youtube_dl.return_value.__enter__.return_value
+    ydl.params = {}
+    ydl.dl.return_value = (True, True)
+    ydl.sanitize_info.side_effect = lambda info: info
+    ydl.extract_info.return_value = {
+        'id': 'video_id', 'title': 'title', 'uploader': 'uploader', 'duration': 3600, 'upload_date': '20190412'}
+    ydl.process_ie_result.side_effect = lambda info, download: {
+        **info, 'requested_formats': [{'format_id': '18', 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'mp4a'}]}
+
+    platform = YouTubePlatform(range_download=False)
+    platform.get_video_metadata('video_id')
+    platform.download_video('video_id', 600, 660, '/tmp/video_id', 'video')
+
+    ydl.extract_info.assert_called_once_with(YOUTUBE_URL_PREFIX + 'video_id', download=False, process=False)
+    # The reused info is a copy of the extraction, which processing does not change
+    assert ydl.process_ie_result.call_args.args[0] == ydl.extract_info.return_value
+    assert ydl.process_ie_result.call_args.args[0] is not ydl.extract_info.return_value
+
+    with mock.patch('core.youtube_platform.time.monotonic', return_value=time.monotonic() + EXTRACTED_INFO_TTL_IN_SEC):
+        platform.get_video_metadata('video_id')
+    assert ydl.extract_info.call_count == 2
+
+
+def test_download_youtube_resources_short(tmpdir) -> None:
+    """
+    Test download short resources from YouTube, merging the video/audio, then trimming.
+    :return: Nothing
+    """
+    # BTS (방탄소년단) '작은 것들을 위한 시 (Boy With Luv) (feat. Halsey)' Official MV
+    _test_download_youtube_resources(
+        tmpdir, "XsX3ATc3FbA", 60, 120, 60)
+
+
+def test_download_youtube_resources_long(tmpdir) -> None:
+    """
+    Test download long resources from YouTube, merging the video/audio, then trimming.
+    :return: Nothing
+    """
+    # [LIVE] 로스트아크 특별 방송 | 19:30 ON AIR
+    _test_download_youtube_resources(
+        tmpdir, "Xofxcgkag1M", 900, 2700, 1800)
+
+
+def _test_download_youtube_resources(
+        tmpdir,
+        video_id: str,
+        start_time_in_sec: int,
+        end_time_in_sec: int,
+        length_in_sec: int) -> None:
+    """
+    Helper test function for downloading YouTube videos
+    :param tmpdir: Temporary test directory
+    :param video_id: Test video ID
+    :param start_time_in_sec: Start time of trim in seconds
+    :param end_time_in_sec: End time of trim in seconds
+    :param length_in_sec: Length for the test video
+    """
+    platform = YouTubePlatform()
+    platform.download_video(
+        video_id,
+        start_time_in_sec,
+        end_time_in_sec,
+        tmpdir,
+        "video")
+
+    expected_video_path = os.path.join(tmpdir, "video.mkv")
+    assert exists(expected_video_path)
+    video = VideoFileClip(expected_video_path)
+    assert int(video.duration) == length_in_sec
+    assert int(video.audio.duration) == length_in_sec
+
+
+@mock.patch('core.youtube_platform.FFmpegFD.can_download', return_value=True)
+@mock.patch('core.youtube_platform.yt_dlp.YoutubeDL')
+def test_download_youtube_range(mock_youtube_dl, _) -> None:
+    """
+    Test downloading only the padded time range of the video, when the format supports it
+    :return: Nothing
+    """
+    ydl = mock_youtube_dl.return_value.__enter__.return_value
+    ydl.params = {}
+    ydl.extract_info.return_value = {
+        'id': 'video_id',
+        'duration': 3600,
+        'protocol': 'https+https',
+        'requested_formats': [{'filesize': 900_000}, {'filesize_approx': 100_000}]
+    }
+
+    def process_ie_result(info, download):
+        if download:
+            progress_hook = mock_youtube_dl.call_args.args[0]['progress_hooks'][0]
+            progress_hook({'status': 'finished', 'total_bytes': 50_000})
+        return info
+
+    ydl.process_ie_result.side_effect = process_ie_result
+
+    platform = YouTubePlatform()
+    download_result = platform.download_video(
+        'video_id', 600, 660, '/tmp/video_id', 'video')
+
+    assert ydl.params['download_ranges'].ranges == [(590, 670)]
+    assert ydl.params['external_downloader_args'] == {'ffmpeg_o': ['-copyts']}
+    trim_pp = ydl.add_post_processor.call_args.args[0]
+    assert isinstance(trim_pp, YouTubePlatform.FFmpegTrimPP)
+    assert trim_pp.start_time_in_sec == 600
+    assert trim_pp.end_time_in_sec == 660
+    assert download_result.downloaded
+    assert download_result.mode == model_pb2.DOWNLOAD_MODE_RANGE
+    assert download_result.bytes_downloaded == 50_000
+    assert download_result.bytes_avoided == 950_000
+
+
+@mock.patch('core.youtube_platform.FFmpegFD.can_download', return_value=True)
+@mock.patch('core.youtube_platform.yt_dlp.YoutubeDL')
+def test_estimate_youtube_download_size(mock_youtube_dl, _) -> None:
+    """
+    Test estimating the disk space of a download from the size of the selected formats, for the padded time range
+    when only the range is downloaded
+    :return: Nothing
+    """
+    ydl = mock_youtube_dl.return_value.__enter__.return_value
+    ydl.extract_info.return_value = {
+        'id': 'video_id',
+        'duration': 3600,
+        'protocol': 'https+https',
+        'requested_formats': [{'filesize': 900_000}, {'filesize_approx': 100_000}]
+    }
+    ydl.process_ie_result.side_effect = lambda info, download: info
+
+    assert YouTubePlatform().estimate_download_size('video_id', 600, 660) == 38_888
+    assert YouTubePlatform(range_download=False).estimate_download_size('video_id', 600, 660) == 1_016_666
+    assert YouTubePlatform(extracted_info_ttl_in_sec=0).estimate_download_size('video_id', 600, 660) == 0
+
+
+@mock.patch('core.youtube_platform.Popen')
+@mock.patch.object(YouTubePlatform.FFmpegStreamTrimPP, 'executable', new_callable=mock.PropertyMock,
+                   return_value='ffmpeg')
+@mock.patch('core.youtube_platform.FFmpegFD.can_download', return_value=True)
+@mock.patch('core.youtube_platform.yt_dlp.YoutubeDL')
+def test_stream_youtube_video(mock_youtube_dl, _, __, mock_popen) -> None:
+    """
+    Test streaming the trimmed video from ffmpeg reading the formats straight from their URLs
+    :return: Nothing
+    """
+    ydl = mock_youtube_dl.return_value.__enter__.return_value
+    ydl.extract_info.return_value = {
+        'id': 'video_id',
+        'protocol': 'https+https',
+        'requested_formats': [
+            {'url': 'https://video', 'vcodec': 'avc1', 'acodec': 'none', 'http_headers': {'User-Agent': 'yt-dlp'}},
+            {'url': 'https://audio', 'vcodec': 'none', 'acodec': 'mp4a'},
+        ]
+    }
+    ydl.process_ie_result.side_effect = lambda info, download: info
+    process = mock_popen.return_value
+    process.stdout.readinto.side_effect = [4, 0]
+    process.poll.return_value = None
+    process.wait.return_value = 0
+
+    with YouTubePlatform().stream_video('video_id', 600, 660) as stream:
+        assert stream.readinto(bytearray(8)) == 4
+        assert stream.readinto(bytearray(8)) == 0
+
+    assert mock_popen.call_args.args[0] == [
+        'ffmpeg', '-y', '-loglevel', 'error', '-nostdin',
+        '-headers', 'User-Agent: yt-dlp\r\n', '-ss', '600', '-to', '660', '-i', 'https://video',
+        '-ss', '600', '-to', '660', '-i', 'https://audio',
+        '-c', 'copy', '-map', '0:v:0?', '-map', '1:a:0?', '-f', 'matroska', 'pipe:1']
+    # ffmpeg is stopped when the stream is closed
+    process.kill.assert_called_once()
+
+
+def test_stream_youtube_video_smart_trim() -> None:
+    """
+    Test that smart cut trims cannot be streamed
+    :return: Nothing
+    """
+    with pytest.raises(VimeoUploaderInternalServerError):
+        with YouTubePlatform().stream_video('video_id', 600, 660, model_pb2.TRIM_MODE_SMART):
+            pass
+
+
+@mock.patch('core.youtube_platform.FFmpegFD.can_download')
+@mock.patch('core.youtube_platform.yt_dlp.YoutubeDL')
+def test_can_stream_youtube_video(mock_youtube_dl, mock_can_download) -> None:
+    """
+    Test that only stream copy trims of formats ffmpeg can read are streamed
+    :return: Nothing
+    """
+    ydl = mock_youtube_dl.return_value.__enter__.return_value
+    ydl.extract_info.return_value = {'id': 'video_id', 'protocol': 'https+https'}
+    ydl.process_ie_result.side_effect = lambda info, download: info
+    platform = YouTubePlatform(extracted_info_ttl_in_sec=0)
+
+    mock_can_download.return_value = True
+    assert platform.can_stream_video('video_id')
+    assert not platform.can_stream_video('video_id', model_pb2.TRIM_MODE_SMART)
+    mock_can_download.return_value = False
+    assert not platform.can_stream_video('video_id')
+    ydl.extract_info.side_effect = Exception("Video unavailable")
+    assert not platform.can_stream_video('video_id')
+
+
+@mock.patch('core.youtube_platform.yt_dlp.YoutubeDL')
+def test_download_youtube_range_fallback(mock_youtube_dl) -> None:
+    """
+    Test falling back to downloading the whole formats when they cannot be partially downloaded, then merging and
+    trimming them in a single pass
+    :return: Nothing
+    """
+    ydl = mock_youtube_dl.return_value.__enter__.return_value
+    ydl.params = {}
+    ydl.dl.return_value = (True, True)
+    ydl.extract_info.return_value = {
+        'id': 'video_id',
+        'duration': 3600,
+        'protocol': 'https+https',
+        'is_live': True,
+        'requested_formats': [
+            {'format_id': '137', 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'none'},
+            {'format_id': '140', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a'}
+        ]
+    }
+    ydl.process_ie_result.side_effect = lambda info, download: info
+
+    platform = YouTubePlatform()
+    download_result = platform.download_video(
+        'video_id', 600, 660, '/tmp/video_id', 'video')
+
+    assert 'download_ranges' not in ydl.params
+    ydl.add_post_processor.assert_not_called()
+    assert [c.args[0] for c in ydl.dl.call_args_list] == [
+        '/tmp/video_id/video.f137.mp4', '/tmp/video_id/video.f140.m4a']
+    merge_trim_pp, information = ydl.run_pp.call_args.args
+    assert merge_trim_pp.start_time_in_sec == 600
+    assert merge_trim_pp.end_time_in_sec == 660
+    assert information['filepath'] == '/tmp/video_id/video.mkv'
+    assert information['__files_to_merge'] == [
+        '/tmp/video_id/video.f137.mp4', '/tmp/video_id/video.f140.m4a']
+    assert download_result.mode == model_pb2.DOWNLOAD_MODE_FULL
+    assert download_result.bytes_avoided == 0
+
+
+def test_merge_trim_single_pass() -> None:
+    """
+    Test merging and trimming with input side seeking in a single ffmpeg invocation
+    :return: Nothing
+    """
+    merge_trim_pp = YouTubePlatform.FFmpegMergeTrimPP(600, 660)
+    files_to_merge = ['/tmp/video.f137.mp4', '/tmp/video.f140.m4a']
+    with mock.patch.object(merge_trim_pp, 'real_run_ffmpeg') as real_run_ffmpeg:
+        files_to_delete, _ = merge_trim_pp.run({
+            'filepath': '/tmp/video.mkv',
+            'requested_formats': [
+                {'vcodec': 'avc1', 'acodec': 'none', 'protocol': 'https'},
+                {'vcodec': 'none', 'acodec': 'mp4a', 'protocol': 'https'}
+            ],
+            '__files_to_merge': files_to_merge
+        })
+
+    input_opts = ['-seek_timestamp', '1', '-ss', '600', '-to', '660']
+    real_run_ffmpeg.assert_called_once_with(
+        [(files_to_merge[0], input_opts), (files_to_merge[1], input_opts)],
+        [('/tmp/video.mkv', ['-c', 'copy', '-map', '0:v:0?', '-map', '1:a:0?'])])
+    assert files_to_delete == files_to_merge
+
+
+def test_multi_trim_single_invocation() -> None:
+    """
+    Test cutting every clip out of the downloaded files in a single ffmpeg invocation with an output per clip
+    :return: Nothing
+    """
+    multi_trim_pp = YouTubePlatform.FFmpegMultiTrimPP(
+        [(600, 660, '/tmp/video_600_660.mkv'), (900, 930, '/tmp/video_900_930.mkv')])
+    files_to_merge = ['/tmp/video.f137.mp4', '/tmp/video.f140.m4a']
+    with mock.patch.object(multi_trim_pp, 'real_run_ffmpeg') as real_run_ffmpeg:
+        files_to_delete, _ = multi_trim_pp.run({
+            'filepath': '/tmp/video.mkv',
+            'requested_formats': [
+                {'vcodec': 'avc1', 'acodec': 'none', 'protocol': 'https'},
+                {'vcodec': 'none', 'acodec': 'mp4a', 'protocol': 'https'}
+            ],
+            '__files_to_merge': files_to_merge
+        })
+
+    first_opts = ['-seek_timestamp', '1', '-ss', '600', '-to', '660']
+    second_opts = ['-seek_timestamp', '1', '-ss', '900', '-to', '930']
+    real_run_ffmpeg.assert_called_once_with(
+        [(files_to_merge[0], first_opts), (files_to_merge[1], first_opts),
+         (files_to_merge[0], second_opts), (files_to_merge[1], second_opts)],
+        [('/tmp/video_600_660.mkv', ['-c', 'copy', '-map', '0:v:0?', '-map', '1:a:0?']),
+         ('/tmp/video_900_930.mkv', ['-c', 'copy', '-map', '2:v:0?', '-map', '3:a:0?'])])
+    assert files_to_delete == files_to_merge
+
+
+@mock.patch('core.youtube_platform.FFmpegFD.can_download', return_value=True)
+@mock.patch('core.youtube_platform.yt_dlp.YoutubeDL')
+def test_download_youtube_clips(mock_youtube_dl, _) -> None:
+    """
+    Test downloading the range covering all the clips once, then cutting the clips out of it
+    :return: Nothing
+    """
+    ydl = mock_youtube_dl.return_value.__enter__.return_value
+    ydl.params = {}
+    ydl.extract_info.return_value = {'id': 'video_id', 'duration': 3600, 'protocol': 'https'}
+    ydl.process_ie_result.side_effect = lambda info, download: info
+
+    platform = YouTubePlatform()
+    download_result = platform.download_clips(
+        'video_id', [(600, 660), (900, 930)], '/tmp/video_id', ['video_600_660.mkv', 'video_900_930.mkv'])
+
+    assert mock_youtube_dl.call_args.args[0]['outtmpl'] == '/tmp/video_id/video_id.source.mkv'
+    assert ydl.params['download_ranges'].ranges == [(590, 940)]
+    multi_trim_pp = ydl.add_post_processor.call_args.args[0]
+    assert isinstance(multi_trim_pp, YouTubePlatform.FFmpegMultiTrimPP)
+    assert multi_trim_pp.clips == [
+        (600, 660, '/tmp/video_id/video_600_660.mkv'), (900, 930, '/tmp/video_id/video_900_930.mkv')]
+    ydl.process_ie_result.assert_called_with(ydl.extract_info.return_value, download=True)
+    assert download_result.mode == model_pb2.DOWNLOAD_MODE_RANGE
+
+
+@mock.patch('core.youtube_platform.FFmpegFD.can_download', return_value=True)
+@mock.patch('core.youtube_platform.yt_dlp.YoutubeDL')
+def test_download_youtube_smart_trim(mock_youtube_dl, _) -> None:
+    """
+    Test selecting the frame accurate smart cut for the trim
+    :return: Nothing
+    """
+    ydl = mock_youtube_dl.return_value.__enter__.return_value
+    ydl.params = {}
+    ydl.extract_info.return_value = {'id': 'video_id', 'duration': 3600, 'protocol': 'https'}
+    ydl.process_ie_result.side_effect = lambda info, download: info
+
+    platform = YouTubePlatform()
+    platform.download_video(
+        'video_id', 600, 660, '/tmp/video_id', 'video', model_pb2.TRIM_MODE_SMART)
+
+    trim_pp = ydl.add_post_processor.call_args.args[0]
+    assert isinstance(trim_pp, YouTubePlatform.FFmpegSmartTrimPP)
+    assert trim_pp.start_time_in_sec == 600
+    assert trim_pp.end_time_in_sec == 660
+
+
+def test_trim_metrics() -> None:
+    """
+    Test recording the run of the trim post processor from the progress yt-dlp reports for it
+    :return: Nothing
+    """
+    class TrimPP(yt_dlp.postprocessor.PostProcessor):
+        def run(self, information):
+            return [], information
+
+    metrics = Metrics()
+    trim_pp = TrimPP()
+    YouTubePlatform._add_trim_metrics(trim_pp, metrics)
+    trim_pp.run({'id': 'video_id'})
+
+    assert [stage_metrics.stage for stage_metrics in metrics.get_stage_metrics()] == ['trim']
+
+
+def test_smart_trim_segments() -> None:
+    """
+    Test splitting the smart cut into re-encoded partial GOPs and the stream copied GOPs in between
+    :return: Nothing
+    """
+    smart_trim_pp = YouTubePlatform.FFmpegSmartTrimPP(41.5, 72.5)
+    keyframes = [40.0, 45.0, 50.0, 55.0, 60.0, 65.0, 70.0, 75.0]
+    assert smart_trim_pp._get_segments(keyframes) == [
+        (41.5, 45.0, True), (45.0, 70.0, False), (70.0, 72.5, True)]
+
+    smart_trim_pp = YouTubePlatform.FFmpegSmartTrimPP(45, 70)
+    assert smart_trim_pp._get_segments(keyframes) == [(45, 70, False)]
+
+    smart_trim_pp = YouTubePlatform.FFmpegSmartTrimPP(41.5, 48.5)
+    assert smart_trim_pp._get_segments(keyframes) == [(41.5, 48.5, True)]
+
+
+def test_download_progress_tracker() -> None:
+    """
+    Test reporting the downloaded fraction across the video and audio files of the download
+    :return: Nothing
+    """
+    progress_callback = mock.MagicMock()
+    progress_tracker = DownloadProgressTracker(progress_callback)
+    progress_tracker.hook({'status': 'downloading', 'filename': 'video', 'downloaded_bytes': 30, 'total_bytes': 60})
+    progress_tracker.hook({'status': 'finished', 'filename': 'video', 'total_bytes': 60})
+    progress_tracker.hook({'status': 'downloading', 'filename': 'audio', 'downloaded_bytes': 10, 'total_bytes': 40})
+    # Without a size, the fraction is unknown
+    progress_tracker.hook({'status': 'downloading', 'filename': 'other', 'downloaded_bytes': 10})
+
+    assert progress_callback.call_args_list == [mock.call(0.5), mock.call(1.0), mock.call(0.7)]
+    assert progress_tracker.bytes_downloaded == 60
+
+
+def test_select_youtube_formats_for_target_profile() -> None:
+    """
+    Test selecting the formats of the target profile out of the extracted formats, and reporting them in the result
+    :return: Nothing
+    """
+    formats = [
+        {'format_id': '18', 'ext': 'mp4', 'vcodec': 'avc1.42001E', 'acodec': 'mp4a.40.2', 'height': 360,
+         'filesize': 20_000_000},
+        {'format_id': '140', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'filesize': 6_000_000},
+        {'format_id': '137', 'ext': 'mp4', 'vcodec': 'avc1.640028', 'acodec': 'none', 'height': 1080,
+         'filesize': 180_000_000},
+        {'format_id': '313', 'ext': 'webm', 'vcodec': 'vp9', 'acodec': 'none', 'height': 2160,
+         'filesize': 900_000_000},
+    ]
+    info = {
+        'id': 'video_id',
+        'title': 'title',
+        'duration': 600,
+        'extractor': 'youtube',
+        'extractor_key': 'Youtube',
+        'webpage_url': YOUTUBE_URL_PREFIX + 'video_id',
+        'formats': [{**fmt, 'url': f"https://example.com/{fmt['format_id']}", 'protocol': 'https'} for fmt in formats],
+    }
+    platform = YouTubePlatform(extracted_info_ttl_in_sec=0)
+    with yt_dlp.YoutubeDL({'format': 'bv*+ba/b', 'quiet': True}) as ydl, \
+            mock.patch.object(ydl, 'extract_info', return_value=info):
+        best_info = platform._extract_info(ydl, 'video_id')
+    with yt_dlp.YoutubeDL({'format': 'bv*+ba/b', 'quiet': True}) as ydl, \
+            mock.patch.object(ydl, 'extract_info', return_value=info):
+        target_info = platform._extract_info(
+            ydl, 'video_id', model_pb2.TargetProfile(max_height=1080, container='mp4'))
+
+    assert best_info['format_id'] == '313+140'
+    assert target_info['format_id'] == '137+140'
+    download_result = platform._get_download_result(
+        'video_id', target_info, model_pb2.DOWNLOAD_MODE_FULL, DownloadProgressTracker())
+    assert download_result.format_id == '137+140'
+    assert download_result.estimated_size_in_bytes == 186_000_000
+    assert platform.get_clip_options(model_pb2.TRIM_MODE_COPY)['format'] == 'bv*+ba/b'
+    assert platform.get_clip_options(
+        model_pb2.TRIM_MODE_COPY, model_pb2.TargetProfile(max_height=1080))['format'].startswith('max_height=1080;')
+
+
+@mock.patch('core.youtube_platform.os.cpu_count', return_value=2)
+def test_get_download_segments(_) -> None:
+    """
+    Test splitting a long section into sub-ranges, as many as the length of the section and the vCPUs allow
+    :return: Nothing
+    """
+    info = {
+        'requested_formats': [
+            {'format_id': '137', 'vcodec': 'avc1', 'acodec': 'none'},
+            {'format_id': '140', 'vcodec': 'none', 'acodec': 'mp4a'}
+        ]
+    }
+    assert YouTubePlatform._get_download_segments(info, 90, 2000) == [
+        (90, 567), (567, 1045), (1045, 1522), (1522, 2000)]
+    assert YouTubePlatform._get_download_segments(info, 100, 400) == [(100, 250), (250, 400)]
+    # Too short to split, or the video and audio in a single format
+    assert YouTubePlatform._get_download_segments(info, 100, 300) == []
+    assert YouTubePlatform._get_download_segments({'format_id': '18'}, 90, 2000) == []
+
+
+@mock.patch('core.youtube_platform.os.path.getsize', return_value=1000)
+@mock.patch('core.youtube_platform.Popen.run')
+@mock.patch.object(YouTubePlatform.FFmpegSegmentedDownloadPP, 'executable', new_callable=mock.PropertyMock,
+                   return_value='ffmpeg')
+def test_segmented_download_retries_segment(_, mock_run, __) -> None:
+    """
+    Test retrying a failed sub-range on its own, keeping the source timestamps
+    :return: Nothing
+    """
+    mock_run.side_effect = [('', 'Connection reset', 1), ('', '', 0)]
+    progress_tracker = DownloadProgressTracker()
+    segmented_download_pp = YouTubePlatform.FFmpegSegmentedDownloadPP([(90, 400), (400, 710)])
+    fmt = {'format_id': '137', 'url': 'https://example.com/137', 'filesize': 7_100_000}
+
+    path = segmented_download_pp._download_segment(fmt, 400, 710, '/tmp/video1.mkv', '0:v:0', 710, progress_tracker)
+
+    assert path == '/tmp/video1.mkv'
+    assert mock_run.call_count == 2
+    cmd = mock_run.call_args.args[0]
+    assert cmd[cmd.index('-i') - 5:cmd.index('-i') + 2] == [
+        '-copyts', '-ss', '400', '-to', '710', '-i', 'https://example.com/137']
+    assert progress_tracker.bytes_downloaded == 1000
+
+    mock_run.side_effect = [('', 'Connection reset', 1)] * 3
+    with pytest.raises(yt_dlp.utils.PostProcessingError):
+        segmented_download_pp._download_segment(fmt, 400, 710, '/tmp/video1.mkv', '0:v:0', 710, progress_tracker)
+
+
+@mock.patch('core.youtube_platform.FFmpegFD.can_download', return_value=True)
+@mock.patch('core.youtube_platform.yt_dlp.YoutubeDL')
+def test_download_youtube_tuning_and_stats(mock_youtube_dl, _) -> None:
+    """
+    Test applying the tuning of the request over the tuning of the deployment, and reporting the statistics of the
+    download with the tuning it was made with
+    :return: Nothing
+    """
+    ydl = mock_youtube_dl.return_value.__enter__.return_value
+    ydl.params = {}
+    ydl.extract_info.return_value = {
+        'id': 'video_id',
+        'duration': 3600,
+        'protocol': 'https+https',
+        'requested_formats': [{'filesize': 900_000}, {'filesize_approx': 100_000}]
+    }
+
+    def process_ie_result(info, download):
+        if download:
+            ydl_opts = mock_youtube_dl.call_args.args[0]
+            progress_hook = ydl_opts['progress_hooks'][0]
+            progress_hook({'status': 'downloading', 'filename': 'video', 'speed': 2_000_000, 'eta': 3,
+                           'fragment_index': 1})
+            ydl_opts['logger'].debug('[download] Got error: HTTP Error 503. Retrying fragment 2 (1/10)...')
+            progress_hook({'status': 'downloading', 'filename': 'video', 'speed': 5_000_000, 'eta': 1,
+                           'fragment_index': 2})
+            progress_hook({'status': 'finished', 'filename': 'video', 'total_bytes': 50_000})
+        return info
+
+    ydl.process_ie_result.side_effect = process_ie_result
+
+    platform = YouTubePlatform(download_tuning=model_pb2.DownloadTuning(
+        concurrent_fragment_downloads=4, retries=5, external_downloader='aria2c'))
+    download_result = platform.download_video(
+        'video_id', 600, 660, '/tmp/video_id', 'video',
+        download_tuning=model_pb2.DownloadTuning(concurrent_fragment_downloads=8, http_chunk_size=10_485_760))
+
+    ydl_opts = mock_youtube_dl.call_args.args[0]
+    assert ydl_opts['concurrent_fragment_downloads'] == 8
+    assert ydl_opts['http_chunk_size'] == 10_485_760
+    assert ydl_opts['retries'] == 5
+    assert ydl_opts['external_downloader'] == {'dash': 'aria2c', 'm3u8': 'aria2c'}
+    assert 'buffersize' not in ydl_opts
+    download_stats = download_result.download_stats
+    assert download_stats.bytes == 50_000
+    assert download_stats.peak_speed_in_bytes_per_sec == 5_000_000
+    assert download_stats.initial_eta_in_sec == 3
+    assert download_stats.fragments == 2
+    assert download_stats.retries == 1
+    assert download_stats.tuning.concurrent_fragment_downloads == 8
+    assert download_stats.tuning.retries == 5
+    # The tuning of the deployment is left as it is
+    assert platform.download_tuning.concurrent_fragment_downloads == 4